@@ -1,4 +1,20 @@
 import topological_code 
+import simulator
+from lattice import get_geometry, get_toric_geometry, lattice_shape
+from batch_code import new_batch_code
+from itertools import combinations
+from results_store import results_store
+import error_models
+import weight_tables
+import benchmark
+import analysis
+import peeling
+import job_queue
+import decoding
+import differential
+from profiling import stage_profiler
+import tempfile
+import os
 import numpy as np
 from math import ceil
 
@@ -42,13 +58,14 @@ class LogicalErrorTester(UnitTester):
             self.passed = False
 
 class DecoderTester(UnitTester):
-    def __init__(self, size, code_type, description, outcome, X_error_list, Z_error_list, erasure_list, verbose = False):
+    def __init__(self, size, code_type, description, outcome, X_error_list, Z_error_list, erasure_list, verbose = False, method = "tree"):
         super().__init__(size, code_type, description, outcome)
         self.X_errors = X_error_list
         self.Z_errors = Z_error_list
         self.erasures = erasure_list
         self.results_string = ""
         self.verbose = verbose
+        self.method = method
 
     def test(self):
         self.code.operations["X"].update(self.X_errors)
@@ -59,7 +76,7 @@ class DecoderTester(UnitTester):
         if not self.code.error_detected():
             self.results_string = f"FAILED: Error not detected {self.description}"
         else:
-            self.code.erasure_decoder()
+            self.code.erasure_decoder(self.method)
             self.code.measure_syndrome()
             if self.code.error_detected():
                 self.results_string = f"FAILED: Syndrome not corrected {self.description}"
@@ -111,4 +128,723 @@ class RandomErrorTester(UnitTester):
         mean_X = np.mean(self.statistics["num_X"])
         mean_Z = np.mean(self.statistics["num_Z"])
         print(f"Expected vs Actual Average Erasures: {ceil(self.size**2/2)*self.p_error} = {mean_erasures}")
-        print(f"Proportion of X and Z errors: {mean_X/mean_erasures}, {mean_Z/mean_erasures}")
\ No newline at end of file
+        print(f"Proportion of X and Z errors: {mean_X/mean_erasures}, {mean_Z/mean_erasures}")
+
+class BatchEngineTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, repetitions, seed = 0, engine = "batch", batch_size = 64):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.repetitions = repetitions
+        self.seed = seed
+        self.engine = engine
+        self.batch_size = batch_size
+        self.results_string = ""
+
+    def test(self):
+        """
+        Per-shot and batch (or packed) engines should give the same counts from the same random state, global or seeded
+        """
+        np.random.seed(self.seed)
+        shot_df = simulator.simulate([self.size], self.p_error, self.p_error, 1, self.repetitions, self.code_type, "shot")
+        np.random.seed(self.seed)
+        batch_df = simulator.simulate([self.size], self.p_error, self.p_error, 1, self.repetitions, self.code_type, self.engine, batch_size = self.batch_size)
+        seeded = [simulator.simulate([self.size], self.p_error, self.p_error, 1, self.repetitions, self.code_type, engine, batch_size = self.batch_size,
+            seed = self.seed + 1) for engine in ["shot", self.engine]]
+        self.passed = (shot_df.equals(batch_df) and seeded[0].equals(seeded[1])) == self.outcome
+        self.results_string = "PASSED" if self.passed else f"FAILED: {self.description}\n{shot_df}\n{batch_df}"
+
+    def __str__(self):
+        return self.results_string
+
+class ParallelSeedTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, repetitions, engine, seed = 0):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.repetitions = repetitions
+        self.engine = engine
+        self.seed = seed
+
+    def test(self):
+        """
+        Counts from the same root seed should not depend on the number of workers,
+        and the chunks of sweeps of the same root seed with different chunk sizes should not share their samples
+        """
+        results = [simulator.simulate_parallel([self.size], self.p_error, self.p_error, 1, self.repetitions, self.code_type,
+            self.engine, workers, self.seed, chunk_size = self.repetitions//4) for workers in [1, 3]]
+        streams = [np.random.default_rng(simulator.chunk_seed(self.seed, self.size, self.p_error, chunk_size, 0)).random(8)
+            for chunk_size in [self.repetitions//4, self.repetitions//2]]
+        self.passed = (results[0].equals(results[1]) and not np.array_equal(*streams)) == self.outcome
+
+class ResumeTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, repetitions, engine, seed = 0):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.repetitions = repetitions
+        self.engine = engine
+        self.seed = seed
+
+    def test(self):
+        """
+        A sweep resumed from a store missing some chunks, or from a sweep with fewer samples whose last chunk is short,
+        should give the counts of the uninterrupted sweep
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            store = results_store(os.path.join(directory, "results.sqlite"))
+            sweep = lambda workers, resume, n_samples = self.repetitions: simulator.simulate_parallel([self.size], self.p_error/2, self.p_error, 2, n_samples,
+                self.code_type, self.engine, workers, self.seed, self.repetitions//4, store = store, resume = resume)
+            full = sweep(1, False)
+            store.connection.execute("DELETE FROM chunks WHERE chunk % 2 = 1")
+            store.connection.commit()
+            resumed = sweep(2, True)
+            merged = store.merged_counts(self.code_type, "tree")
+            store.connection.execute("DELETE FROM chunks")
+            store.connection.commit()
+            sweep(1, False, self.repetitions - self.repetitions//8)
+            topped_up = sweep(1, True)
+            store.close()
+        self.passed = (full.equals(resumed) and full.equals(topped_up) and bool((merged["n_samples"] == self.repetitions).all())) == self.outcome
+
+class SyndromeClearingTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, repetitions, method):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.repetitions = repetitions
+        self.method = method
+
+    def test(self):
+        """
+        Decoding random erasures should always leave no syndrome, also when codes of the same size grow their trees in turn,
+        and a forest should peel in place unless another code grew since and leave its scratch flags clear if growing fails
+        """
+        self.passed = True
+        for rep in range(self.repetitions):
+            self.code = topological_code.surface_code(self.size) if self.code_type == "surface" else topological_code.toric_code(self.size)
+            self.code.add_erasure_errors(self.p_error)
+            self.code.measure_syndrome()
+            self.code.erasure_decoder(self.method)
+            self.code.measure_syndrome()
+            if bool(self.code.error_detected()) != (not self.outcome):
+                self.passed = False
+                return
+        if self.method == "tree" and self.code_type == "surface":
+            # codes of one size share the scratch lists of their forests, growing another code's trees before peeling should not matter
+            for rep in range(self.repetitions):
+                codes = [topological_code.surface_code(self.size) for _ in range(2)]
+                for code in codes:
+                    code.add_erasure_errors(self.p_error)
+                    code.measure_syndrome()
+                    code.construct_erasure_tree()
+                forests = peeling.get_erasure_forests(codes[0].geometry)
+                if codes[0].forests["X"] is forests["X"] or codes[1].forests["X"] is not forests["X"]:
+                    self.passed = False
+                    return
+                for code in codes:
+                    code.peel_erasure_trees()
+                    code.measure_syndrome()
+                    if bool(code.error_detected()) != (not self.outcome):
+                        self.passed = False
+                        return
+            geometry = codes[0].geometry
+            forest = peeling.get_erasure_forests(geometry)["X"]
+            try:
+                forest.grow([int(geometry.data_index[0])], [int(forest.open_index[0]), geometry.n_cells])
+            except IndexError:
+                pass
+            if any(forest.visited) or any(forest.erased) or any(forest.marked):
+                self.passed = False
+
+class GeometryTester(UnitTester):
+    def test(self):
+        """
+        Codes of one size share a geometry whose integer tables agree with the coordinate lookups
+        """
+        geometry = get_geometry(self.size)
+        self.passed = topological_code.surface_code(self.size).geometry is geometry
+        for stab_type in ["X", "Z"]:
+            indptr, indices = geometry.stabilizer_qubits[stab_type]
+            for j, stab in enumerate(geometry.stabilizers[stab_type]):
+                for qubit in indices[indptr[j]:indptr[j+1]]:
+                    if geometry.get_index(stab) not in geometry.qubit_stabilizers[stab_type][qubit]:
+                        self.passed = False
+                    if stab not in self.code.get_adjacent_stabilizers(geometry.data_qubits[qubit], stab_type):
+                        self.passed = False
+        for error_type in ["X", "Z"]:
+            for qubits, mask in zip(geometry.boundary[error_type], geometry.boundary_mask[error_type]):
+                if sorted(np.flatnonzero(mask)) != sorted(geometry.get_index(qubit) for qubit in qubits):
+                    self.passed = False
+        self.passed = self.passed == self.outcome
+
+class AdaptiveSamplingTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, max_samples, target_width, engine, seed = 0):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.max_samples = max_samples
+        self.target_width = target_width
+        self.engine = engine
+        self.seed = seed
+
+    def test(self):
+        """
+        Intervals should match reference values, and every point should stop at the target width unless the sweep's pooled
+        budget is spent, with the same counts for the same seed. Points without failures should come after those with failures.
+        """
+        self.passed = True
+        for interval, reference in [("wilson", (0.02154, 0.11175)), ("clopper_pearson", (0.01643, 0.11283))]:
+            if not np.allclose(simulator.confidence_interval(5, 100, 0.95, interval), reference, atol = 1e-5):
+                self.passed = False
+        results = [simulator.simulate_adaptive([self.size], self.p_error/2, self.p_error, 2, self.max_samples, self.code_type,
+            self.engine, self.target_width, min_samples = 100, seed = self.seed, chunk_size = 500) for _ in range(2)]
+        if not results[0].equals(results[1]):
+            self.passed = False
+        df = results[0]
+        width = (df["ci_upper"] - df["ci_lower"])/df["logical_error_rate"]
+        if df["n_samples"].sum() > 2*self.max_samples or not ((width <= self.target_width).all() or df["n_samples"].sum() == 2*self.max_samples):
+            self.passed = False
+        counts = np.zeros((2, 4), dtype = np.int64)
+        counts[0, 0], counts[1, 0], counts[1, 1] = 1000, 10, 1
+        if simulator.sampling_order(counts[0], 0.95, "wilson") < simulator.sampling_order(counts[1], 0.95, "wilson"):
+            self.passed = False
+        self.passed = self.passed == self.outcome
+
+class ErrorModelTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, n_samples, noise, noise_parameter, engine, seed = 0):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.n_samples = n_samples
+        self.noise = noise
+        self.noise_parameter = noise_parameter
+        self.engine = engine
+        self.seed = seed
+
+    def test(self):
+        """
+        The prefiltered stream should count the same outcomes as decoding every detected shot of the same batches,
+        and erasure_channel should erase with probability p_error and draw its Paulis uniformly.
+        Noise models missing their parameter should be refused
+        """
+        self.passed = True
+        channels = error_models.get_channels(self.noise, self.p_error, self.noise_parameter)
+        counts = simulator.simulate_stream(self.size, self.n_samples, channels, 100, self.seed, code = self.code_type, engine = self.engine)
+        full = sum(simulator.classify_batch(encoding, contained = False) for encoding in
+            error_models.shot_batches(self.size, self.n_samples, channels, 100, self.seed, self.code_type, self.engine))
+        if counts.sum() != self.n_samples or not np.array_equal(counts, full):
+            self.passed = False
+        streams = [np.random.default_rng(stream) for stream in np.random.SeedSequence(self.seed).spawn(2)]
+        erased, X, Z = error_models.erasure_channel(self.p_error).sample(streams, self.n_samples, get_geometry(self.size))
+        paulis = [np.mean(X[erased] & ~Z[erased]), np.mean(X[erased] & Z[erased]), np.mean(Z[erased] & ~X[erased])]
+        if abs(erased.mean() - self.p_error) > 0.01 or not np.allclose(paulis, 0.25, atol = 0.01) or (X | Z)[~erased].any():
+            self.passed = False
+        for noise in error_models.parametrized:
+            try:
+                error_models.get_channels(noise, self.p_error)
+                self.passed = False
+            except ValueError:
+                pass
+        self.passed = self.passed == self.outcome
+
+class StratifiedSamplingTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, n_samples, engine, seed = 0):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.n_samples = n_samples
+        self.engine = engine
+        self.seed = seed
+
+    def test(self):
+        """
+        Fixed weight erasures should have exactly their weight, and the stratified estimate should agree with direct sampling
+        at p_error and be exactly zero when no stratum can fail, without more shots than n_samples
+        """
+        self.passed = True
+        streams = [np.random.default_rng(stream) for stream in np.random.SeedSequence(self.seed).spawn(2)]
+        erased, X, Z = error_models.fixed_weight_erasure_channel(7).sample(streams, 100, get_geometry(self.size))
+        if not (erased.sum(axis = 1) == 7).all() or (X | Z)[~erased].any():
+            self.passed = False
+        pmf = simulator.weight_distribution(50, self.p_error)
+        if abs(pmf.sum() - 1) > 1e-9 or abs(pmf @ np.arange(51) - 50*self.p_error) > 1e-9:
+            self.passed = False
+        df = simulator.simulate_stratified([self.size], self.p_error, self.p_error, 1, self.n_samples, self.code_type, self.engine, seed = self.seed)
+        counts = simulator.simulate_stream(self.size, self.n_samples, error_models.get_channels("erasure", self.p_error), seed = self.seed,
+            code = self.code_type, engine = self.engine)
+        lower, upper = simulator.confidence_interval(simulator.logical_failures(counts), self.n_samples)
+        if df["ci_upper"].iloc[0] < lower or df["ci_lower"].iloc[0] > upper:
+            self.passed = False
+        # a p so small that every stratum from the distance on is dropped
+        df = simulator.simulate_stratified([self.size], 1e-9, 1e-9, 1, 100, self.code_type, self.engine, seed = self.seed)
+        if df["logical_error_rate"].iloc[0] != 0 or df["ci_upper"].iloc[0] > 1e-12:
+            self.passed = False
+        # small budgets over many strata should be refused or kept, never exceeded
+        for n_samples in [3, 40]:
+            try:
+                df = simulator.simulate_stratified([self.size], 0.05, 0.6, 5, n_samples, self.code_type, self.engine, seed = self.seed)
+                if n_samples == 3 or (df["n_samples"] > n_samples).any():
+                    self.passed = False
+            except ValueError:
+                pass
+        self.passed = self.passed == self.outcome
+
+class WeightTableTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, n_samples, engine, seed = 0):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.n_samples = n_samples
+        self.engine = engine
+        self.seed = seed
+
+    def test(self):
+        """
+        Exact weights should match decoding every Pauli of every pattern, the cached table should be reloaded as built
+        and topped up when more shots are asked for, and its polynomial should agree with direct sampling at p_error
+        """
+        self.passed = True
+        weight = self.size//2 + 1 if self.code_type == "toric" else (self.size + 1)//2 + 1
+        n_qubits = len(get_toric_geometry(self.size).data_qubits if self.code_type == "toric" else get_geometry(self.size).data_qubits)
+        failures = 0
+        for pattern in combinations(range(n_qubits), weight):
+            erased = np.zeros((4**weight, n_qubits), dtype = bool)
+            erased[:, list(pattern)] = True
+            paulis = (np.arange(4**weight)[:, None] >> 2*np.arange(weight)) & 3
+            X = np.zeros_like(erased)
+            Z = np.zeros_like(erased)
+            X[:, list(pattern)] = paulis & 1 == 1
+            Z[:, list(pattern)] = paulis & 2 == 2
+            encoding = new_batch_code(self.size, len(erased), self.code_type, self.engine)
+            encoding.add_errors(erased, X, Z)
+            failures += np.mean(simulator.classify_shots(encoding) % 2)
+        if not np.isclose(failures, weight_tables.exact_failures(self.size, self.code_type, "tree", weight, self.engine)):
+            self.passed = False
+        with tempfile.TemporaryDirectory() as table_dir:
+            table = weight_tables.get_table(self.size, self.code_type, "tree", self.n_samples, table_dir, engine = self.engine, seed = self.seed)
+            if not table.equals(weight_tables.get_table(self.size, self.code_type, "tree", 1, table_dir)):
+                self.passed = False
+            topped_up = weight_tables.get_table(self.size, self.code_type, "tree", 2*self.n_samples, table_dir, engine = self.engine, seed = self.seed)
+            sampled = ~table["exact"]
+            if sampled.any() and not ((topped_up["shots"][sampled] == 2*self.n_samples).all() and (topped_up["failures"] >= table["failures"]).all()
+                    and topped_up.equals(weight_tables.get_table(self.size, self.code_type, "tree", 1, table_dir))):
+                self.passed = False
+        df = weight_tables.evaluate_table(table, [self.p_error])
+        counts = simulator.simulate_stream(self.size, self.n_samples, error_models.get_channels("erasure", self.p_error), seed = self.seed,
+            code = self.code_type, engine = self.engine)
+        lower, upper = simulator.confidence_interval(simulator.logical_failures(counts), self.n_samples)
+        if df["ci_upper"].iloc[0] < lower or df["ci_lower"].iloc[0] > upper:
+            self.passed = False
+        self.passed = self.passed == self.outcome
+
+class BenchmarkTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, n_shots, decoder):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.n_shots = n_shots
+        self.decoder = decoder
+
+    def test(self):
+        """
+        Every stage should be timed once per shot (decoders once per detected shot),
+        and a baseline twice as fast should be reported as a regression
+        """
+        self.passed = True
+        timings = benchmark.benchmark_stages(self.size, self.p_error, self.n_shots, self.code_type, self.decoder, seed = 0)
+        decoder_stages = ["construct_erasure_tree", "peel_erasure_trees"] if self.code_type == "surface" and self.decoder == "tree" else ["erasure_decoder"]
+        if set(timings) != {"add_erasure_errors", "measure_syndrome", "has_logical_error", *decoder_stages}:
+            self.passed = False
+        elif len(timings["measure_syndrome"]) != self.n_shots or len(timings[decoder_stages[0]]) > self.n_shots:
+            self.passed = False
+        records = benchmark.stage_records(self.size, self.p_error, self.code_type, self.decoder, timings)
+        baseline = {"results": [dict(record, shots_per_second = 2*record["shots_per_second"]) for record in records]}
+        comparisons = benchmark.compare({"results": records}, baseline, 0.25)
+        if len(comparisons) != len(records) or not all(regression for record, ratio, regression in comparisons):
+            self.passed = False
+        if any(regression for record, ratio, regression in benchmark.compare({"results": records}, {"results": records}, 0.25)):
+            self.passed = False
+        self.passed = self.passed == self.outcome
+
+class ProfilingTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, repetitions, engine):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.repetitions = repetitions
+        self.engine = engine
+
+    def test(self):
+        """
+        Profiling should not change the counts, should count every shot and time every stage,
+        and the trees of the tree decoder should hold every erased qubit
+        """
+        self.passed = True
+        profile = stage_profiler()
+        np.random.seed(0)
+        profiled = simulator.simulate([self.size], self.p_error, self.p_error, 1, self.repetitions, self.code_type, self.engine, profile = profile)
+        np.random.seed(0)
+        if not profiled.equals(simulator.simulate([self.size], self.p_error, self.p_error, 1, self.repetitions, self.code_type, self.engine)):
+            self.passed = False
+        report = profile.report()
+        stages = report["stages"]
+        if stages["shots"].sum() != self.repetitions or not (stages[[col for col in stages if col.endswith("_seconds")]] > 0).all(axis = None):
+            self.passed = False
+        if self.engine == "shot" and self.code_type == "surface":
+            code = topological_code.surface_code(self.size)
+            np.random.seed(1)
+            code.add_erasure_errors(self.p_error)
+            code.measure_syndrome()
+            code.construct_erasure_tree()
+            profile = stage_profiler()
+            profile.point(self.size, self.p_error)
+            profile.record_forests(code.forests)
+            sizes = profile.histogram_frame(profile.cluster_sizes)
+            if (sizes["value"]*sizes["count"]).sum() != 2*len(code.erasure_set):
+                self.passed = False
+        if len(report["failures"]):
+            self.passed = False
+        self.passed = self.passed == self.outcome
+
+class SpacetimeTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, p_measurement, rounds, repetitions):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.p_measurement = p_measurement
+        self.rounds = rounds
+        self.repetitions = repetitions
+
+    def test(self):
+        """
+        Peeling the spacetime forest should clear every detection event with one tree node per erased edge and root,
+        measurement erasures alone should never end in a logical error, and codes or engines without
+        a multi-round mode should be rejected
+        """
+        self.passed = True
+        if self.code_type != "surface":
+            if self.rounds == 1:
+                self.passed = self.passed == self.outcome
+                return
+            try:
+                simulator.simulate([self.size], self.p_error, self.p_error, 1, 1, self.code_type, rounds = self.rounds)
+                self.passed = False
+            except ValueError:
+                pass
+            self.passed = self.passed == self.outcome
+            return
+        rng = np.random.default_rng(0)
+        for p_error in [self.p_error, 0.0]:
+            for _ in range(self.repetitions):
+                code = topological_code.spacetime_code(self.size, self.rounds)
+                code.add_erasure_errors(p_error, rng, self.p_measurement)
+                code.measure_syndrome()
+                code.erasure_decoder()
+                for forest, erasures in zip(code.forests.values(), code.erasures.values()):
+                    if forest.n_nodes - forest.parents.count(-1) > len(erasures):
+                        self.passed = False
+                code.measure_syndrome()
+                if code.error_detected() or (p_error == 0 and code.has_logical_error()):
+                    self.passed = False
+        try:
+            simulator.simulate([self.size], self.p_error, self.p_error, 1, 1, self.code_type, "batch", rounds = self.rounds)
+            self.passed = self.rounds == 1
+        except ValueError:
+            pass
+        counts = simulator.simulate([self.size], self.p_error, self.p_error, 1, self.repetitions, self.code_type, rounds = self.rounds,
+            measurement_error_rate = self.p_measurement)
+        if counts[simulator.outcomes].to_numpy().sum() != self.repetitions or counts["uncorrected_error"].sum() == self.repetitions:
+            self.passed = False
+        self.passed = self.passed == self.outcome
+
+class RectangularTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, repetitions):
+        super().__init__(size if code_type == "surface" else lattice_shape(size)[0], code_type, description, correct)
+        self.size = size
+        self.p_error = p_error
+        self.repetitions = repetitions
+
+    def test(self):
+        """
+        The straight logical operators of a rows x columns lattice should have the weights of its X and Z distances,
+        every engine should give the same counts, and a square (size, size) lattice should be the size one
+        """
+        self.passed = True
+        if self.code_type != "surface":
+            try:
+                simulator.simulate([self.size], self.p_error, self.p_error, 1, 1, self.code_type)
+                self.passed = False
+            except ValueError:
+                pass
+            self.passed = self.passed == self.outcome
+            return
+        geometry = get_geometry(self.size)
+        rows, columns = lattice_shape(self.size)
+        chains = {"X": [(0, x) for x in range(0, columns, 2)], "Z": [(y, 0) for y in range(0, rows, 2)]}
+        for error_type, chain in chains.items():
+            if len(chain) != geometry.distances[error_type]:
+                self.passed = False
+            for qubits, logical in [(chain, True), (chain[:-1], False)]:
+                code = topological_code.surface_code(self.size)
+                code.operations[error_type].update(qubits)
+                code.measure_syndrome()
+                if bool(code.error_detected()) == logical or code.has_logical_error() != logical:
+                    self.passed = False
+        counts = []
+        for engine in ["shot", "batch", "packed"]:
+            np.random.seed(0)
+            counts.append(simulator.simulate([self.size], self.p_error, self.p_error, 1, self.repetitions, self.code_type, engine)[simulator.outcomes].to_numpy())
+        if any((count != counts[0]).any() for count in counts):
+            self.passed = False
+        square = get_geometry((columns, columns))
+        if square.data_qubits != get_geometry(columns).data_qubits or square.open_index != get_geometry(columns).open_index:
+            self.passed = False
+        self.passed = self.passed == self.outcome
+
+class AnalysisTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, threshold, nu, n_samples, n_bootstrap):
+        super().__init__(size, code_type, description, correct)
+        self.threshold = threshold
+        self.nu = nu
+        self.n_samples = n_samples
+        self.n_bootstrap = n_bootstrap
+
+    def test(self):
+        """
+        On counts drawn from a logistic scaling curve through 0.75 p_th at p_th, the fit should find p_th and nu within their
+        bootstrap intervals, every pseudo-threshold and crossing should be near p_th and the next window should hold p_th
+        """
+        self.passed = True
+        rng = np.random.default_rng(0)
+        sizes = [self.size + 4*k for k in range(4)]
+        error_range = np.linspace(self.threshold - 0.06, self.threshold + 0.06, 7)
+        with tempfile.TemporaryDirectory() as directory:
+            store = results_store(os.path.join(directory, "results.sqlite"))
+            for size in sizes:
+                distance = (get_toric_geometry(size) if self.code_type == "toric" else get_geometry(size)).distance
+                for phys_error_rate in error_range:
+                    rate = 1.5*self.threshold/(1 + np.exp(-3.2*(phys_error_rate - self.threshold)*distance**(1/self.nu)))
+                    failures = rng.binomial(self.n_samples, rate)
+                    store.add_chunk((self.code_type, "tree", size, phys_error_rate, 0, self.n_samples, 0),
+                        [self.n_samples - failures, failures, 0, 0])
+            store.close()
+            df = analysis.load_counts(os.path.join(directory, "results.sqlite"), self.code_type, "tree")
+        if len(df) != len(sizes)*len(error_range) or not (df["failures"] <= df["n_samples"]).all():
+            self.passed = False
+        fit = analysis.analyse(df)
+        samples = analysis.bootstrap(df, self.n_bootstrap, seed = 0)
+        for name, truth in [("threshold", self.threshold), ("nu", self.nu)]:
+            median, lower, upper = analysis.interval([sample[name] for sample in samples], 0.99)
+            if not lower <= truth <= upper or not lower <= fit[name] <= upper:
+                self.passed = False
+        for value in [*fit["pseudo_thresholds"].values(), *fit["crossings"].values()]:
+            if not abs(value - self.threshold) < 0.03:
+                self.passed = False
+        lower, upper, n_points = analysis.suggest_window([sample["threshold"] for sample in samples], error_range)
+        if not lower < self.threshold < upper or upper - lower > error_range[-1] - error_range[0]:
+            self.passed = False
+        self.passed = self.passed == self.outcome
+
+def dying_worker(path, *args):
+    """
+    Worker process that claims a unit of the queue at path and dies holding its lease
+    """
+    job_queue.job_queue(path).claim("dying")
+    os._exit(1)
+
+class QueueTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, repetitions, n_workers, seed = 0):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.repetitions = repetitions
+        self.n_workers = n_workers
+        self.seed = seed
+
+    def test(self):
+        """
+        Local worker processes draining a submitted sweep should give the counts of simulate_parallel, retrying the unit
+        of a worker that died holding it and simulating again the short last chunks of a sweep with fewer samples,
+        and submitting the sweep again should add no units. The coordinator should raise instead of waiting once every
+        local worker died.
+        """
+        self.passed = True
+        chunk_size = self.repetitions//4
+        error_range = np.linspace(self.p_error/2, self.p_error, 2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.sqlite")
+            job_queue.simulate_queue([self.size], self.p_error/2, self.p_error, 2, self.repetitions - chunk_size//2, self.code_type, path,
+                seed = self.seed, chunk_size = chunk_size, workers = self.n_workers, poll = 0.05)
+            queue = job_queue.job_queue(path, lease_seconds = 0)
+            if queue.submit([self.size], error_range, self.repetitions, self.code_type, "tree", self.seed, chunk_size) != 2:
+                self.passed = False
+            dead = queue.claim("dead")
+            queue.close()
+            df = job_queue.simulate_queue([self.size], self.p_error/2, self.p_error, 2, self.repetitions, self.code_type, path,
+                seed = self.seed, chunk_size = chunk_size, workers = self.n_workers, poll = 0.05)
+            queue = job_queue.job_queue(path)
+            if queue.submit([self.size], error_range, self.repetitions, self.code_type, "tree", self.seed, chunk_size) != 0:
+                self.passed = False
+            attempts = queue.connection.execute("SELECT attempts, status FROM units WHERE rowid = ?", (dead["rowid"],)).fetchone()
+            if attempts != (2, "done") or queue.progress() != {"done": 8}:
+                self.passed = False
+            queue.close()
+            run_worker = job_queue.run_worker
+            job_queue.run_worker = dying_worker
+            try:
+                job_queue.simulate_queue([self.size], self.p_error/2, self.p_error, 2, self.repetitions, self.code_type,
+                    os.path.join(directory, "dying.sqlite"), seed = self.seed, chunk_size = chunk_size, workers = self.n_workers, poll = 0.05)
+                self.passed = False
+            except RuntimeError:
+                pass
+            finally:
+                job_queue.run_worker = run_worker
+        expected = simulator.simulate_parallel([self.size], self.p_error/2, self.p_error, 2, self.repetitions, self.code_type,
+            "shot", 1, self.seed, chunk_size)
+        self.passed = (self.passed and df.equals(expected)) == self.outcome
+
+class DecodeBatchTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, repetitions, decoder):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.repetitions = repetitions
+        self.decoder = decoder
+
+    def test(self):
+        """
+        Corrections of decode_batch should stay inside the erasure and clear every syndrome, be those of the batch engine
+        for union_find, and be the same from memory mapped files decoded in chunks; records of the wrong shape should be refused.
+        The corrections of the other decoder should only differ by a syndrome-free operator, logical only on spanning erasures
+        """
+        self.passed = True
+        rng = np.random.default_rng(0)
+        encoding = new_batch_code(self.size, self.repetitions, self.code_type)
+        encoding.add_erasure_errors(self.p_error, rng)
+        encoding.measure_syndrome()
+        erasures, syndromes = decoding.batch_records(encoding)
+        corrections = decoding.decode_batch(self.size, erasures.view(np.uint8), syndromes, self.code_type, self.decoder)
+        if (corrections & ~erasures[:, None]).any():
+            self.passed = False
+        reference = new_batch_code(self.size, self.repetitions, self.code_type)
+        reference.add_erasure_errors(self.p_error, np.random.default_rng(0))
+        reference.measure_syndrome()
+        reference.erasure_decoder(None, None, self.decoder)
+        data_grid = encoding.geometry.data_grid
+        for type_number, error_type in enumerate(["X", "Z"]):
+            encoding.operations[error_type][:, data_grid] ^= corrections[:, type_number]
+            if self.decoder == "union_find" and not (encoding.operations[error_type] == reference.operations[error_type]).all():
+                self.passed = False
+        encoding.measure_syndrome()
+        if encoding.error_detected().any():
+            self.passed = False
+        other = decoding.decode_batch(self.size, erasures, syndromes, self.code_type, "tree" if self.decoder == "union_find" else "union_find")
+        difference = new_batch_code(self.size, self.repetitions, self.code_type)
+        difference.add_errors(erasures, corrections[:, 0] ^ other[:, 0], corrections[:, 1] ^ other[:, 1])
+        difference.measure_syndrome()
+        if difference.error_detected().any() or (difference.has_logical_error() & ~difference.erasure_spans_boundaries()).any():
+            self.passed = False
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ["erasures.npy", "syndromes.npy", "corrections.npy"]]
+            np.save(paths[0], erasures)
+            np.save(paths[1], syndromes)
+            decoding.decode_file(self.size, *paths, self.code_type, self.decoder, chunk_shots = self.repetitions//3)
+            if not (np.load(paths[2]) == corrections).all():
+                self.passed = False
+        try:
+            decoding.decode_batch(self.size, erasures[:, 1:], syndromes, self.code_type, self.decoder)
+            self.passed = False
+        except ValueError:
+            pass
+        self.passed = self.passed == self.outcome
+
+class ClusterTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, p_error, repetitions):
+        super().__init__(size, code_type, description, correct)
+        self.p_error = p_error
+        self.repetitions = repetitions
+
+    def test(self):
+        """
+        Clusters should hold every erased qubit, a straight logical chain should span, decoded shots without a spanning cluster
+        should have no logical error, and the shot engine skipping those should keep the counts of the batch engine
+        and record the clusters of every shot when profiled
+        """
+        self.passed = True
+        geometry = get_geometry(self.size)
+        for error_type, chain in [("X", [(0, x) for x in range(0, self.size, 2)]), ("Z", [(y, 0) for y in range(0, self.size, 2)])]:
+            code = topological_code.surface_code(self.size)
+            code.erasure_set.update(chain)
+            if not code.erasure_clusters()[error_type][1] or code.erasure_clusters()["Z" if error_type == "X" else "X"][1]:
+                self.passed = False
+        rng = np.random.default_rng(0)
+        for _ in range(self.repetitions):
+            code = topological_code.surface_code(self.size)
+            code.add_erasure_errors(self.p_error, rng)
+            clusters = code.erasure_clusters()
+            if any(sum(sizes) != len(code.erasure_set) for sizes, spans in clusters.values()):
+                self.passed = False
+            code.measure_syndrome()
+            code.erasure_decoder()
+            if code.has_logical_error() and not (clusters["X"][1] or clusters["Z"][1]):
+                self.passed = False
+        shot = simulator.simulate_shots(self.size, self.p_error, self.repetitions, self.code_type, np.random.default_rng(1))
+        batch = simulator.simulate_batch(self.size, self.p_error, self.repetitions, rng = np.random.default_rng(1), code = self.code_type)
+        profile = stage_profiler()
+        profile.point(self.size, self.p_error)
+        profiled = simulator.simulate_shots(self.size, self.p_error, self.repetitions, self.code_type, np.random.default_rng(1), profile = profile)
+        report = profile.report()
+        if not ((shot == batch).all() and (profiled == batch).all()) or len(report["shot_clusters"]) != 2*self.repetitions:
+            self.passed = False
+        spanning = report["shot_clusters"].groupby("shot")["spans"].any()
+        if profile.counters[profile.current, "early_exit"] != (~spanning).sum():
+            self.passed = False
+        self.passed = self.passed == self.outcome
+
+class CoupledTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, lower_bound, upper_bound, n_points, repetitions):
+        super().__init__(size, code_type, description, correct)
+        self.error_range = np.linspace(lower_bound, upper_bound, n_points)
+        self.repetitions = repetitions
+
+    def test(self):
+        """
+        The coupled sweep should give the counts of classify_batch at every error rate on the nested errors of the same draws,
+        in any order of the error rates, and refuse the codes the packed engine does not support
+        """
+        self.passed = True
+        if self.code_type != "surface":
+            try:
+                simulator.simulate_coupled([self.size], self.error_range[0], self.error_range[-1], len(self.error_range), self.repetitions, self.code_type)
+                self.passed = False
+            except ValueError:
+                pass
+            self.passed = self.passed == self.outcome
+            return
+        batch_size = self.repetitions//2
+        counts = simulator.coupled_counts(self.size, self.error_range[::-1], self.repetitions, batch_size, np.random.default_rng(0))[::-1]
+        rng = np.random.default_rng(0)
+        expected = np.zeros_like(counts)
+        geometry = get_geometry(self.size)
+        for start in range(0, self.repetitions, batch_size):
+            random = rng.random((batch_size, *geometry.shape))
+            pauli = rng.random((batch_size, *geometry.shape))
+            for j, phys_error_rate in enumerate(self.error_range):
+                erased = (random < phys_error_rate) & geometry.data_grid
+                encoding = new_batch_code(self.size, batch_size, self.code_type)
+                encoding.add_grid_errors(erased, erased & (pauli < 1/2), erased & (pauli >= 1/4) & (pauli < 3/4))
+                expected[j] += simulator.classify_batch(encoding)
+        df = simulator.simulate_coupled([self.size], self.error_range[0], self.error_range[-1], len(self.error_range), self.repetitions, seed = 0)
+        self.passed = (self.passed and (counts == expected).all() and bool((df[simulator.outcomes].sum(axis = 1) == self.repetitions).all())) == self.outcome
+
+class DifferentialTester(UnitTester):
+    def __init__(self, size, code_type, description, correct, n_shots):
+        super().__init__(size, code_type, description, correct)
+        self.n_shots = n_shots
+
+    def test(self):
+        """
+        Every backend should agree on random patterns, and a backend flipping the outcome of shots with two X errors
+        should be caught and minimized to two erased qubits with X errors
+        """
+        decoded, failures = differential.run([self.size], self.n_shots, self.code_type, seed = 0)
+        self.passed = decoded > 0 and not failures
+        reference = differential.backends["batch_union_find"][0]
+        def faulty(size, code, erased, X, Z):
+            syndromes, logical = reference(size, code, erased, X, Z)
+            return syndromes, logical ^ (X.sum(axis = 1) >= 2)
+        differential.register("faulty", "union_find", [self.code_type])(faulty)
+        try:
+            decoded, failures = differential.run([self.size], self.n_shots, self.code_type, ["shot_union_find", "faulty"], seed = 0)
+        finally:
+            del differential.backends["faulty"]
+        self.passed &= len(failures) == 1 and [len(failures[0][qubits]) for qubits in ["erasure", "X", "Z"]] == [2, 2, 0]
+        self.passed = self.passed == self.outcome
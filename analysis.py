@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from results_store import results_store
+from simulator import logical_failures, outcomes
+from lattice import get_geometry, get_toric_geometry
+"""
+Threshold analysis of the counts accumulated in a results_store.
+
+Fits the finite-size scaling ansatz P_L = A + B x + C x^2 with x = (p - p_th) d^(1/nu) to the logical error rates
+of every (size, physical error rate) point, by least squares weighted with the binomial variances: A, B and C are
+solved exactly for every (p_th, nu) of a grid that is refined around the best point. Also finds the pseudo-threshold of
+every size, where its logical error rate crosses the effective error rate 0.75 p, and the crossings of the curves of
+consecutive sizes. Bootstrapping the binomial counts gives confidence intervals of all of them, and the spread of the
+bootstrapped thresholds gives the error-rate window worth simulating next.
+"""
+
+def load_counts(store_path, code, decoder):
+    """
+    One row per stored (size, physical error rate) with the code distance, samples and logical failures
+    """
+    store = results_store(store_path)
+    try:
+        df = store.merged_counts(code, decoder)
+    finally:
+        store.close()
+    df = df.reset_index()
+    df["distance"] = [(get_toric_geometry(size) if code == "toric" else get_geometry(size)).distance for size in df["size"]]
+    df["failures"] = logical_failures(df[outcomes].to_numpy())
+    return df[["size", "distance", "physical_error_rate", "n_samples", "failures"]]
+
+def binomial_weights(failures, n_samples):
+    """
+    Inverse variances of the logical error rates, from Laplace estimates so points without failures keep a finite weight
+    """
+    rate = (failures + 1)/(n_samples + 2)
+    return n_samples/(rate*(1 - rate))
+
+def scaling_fit(p, distance, rate, weights, p_range, nu_range = (0.5, 3.0), grid = 25, refinements = 4):
+    """
+    (p_th, nu, (A, B, C), chi2) of the scaling ansatz minimizing the weighted squared residuals.
+    Every refinement searches a grid x grid (p_th, nu) grid and then halves the grid around the best point.
+    """
+    (p_low, p_high), (nu_low, nu_high) = p_range, nu_range
+    for _ in range(refinements):
+        thresholds = np.linspace(p_low, p_high, grid)
+        nus = np.linspace(nu_low, nu_high, grid)
+        th, nu = (values.ravel() for values in np.meshgrid(thresholds, nus, indexing = "ij"))
+        x = (p[None, :] - th[:, None])*distance[None, :]**(1/nu[:, None])
+        design = np.stack([np.ones_like(x), x, x**2], axis = 2)
+        normal = np.einsum("n,gni,gnj->gij", weights, design, design)
+        normal += 1e-12*np.trace(normal, axis1 = 1, axis2 = 2)[:, None, None]*np.eye(3)
+        coefficients = np.linalg.solve(normal, np.einsum("n,gni,n->gi", weights, design, rate)[..., None])[..., 0]
+        chi2 = np.einsum("n,gn->g", weights, (rate[None, :] - np.einsum("gni,gi->gn", design, coefficients))**2)
+        best = int(np.argmin(chi2))
+        p_step, nu_step = (p_high - p_low)/(grid - 1), (nu_high - nu_low)/(grid - 1)
+        p_low, p_high = th[best] - 2*p_step, th[best] + 2*p_step
+        nu_low, nu_high = max(1e-3, nu[best] - 2*nu_step), nu[best] + 2*nu_step
+    return float(th[best]), float(nu[best]), tuple(float(c) for c in coefficients[best]), float(chi2[best])
+
+def pseudo_thresholds(df, rates):
+    """
+    {size: error rate where the logical error rate of the size crosses 0.75 p}, linearly interpolated
+    between the first pair of points where it goes from below to above, nan if it never does
+    """
+    return {size: first_crossing(df["physical_error_rate"].to_numpy()[rows], rates[rows] - 0.75*df["physical_error_rate"].to_numpy()[rows])
+            for size, rows in size_rows(df).items()}
+
+def curve_crossings(df, rates):
+    """
+    {(size, next size): error rate where the logical error rate of the larger size overtakes the smaller one},
+    over the error rates both were simulated at, nan if it never does
+    """
+    sizes = size_rows(df)
+    crossings = {}
+    for small, large in zip(list(sizes)[:-1], list(sizes)[1:]):
+        small_rates = pd.Series(rates[sizes[small]], index = df["physical_error_rate"].to_numpy()[sizes[small]])
+        large_rates = pd.Series(rates[sizes[large]], index = df["physical_error_rate"].to_numpy()[sizes[large]])
+        common = small_rates.index.intersection(large_rates.index).sort_values()
+        crossings[small, large] = first_crossing(common.to_numpy(), (large_rates[common] - small_rates[common]).to_numpy())
+    return crossings
+
+def size_rows(df):
+    """
+    {size: row numbers of df sorted by error rate}, sizes in increasing order
+    """
+    order = np.lexsort((df["physical_error_rate"].to_numpy(), df["size"].to_numpy()))
+    sizes = df["size"].to_numpy()[order]
+    return {size: order[sizes == size] for size in np.unique(sizes)}
+
+def first_crossing(p, difference):
+    """
+    First error rate where difference goes from negative to non-negative, linearly interpolated
+    """
+    for i in range(1, len(p)):
+        if difference[i - 1] < 0 <= difference[i]:
+            return float(p[i - 1] + (p[i] - p[i - 1])*(-difference[i - 1])/(difference[i] - difference[i - 1]))
+    return float("nan")
+
+def analyse(df, p_range = None, nu_range = (0.5, 3.0)):
+    """
+    Threshold, nu, pseudo-thresholds and crossings of one set of counts
+    """
+    p = df["physical_error_rate"].to_numpy()
+    n_samples = df["n_samples"].to_numpy()
+    failures = df["failures"].to_numpy()
+    rates = failures/n_samples
+    if p_range is None:
+        p_range = (p.min(), p.max())
+    threshold, nu, coefficients, chi2 = scaling_fit(p, df["distance"].to_numpy().astype(float), rates, binomial_weights(failures, n_samples), p_range, nu_range)
+    return {
+        "threshold": threshold, "nu": nu, "coefficients": coefficients, "chi2": chi2, "dof": len(df) - 5,
+        "pseudo_thresholds": pseudo_thresholds(df, rates), "crossings": curve_crossings(df, rates)
+    }
+
+def bootstrap(df, n_bootstrap = 200, seed = None, p_range = None, nu_range = (0.5, 3.0)):
+    """
+    analyse of n_bootstrap parametric resamples of the counts, the failures of every point drawn
+    from a binomial with its number of samples and observed logical error rate
+    """
+    rng = np.random.default_rng(seed)
+    resample = df.copy()
+    results = []
+    for _ in range(n_bootstrap):
+        resample["failures"] = rng.binomial(df["n_samples"].to_numpy(), df["failures"].to_numpy()/df["n_samples"].to_numpy())
+        results.append(analyse(resample, p_range, nu_range))
+    return results
+
+def interval(values, confidence):
+    """
+    (median, lower, upper) percentiles of the bootstrapped values, ignoring nan
+    """
+    values = np.asarray(values, dtype = float)
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return (float("nan"),)*3
+    return tuple(float(q) for q in np.percentile(values, [50, 50*(1 - confidence), 50*(1 + confidence)]))
+
+def suggest_window(thresholds, error_rates, n_points = 7):
+    """
+    Error-rate window for the next sweep, centered on the median bootstrapped threshold and two bootstrap standard
+    deviations wide on each side, at least one spacing of the simulated error rates, so its points all land where
+    the curves of different sizes are still distinguishable and each one narrows the fit
+    """
+    thresholds = np.asarray(thresholds, dtype = float)
+    thresholds = thresholds[~np.isnan(thresholds)]
+    spacing = np.min(np.diff(np.unique(error_rates))) if len(np.unique(error_rates)) > 1 else 0.0
+    center = float(np.median(thresholds))
+    half_width = max(2*float(np.std(thresholds)), spacing)
+    return max(0.0, center - half_width), min(1.0, center + half_width), n_points
+
+def next_command(sizes, window, n_samples, code, store_path):
+    """
+    main.py command line of the suggested sweep over the stored sizes, None if they are not evenly spaced
+    """
+    steps = np.unique(np.diff(sizes))
+    if len(steps) > 1:
+        return None
+    interval = int(steps[0]) if len(steps) else 1
+    lower, upper, n_points = window
+    return f"python main.py {sizes[0]} {sizes[-1]} {interval} {lower:.4f} {upper:.4f} {n_points} {n_samples} {code} --workers 0 --store {store_path}"
+
+def main(args):
+    df = load_counts(args.store, args.code, args.decoder)
+    if args.window is not None:
+        df = df[(df["physical_error_rate"] >= args.window[0]) & (df["physical_error_rate"] <= args.window[1])]
+    if df["size"].nunique() < 2 or len(df) < 6:
+        print(f"Not enough points of the {args.code} code with the {args.decoder} decoder in {args.store} to fit the threshold "
+            f"({df['size'].nunique()} sizes, {len(df)} points)")
+        sys.exit(1)
+    df = df.reset_index(drop = True)
+    nu_range = tuple(args.nu_range)
+    fit = analyse(df, nu_range = nu_range)
+    samples = bootstrap(df, args.n_bootstrap, args.seed, nu_range = nu_range)
+    summary = {
+        "store": args.store, "code": args.code, "decoder": args.decoder, "confidence": args.confidence,
+        "points": len(df), "sizes": [int(size) for size in df["size"].unique()], "samples": int(df["n_samples"].sum()),
+        "threshold": fit["threshold"], "threshold_interval": interval([sample["threshold"] for sample in samples], args.confidence),
+        "nu": fit["nu"], "nu_interval": interval([sample["nu"] for sample in samples], args.confidence),
+        "chi2": fit["chi2"], "dof": fit["dof"], "coefficients": fit["coefficients"],
+        "pseudo_thresholds": {int(size): {"estimate": value, "interval": interval([sample["pseudo_thresholds"][size] for sample in samples], args.confidence)}
+            for size, value in fit["pseudo_thresholds"].items()},
+        "crossings": {f"{small}-{large}": {"estimate": value, "interval": interval([sample["crossings"][small, large] for sample in samples], args.confidence)}
+            for (small, large), value in fit["crossings"].items()}
+    }
+    window = suggest_window([sample["threshold"] for sample in samples], df["physical_error_rate"].to_numpy(), args.n_points)
+    summary["next_window"] = window
+    summary["next_command"] = next_command(sorted(summary["sizes"]), window, args.n_samples, args.code, args.store)
+
+    median, lower, upper = summary["threshold_interval"]
+    print(f"{len(df)} points of sizes {summary['sizes']}, {summary['samples']} samples")
+    print(f"Threshold {fit['threshold']:.5f}  ({args.confidence:.0%} interval {lower:.5f} - {upper:.5f})")
+    print(f"nu {fit['nu']:.3f}  ({args.confidence:.0%} interval {summary['nu_interval'][1]:.3f} - {summary['nu_interval'][2]:.3f}), "
+        f"chi2 {fit['chi2']:.1f} over {fit['dof']} degrees of freedom")
+    for size, pseudo in summary["pseudo_thresholds"].items():
+        print(f"Pseudo-threshold of size {size:4}: {pseudo['estimate']:.5f}  ({pseudo['interval'][1]:.5f} - {pseudo['interval'][2]:.5f})")
+    for pair, crossing in summary["crossings"].items():
+        print(f"Crossing of sizes {pair:9}: {crossing['estimate']:.5f}  ({crossing['interval'][1]:.5f} - {crossing['interval'][2]:.5f})")
+    print(f"Next window: {window[0]:.4f} - {window[1]:.4f} with {window[2]} points")
+    if summary["next_command"] is not None:
+        print(summary["next_command"])
+    if args.output is not None:
+        if os.path.dirname(args.output) and not os.path.exists(os.path.dirname(args.output)):
+            os.makedirs(os.path.dirname(args.output))
+        with open(args.output, "w") as file:
+            json.dump(summary, file, indent = 1)
+        print(f"Wrote {args.output}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Finite-size scaling fit, pseudo-thresholds and curve crossings of the counts in a results store")
+    parser.add_argument("code", choices = ["toric", "surface"])
+    parser.add_argument("--decoder", default = "tree", choices = ["tree", "union_find"])
+    parser.add_argument("--store", default = "./df/results.sqlite", help = "SQLite file written by main.py --workers")
+    parser.add_argument("--window", type = float, nargs = 2, default = None, metavar = ("LOWER", "UPPER"), help = "Only fit the error rates in this range")
+    parser.add_argument("--nu_range", type = float, nargs = 2, default = [0.5, 3.0], metavar = ("LOWER", "UPPER"), help = "Initial search range of nu")
+    parser.add_argument("--n_bootstrap", type = int, default = 200, help = "Bootstrap resamples of the counts")
+    parser.add_argument("--confidence", type = float, default = 0.95, help = "Confidence level of the bootstrap intervals")
+    parser.add_argument("--seed", type = int, default = None, help = "Seed of the bootstrap")
+    parser.add_argument("--n_points", type = int, default = 7, help = "Error rates of the suggested next sweep")
+    parser.add_argument("--n_samples", type = int, default = 10000, help = "Samples per point of the suggested next sweep")
+    parser.add_argument("--output", default = None, help = "JSON file of the summary")
+    args = parser.parse_args()
+    main(args)
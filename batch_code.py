@@ -0,0 +1,434 @@
+import numpy as np
+from lattice import get_geometry, get_toric_geometry, lattice_shape
+from union_find import peel_forest
+from peeling import get_erasure_forests
+
+def pack_shots(bits):
+    """
+    (n_shots, n_cells) booleans to (n_cells, n_lanes) uint64 words, shot i is bit i % 64 of lane i // 64
+    """
+    n_shots, n_cells = bits.shape
+    n_lanes = -(-n_shots//64)
+    # transposed first so packbits runs along contiguous memory
+    padded = np.zeros((n_cells, 64*n_lanes), dtype = bool)
+    padded[:, :n_shots] = bits.T
+    return np.packbits(padded, axis = 1, bitorder = "little").view("<u8")
+
+def unpack_shots(words, n_shots):
+    """
+    (..., n_lanes) uint64 words to (n_shots, ...) booleans, inverse of pack_shots
+    """
+    bits = np.unpackbits(np.ascontiguousarray(words).astype("<u8").view(np.uint8), axis = -1, bitorder = "little")
+    return np.moveaxis(bits[..., :n_shots].astype(bool), -1, 0)
+
+def default_batch_size(size):
+    """
+    Shots per batch that keep the (batch_size, rows, columns) random draw of a batch around 32MB
+    """
+    rows, columns = lattice_shape(size)
+    return max(1, 2**22//(rows*columns))
+
+def new_batch_code(size, n_shots, code = "surface", engine = "batch"):
+    """
+    Empty batch of n_shots codes, packed_surface_code for engine = "packed"
+    """
+    if code == "toric":
+        return batch_toric_code(size, n_shots)
+    if engine == "packed":
+        return packed_surface_code(size, n_shots)
+    return batch_surface_code(size, n_shots)
+
+def flood_lanes(allowed, reached, target, offsets):
+    """
+    Words of the shots whose reached cells grow through allowed cells to a target cell, along flat offsets.
+    allowed and reached are (n_cells, n_lanes) words of pack_shots, reached is consumed.
+    """
+    lanes = np.arange(reached.shape[1])
+    hits = np.zeros(reached.shape[1], dtype = np.uint64)
+    while len(lanes):
+        grown = reached.copy()
+        for offset in offsets:
+            if offset > 0:
+                grown[offset:] |= reached[:-offset]
+            else:
+                grown[:offset] |= reached[-offset:]
+        grown &= allowed
+        hits[lanes] |= np.bitwise_or.reduce(grown[target], axis = 0)
+        # lanes where no shot grew are finished
+        keep = np.bitwise_or.reduce(grown ^ reached, axis = 0) != 0
+        if keep.all():
+            reached = grown
+            continue
+        lanes, reached, allowed = lanes[keep], grown[:, keep], allowed[:, keep]
+    return hits
+
+def spread_lanes(allowed, reached, offsets):
+    """
+    reached grown through allowed cells along flat offsets until no shot grows, for every lane.
+    Unlike flood_lanes the grown words are returned, so a flood through a growing set of allowed cells can resume from them.
+    """
+    while True:
+        grown = reached.copy()
+        for offset in offsets:
+            if offset > 0:
+                grown[offset:] |= reached[:-offset]
+            else:
+                grown[:offset] |= reached[-offset:]
+        grown &= allowed
+        if np.array_equal(grown, reached):
+            return grown
+        reached = grown
+
+class batch_surface_code:
+    """
+    n_shots copies of a surface code stored as boolean arrays of shape (n_shots, *geometry.shape),
+    indexed by the same (y, x) coordinates as surface_code.
+    Sampling, syndrome measurement and the logical check are array operations; decoding peels one shot
+    at a time on the flat indices of lattice_geometry, growing the same trees as surface_code.
+    """
+    def __init__(self, size, n_shots, geometry = None):
+        self.size = size
+        self.n_shots = n_shots
+        self.geometry = get_geometry(size) if geometry is None else geometry
+        self.width = self.geometry.width
+        shape = (n_shots, *self.geometry.shape)
+        self.erasures = np.zeros(shape, dtype = bool)
+        self.syndromes = {
+            "X": np.zeros(shape, dtype = bool),
+            "Z": np.zeros(shape, dtype = bool)
+        }
+        self.operations = {
+            "X": np.zeros(shape, dtype = bool),
+            "Z": np.zeros(shape, dtype = bool)
+        }
+
+    def add_erasure_errors(self, p_error_rate, rng = np.random):
+        """
+        Same channel as topological_code.add_erasure_errors for every shot.
+        A single (n_shots, rows, columns) draw consumes the random stream exactly like n_shots per-shot draws.
+        """
+        random = rng.random((self.n_shots, *self.geometry.shape))
+        erased = (random < p_error_rate) & self.geometry.data_grid
+        if not p_error_rate > 0:
+            return
+        error_random = random/p_error_rate
+        self.erasures |= erased
+        self.operations["X"] ^= erased & (error_random < 1/2)
+        self.operations["Z"] ^= erased & (error_random >= 1/4) & (error_random < 3/4)
+        return
+
+    def add_errors(self, erased, X, Z):
+        """
+        Erasures and Pauli errors as (n_shots, n_data_qubits) booleans over geometry.data_qubits, as sampled by error_models
+        """
+        data_grid = self.geometry.data_grid
+        self.erasures[:, data_grid] |= erased
+        self.operations["X"][:, data_grid] ^= X
+        self.operations["Z"][:, data_grid] ^= Z
+        return
+
+    def add_grid_errors(self, erased, X, Z):
+        """
+        Erasures and Pauli errors as (n_shots, rows, columns) booleans, False away from the data qubits
+        """
+        self.erasures |= erased
+        self.operations["X"] ^= X
+        self.operations["Z"] ^= Z
+        return
+
+    def measure_syndrome(self):
+        for stab_type in ["Z", "X"]:
+            operation = "X" if stab_type == "Z" else "Z"
+            padded = np.pad(self.operations[operation], ((0, 0), (1, 1), (1, 1)))
+            parity = padded[:, 2:, 1:-1] ^ padded[:, :-2, 1:-1] ^ padded[:, 1:-1, 2:] ^ padded[:, 1:-1, :-2]
+            self.syndromes[stab_type] = parity & self.geometry.stabilizer_grid[stab_type]
+        return
+
+    def error_detected(self, stab_type = None):
+        """
+        Boolean array, True for shots with any stabilizer measurement (of stab_type if given)
+        """
+        if stab_type is not None:
+            return self.syndromes[stab_type].any(axis = (1, 2))
+        return self.syndromes["X"].any(axis = (1, 2)) | self.syndromes["Z"].any(axis = (1, 2))
+
+    def has_logical_error(self, shots = None, error_type = None):
+        """
+        Boolean array over shots (all shots if None), same boundary connectivity check as topological_code.has_logical_error,
+        for the errors of error_type only if given
+        """
+        shots = np.arange(self.n_shots) if shots is None else np.asarray(shots)
+        logical = np.zeros(len(shots), dtype = bool)
+        for error_type in (["X", "Z"] if error_type is None else [error_type]):
+            logical |= self.connects_boundaries(self.operations[error_type][shots], error_type)
+        return logical
+
+    def erasure_spans_boundaries(self, error_type = None, include_errors = False):
+        """
+        Shots whose erasure set connects the two boundaries of error_type (either type if None).
+        Residual errors after decoding are contained in the erasure set, so no other shot can have a logical error.
+        With include_errors the errors of error_type count as erased, for noise outside the erasure.
+        """
+        if error_type is None:
+            return self.erasure_spans_boundaries("X", include_errors) | self.erasure_spans_boundaries("Z", include_errors)
+        if include_errors:
+            return self.connects_boundaries(self.erasures | self.operations[error_type], error_type)
+        return self.connects_boundaries(self.erasures, error_type)
+
+    def connects_boundaries(self, qubits, error_type):
+        """
+        Flood fill from the first boundary through qubits along the adjacency of error_type.
+        Same reachability as the search in topological_code.has_logical_error, computed for every shot at once
+        with 64 shots packed in each word.
+        """
+        first, second = self.geometry.boundary_grid[error_type]
+        n = len(qubits)
+        connected = np.zeros(n, dtype = bool)
+        start = qubits & first
+        active = np.flatnonzero(start.any(axis = (1, 2)) & (qubits & second).any(axis = (1, 2)))
+        if not len(active):
+            return connected
+        # cells of the lattice padded by 2, so every adjacency offset is a shift along the cell axis
+        allowed = pack_shots(np.pad(qubits[active], ((0, 0), (2, 2), (2, 2))).reshape(len(active), -1))
+        reached = pack_shots(np.pad(start[active], ((0, 0), (2, 2), (2, 2))).reshape(len(active), -1))
+        target = np.flatnonzero(self.geometry.boundary_mask[error_type][1])
+        hits = flood_lanes(allowed, reached, target, self.geometry.adjacency_offsets[error_type])
+        connected[active] = unpack_shots(hits, len(active))
+        return connected
+
+    def erasure_decoder(self, shots = None, stab_types = None, method = "tree"):
+        """
+        Peel the erasure trees of the given shots (all if None), one shot at a time.
+        With method = "tree" grows the same peeling.erasure_forest as surface_code.construct_erasure_tree, so corrections are identical
+        to the per-shot decoder.
+        With method = "union_find" gives the same corrections as surface_code.erasure_decoder("union_find").
+        stab_types optionally gives, per shot, the list of stabilizer types to decode.
+        """
+        shots = np.arange(self.n_shots) if shots is None else np.asarray(shots)
+        if not len(shots):
+            return
+        erasures, syndromes = self.flat_state(shots)
+        forests = get_erasure_forests(self.geometry) if method == "tree" else None
+        for i, shot in enumerate(shots):
+            erased = erasures[i]
+            if method == "tree":
+                # surface_code roots the trees away from the boundary at next(iter(erasure_copy)),
+                # which follows the iteration order of the erasure set built by add_erasure_errors
+                erasure_set = set()
+                for qubit in np.flatnonzero(erased[self.geometry.data_index]).tolist():
+                    erasure_set.add(self.geometry.data_qubits[qubit])
+                erasure_order = [self.geometry.get_index(qubit) for qubit in erasure_set.copy()]
+            for stab_type in (["X", "Z"] if stab_types is None else stab_types[i]):
+                operation = "X" if stab_type == "Z" else "Z"
+                if method == "tree":
+                    forests[stab_type].grow(erasure_order, np.flatnonzero(syndromes[stab_type][i]).tolist())
+                    corrections = forests[stab_type].peel()
+                else:
+                    corrections = self.union_find_forest(erased, syndromes[stab_type][i].tolist(), stab_type)
+                if corrections:
+                    self.flip(operation, shot, corrections)
+        return
+
+    def flat_state(self, shots):
+        """
+        Erasures and syndromes of the shots as (len(shots), n_cells) booleans over the padded flat indices
+        """
+        erasures = np.pad(self.erasures[shots], ((0, 0), (2, 2), (2, 2))).reshape(len(shots), -1)
+        syndromes = {
+            stab_type: np.pad(self.syndromes[stab_type][shots], ((0, 0), (2, 2), (2, 2))).reshape(len(shots), -1)
+            for stab_type in ["X", "Z"]
+        }
+        return erasures, syndromes
+
+    def flip(self, operation, shot, corrections):
+        """
+        Apply operation to the qubits at the flat indices corrections of one shot
+        """
+        flipped = np.zeros(self.geometry.n_cells, dtype = bool)
+        flipped[corrections] = True
+        self.operations[operation][shot] ^= flipped.reshape(-1, self.width)[2:-2, 2:-2]
+
+    def union_find_forest(self, erased, syndromes, stab_type):
+        """
+        Flat indices of the qubits chosen by union_find.peel_forest, with the edges in the order of surface_code.union_find_decoder
+        """
+        qubits = np.flatnonzero(erased)
+        stabilizers = self.geometry.qubit_stabilizers[stab_type][self.geometry.qubit_number[qubits]]
+        edges = list(zip(stabilizers[:, 0].tolist(), stabilizers[:, 1].tolist(), qubits.tolist()))
+        return peel_forest(self.geometry.n_cells, edges, syndromes, self.geometry.open_index[stab_type])
+
+class packed_surface_code(batch_surface_code):
+    """
+    batch_surface_code with 64 shots packed in each uint64 word. Erasures, syndromes and operations are
+    (n_cells, n_lanes) words over the padded flat indices of lattice_geometry, shot i is bit i % 64 of lane i // 64,
+    so syndrome measurement and the logical check act on 64 shots per word operation.
+    Only the shots given to erasure_decoder are unpacked, and give the same counts as batch_surface_code.
+    """
+    def __init__(self, size, n_shots):
+        self.size = size
+        self.n_shots = n_shots
+        self.n_lanes = -(-n_shots//64)
+        self.geometry = get_geometry(size)
+        self.width = self.geometry.width
+        n_cells = self.geometry.n_cells
+        self.erasures = np.zeros((n_cells, self.n_lanes), dtype = np.uint64)
+        self.syndromes = {
+            "X": np.zeros((n_cells, self.n_lanes), dtype = np.uint64),
+            "Z": np.zeros((n_cells, self.n_lanes), dtype = np.uint64)
+        }
+        self.operations = {
+            "X": np.zeros((n_cells, self.n_lanes), dtype = np.uint64),
+            "Z": np.zeros((n_cells, self.n_lanes), dtype = np.uint64)
+        }
+        self.stabilizer_cells = {stab_type: self.geometry.get_mask(self.geometry.stabilizers[stab_type]) for stab_type in ["X", "Z"]}
+
+    def pack(self, grid):
+        """
+        Words of a (n_shots, rows, columns) boolean array that is False away from the data qubits
+        """
+        words = np.zeros((self.geometry.n_cells, self.n_lanes), dtype = np.uint64)
+        words[self.geometry.data_index] = pack_shots(grid[:, self.geometry.data_grid])
+        return words
+
+    def add_erasure_errors(self, p_error_rate, rng = np.random):
+        """
+        Same draw and thresholds as batch_surface_code.add_erasure_errors, packed once per batch
+        """
+        random = rng.random((self.n_shots, *self.geometry.shape))
+        if not p_error_rate > 0:
+            return
+        erased = (random < p_error_rate) & self.geometry.data_grid
+        error_random = random/p_error_rate
+        self.erasures |= self.pack(erased)
+        self.operations["X"] ^= self.pack(erased & (error_random < 1/2))
+        self.operations["Z"] ^= self.pack(erased & (error_random >= 1/4) & (error_random < 3/4))
+        return
+
+    def add_grid_errors(self, erased, X, Z):
+        self.erasures |= self.pack(erased)
+        self.operations["X"] ^= self.pack(X)
+        self.operations["Z"] ^= self.pack(Z)
+        return
+
+    def add_errors(self, erased, X, Z):
+        data_index = self.geometry.data_index
+        self.erasures[data_index] |= pack_shots(erased)
+        self.operations["X"][data_index] ^= pack_shots(X)
+        self.operations["Z"][data_index] ^= pack_shots(Z)
+        return
+
+    def measure_syndrome(self):
+        width = self.width
+        for stab_type in ["Z", "X"]:
+            operation = self.operations["X" if stab_type == "Z" else "Z"]
+            parity = np.zeros_like(operation)
+            parity[width:] ^= operation[:-width]
+            parity[:-width] ^= operation[width:]
+            parity[1:] ^= operation[:-1]
+            parity[:-1] ^= operation[1:]
+            parity[~self.stabilizer_cells[stab_type]] = 0
+            self.syndromes[stab_type] = parity
+        return
+
+    def error_detected(self, stab_type = None):
+        syndromes = self.syndromes["X"] | self.syndromes["Z"] if stab_type is None else self.syndromes[stab_type]
+        words = np.bitwise_or.reduce(syndromes, axis = 0)
+        return unpack_shots(words, self.n_shots)
+
+    def connects_boundaries(self, qubits, error_type):
+        """
+        connects_boundaries on (n_cells, n_lanes) words, one boolean per shot of those lanes
+        """
+        reached = np.zeros_like(qubits)
+        first, second = (np.flatnonzero(mask) for mask in self.geometry.boundary_mask[error_type])
+        reached[first] = qubits[first]
+        hits = flood_lanes(qubits, reached, second, self.geometry.adjacency_offsets[error_type])
+        return unpack_shots(hits, 64*qubits.shape[1])
+
+    def erasure_spans_boundaries(self, error_type = None, include_errors = False):
+        if error_type is None:
+            return self.erasure_spans_boundaries("X", include_errors) | self.erasure_spans_boundaries("Z", include_errors)
+        qubits = self.erasures | self.operations[error_type] if include_errors else self.erasures
+        return self.connects_boundaries(qubits, error_type)[:self.n_shots]
+
+    def has_logical_error(self, shots = None, error_type = None):
+        shots = np.arange(self.n_shots) if shots is None else np.asarray(shots)
+        # only the lanes holding the shots are flooded
+        lanes, lane_index = np.unique(shots//64, return_inverse = True)
+        logical = np.zeros(len(shots), dtype = bool)
+        for error_type in (["X", "Z"] if error_type is None else [error_type]):
+            logical |= self.connects_boundaries(self.operations[error_type][:, lanes], error_type)[64*lane_index + shots % 64]
+        return logical
+
+    def flat_state(self, shots):
+        shifts = (shots % 64).astype(np.uint64)
+        unpack = lambda words: np.ascontiguousarray(((words[:, shots//64] >> shifts) & np.uint64(1)).T.astype(bool))
+        return unpack(self.erasures), {stab_type: unpack(self.syndromes[stab_type]) for stab_type in ["X", "Z"]}
+
+    def flip(self, operation, shot, corrections):
+        self.operations[operation][corrections, shot//64] ^= np.uint64(1) << np.uint64(shot % 64)
+
+class batch_toric_code(batch_surface_code):
+    """
+    n_shots copies of toric_code as (n_shots, size, size) boolean arrays. Syndromes wrap around with np.roll,
+    the logical check is a parity over the cuts of each homology class, and decoding peels the same
+    union-find forests as toric_code one shot at a time.
+    """
+    def __init__(self, size, n_shots):
+        super().__init__(size, n_shots, get_toric_geometry(size))
+
+    def measure_syndrome(self):
+        for stab_type in ["Z", "X"]:
+            operation = self.operations["X" if stab_type == "Z" else "Z"]
+            parity = np.roll(operation, 1, axis = 1) ^ np.roll(operation, -1, axis = 1) ^ np.roll(operation, 1, axis = 2) ^ np.roll(operation, -1, axis = 2)
+            self.syndromes[stab_type] = parity & self.geometry.stabilizer_grid[stab_type]
+        return
+
+    def has_logical_error(self, shots = None, error_type = None):
+        """
+        Boolean array over shots (all shots if None), same cut parities as toric_code.has_logical_error,
+        for the errors of error_type only if given
+        """
+        shots = np.arange(self.n_shots) if shots is None else np.asarray(shots)
+        logical = np.zeros(len(shots), dtype = bool)
+        for error_type in (["X", "Z"] if error_type is None else [error_type]):
+            operations = self.operations[error_type][shots]
+            for cut in self.geometry.cut_grid[error_type]:
+                logical |= np.sum(operations & cut, axis = (1, 2))%2 == 1
+        return logical
+
+    def erasure_spans_boundaries(self, error_type = None, include_errors = False):
+        """
+        Shots whose erasure crosses every translate of one of the cuts of error_type (either type if None).
+        Residual errors after decoding are closed chains inside the erasure set, so no other shot can have a logical error.
+        With include_errors the errors of error_type count as erased, for noise outside the erasure.
+        """
+        if error_type is None:
+            return self.erasure_spans_boundaries("X", include_errors) | self.erasure_spans_boundaries("Z", include_errors)
+        qubits = self.erasures | self.operations[error_type] if include_errors else self.erasures
+        column, row = self.geometry.cut_parity[error_type]
+        columns = qubits.any(axis = 1)[:, column::2].all(axis = 1)
+        rows = qubits.any(axis = 2)[:, row::2].all(axis = 1)
+        return columns | rows
+
+    def erasure_decoder(self, shots = None, stab_types = None, method = "union_find"):
+        """
+        Peel the erasure forests of the given shots (all if None), with the corrections of toric_code.erasure_decoder.
+        stab_types optionally gives, per shot, the list of stabilizer types to decode
+        """
+        if method not in ["tree", "union_find"]:
+            raise ValueError(f"Unknown decoder {method}")
+        shots = np.arange(self.n_shots) if shots is None else np.asarray(shots)
+        if not len(shots):
+            return
+        erasures = self.erasures[shots].reshape(len(shots), -1)
+        syndromes = {stab_type: self.syndromes[stab_type][shots].reshape(len(shots), -1) for stab_type in ["X", "Z"]}
+        for i, shot in enumerate(shots):
+            for stab_type in (["X", "Z"] if stab_types is None else stab_types[i]):
+                operation = "X" if stab_type == "Z" else "Z"
+                corrections = self.union_find_forest(erasures[i], syndromes[stab_type][i].tolist(), stab_type)
+                if corrections:
+                    flipped = np.zeros(self.geometry.n_cells, dtype = bool)
+                    flipped[corrections] = True
+                    self.operations[operation][shot] ^= flipped.reshape(-1, self.width)
+        return
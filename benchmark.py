@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import simulator
+from topological_code import surface_code, toric_code
+"""
+Benchmarks of the per-shot stages (add_erasure_errors, measure_syndrome, construct_erasure_tree, peel_erasure_trees
+or erasure_decoder, has_logical_error) and of whole simulate calls per engine, over a grid of sizes and error rates.
+
+Reports shots per second, per-shot latency percentiles of every stage and the peak traced memory of each simulate call,
+and writes everything as JSON. With --baseline the results are compared to an earlier JSON file,
+and the exit status is 1 if any benchmark got slower than the tolerance allows.
+"""
+
+percentiles = [50, 90, 99]
+
+def benchmark_stages(size, phys_error_rate, n_shots, code, decoder, seed):
+    """
+    Seconds of every stage of the per-shot pipeline of simulator.simulate_shots for n_shots shots.
+    Undetected shots are not decoded, as in simulate_shots, so decoder stages have fewer timings.
+    """
+    (toric_code(size) if code == "toric" else surface_code(size)).measure_syndrome()
+    np.random.seed(seed)
+    timings = {}
+    def timed(stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+    for _ in range(n_shots):
+        encoding = toric_code(size) if code == "toric" else surface_code(size)
+        timed("add_erasure_errors", encoding.add_erasure_errors, phys_error_rate)
+        timed("measure_syndrome", encoding.measure_syndrome)
+        if encoding.error_detected():
+            if code == "surface" and decoder == "tree":
+                timed("construct_erasure_tree", encoding.construct_erasure_tree)
+                timed("peel_erasure_trees", encoding.peel_erasure_trees)
+            else:
+                timed("erasure_decoder", encoding.erasure_decoder, decoder)
+        timed("has_logical_error", encoding.has_logical_error)
+    return timings
+
+def benchmark_simulate(size, phys_error_rate, n_samples, code, engine, decoder, batch_size, seed, repeats = 3, memory = True):
+    """
+    Fastest of repeats seconds of simulator.simulate at one point, after a short warm up call that builds the shared geometry,
+    and with memory the peak bytes traced by tracemalloc in one more identical call
+    """
+    simulator.simulate([size], phys_error_rate, phys_error_rate, 1, min(n_samples, 10), code, engine, batch_size, decoder)
+    seconds = np.inf
+    for _ in range(repeats):
+        np.random.seed(seed)
+        start = time.perf_counter()
+        simulator.simulate([size], phys_error_rate, phys_error_rate, 1, n_samples, code, engine, batch_size, decoder)
+        seconds = min(seconds, time.perf_counter() - start)
+    peak = None
+    if memory:
+        np.random.seed(seed)
+        tracemalloc.start()
+        simulator.simulate([size], phys_error_rate, phys_error_rate, 1, n_samples, code, engine, batch_size, decoder)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak
+
+def stage_records(size, phys_error_rate, code, decoder, timings):
+    records = []
+    for stage, seconds in timings.items():
+        seconds = np.array(seconds)
+        record = {"benchmark": "stage", "stage": stage, "code": code, "engine": "shot", "decoder": decoder, "size": size,
+            "physical_error_rate": phys_error_rate, "calls": len(seconds), "shots_per_second": float(len(seconds)/seconds.sum())}
+        record.update({f"p{q}_us": float(np.percentile(seconds, q)*1e6) for q in percentiles})
+        records.append(record)
+    return records
+
+def record_key(record):
+    return tuple(record.get(field) for field in ["benchmark", "stage", "code", "engine", "decoder", "size", "physical_error_rate"])
+
+def compare(results, baseline, tolerance):
+    """
+    Ratio of shots per second to the baseline for every benchmark in both,
+    a regression when it is below 1/(1 + tolerance)
+    """
+    baseline_records = {record_key(record): record for record in baseline["results"]}
+    comparisons = []
+    for record in results["results"]:
+        reference = baseline_records.get(record_key(record))
+        if reference is None:
+            continue
+        ratio = record["shots_per_second"]/reference["shots_per_second"]
+        comparisons.append((record, ratio, ratio < 1/(1 + tolerance)))
+    return comparisons
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def describe(record):
+    name = record["stage"] or f"simulate {record['engine']}"
+    return f"{name:24} {record['code']:8} {record['decoder']:10} size {record['size']:4} p {record['physical_error_rate']:.3f}"
+
+def main(args):
+    results = {
+        "started": datetime.now().isoformat(),
+        "python": sys.version.split()[0], "numpy": np.__version__, "platform": platform.platform(),
+        "commit": git_commit(), "arguments": vars(args), "results": []
+    }
+    for size in args.sizes:
+        for phys_error_rate in args.error_rates:
+            if not args.skip_stages:
+                timings = benchmark_stages(size, phys_error_rate, args.n_shots, args.code, args.decoder, args.seed)
+                for record in stage_records(size, phys_error_rate, args.code, args.decoder, timings):
+                    results["results"].append(record)
+                    print(f"{describe(record)} {record['shots_per_second']:12.1f} calls/s  p50 {record['p50_us']:10.1f} us  p99 {record['p99_us']:10.1f} us")
+            for engine in args.engines:
+                try:
+                    simulator.check_engine([size], args.code, engine)
+                except ValueError:
+                    continue
+                n_samples = args.n_shots if engine == "shot" else args.n_samples
+                seconds, peak = benchmark_simulate(size, phys_error_rate, n_samples, args.code, engine, args.decoder, args.batch_size, args.seed, args.repeats, not args.no_memory)
+                record = {"benchmark": "simulate", "stage": None, "code": args.code, "engine": engine, "decoder": args.decoder, "size": size,
+                    "physical_error_rate": phys_error_rate, "n_samples": n_samples, "seconds": seconds,
+                    "shots_per_second": n_samples/seconds, "peak_bytes": peak}
+                results["results"].append(record)
+                memory = "" if peak is None else f"  peak {peak/2**20:8.1f} MiB"
+                print(f"{describe(record)} {record['shots_per_second']:12.1f} shots/s{memory}")
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print(f"Compared to {args.baseline} (commit {baseline.get('commit')})")
+        for record, ratio, regression in compare(results, baseline, args.tolerance):
+            print(f"{describe(record)} {ratio:6.2f}x{'  REGRESSION' if regression else ''}")
+            if regression:
+                regressions.append(record)
+    output = args.output or f"df/benchmark_{datetime.now().strftime('%m%d%Y_%H%M%S')}.json"
+    if os.path.dirname(output) and not os.path.exists(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, "w") as file:
+        json.dump(results, file, indent = 1)
+    print(f"Wrote {output}")
+    if regressions:
+        print(f"{len(regressions)} benchmarks slower than the baseline by more than {args.tolerance:.0%}")
+        sys.exit(1)
+    return
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Throughput and latency benchmarks of the decoder pipeline and simulate engines")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [5, 11, 25, 51, 101], help = "Lattice sizes")
+    parser.add_argument("--error_rates", type = float, nargs = "+", default = [0.1, 0.3, 0.5], help = "Physical error rates")
+    parser.add_argument("--code", default = "surface", choices = ["toric", "surface"])
+    parser.add_argument("--decoder", default = "tree", choices = ["tree", "union_find"])
+    parser.add_argument("--engines", nargs = "+", default = ["shot", "batch", "packed"], choices = ["shot", "batch", "packed"],
+        help = "Engines of the simulate benchmarks, the ones a code or size does not support are skipped")
+    parser.add_argument("--n_shots", type = int, default = 50, help = "Shots of the stage benchmarks and of simulate with the shot engine")
+    parser.add_argument("--n_samples", type = int, default = 2000, help = "Samples of simulate with the batch engines")
+    parser.add_argument("--batch_size", type = int, default = None, help = "Samples per batch for the batch engines")
+    parser.add_argument("--seed", type = int, default = 0, help = "Seed of np.random before every benchmark, so runs time the same shots")
+    parser.add_argument("--repeats", type = int, default = 3, help = "Timed simulate calls per benchmark, the fastest is reported")
+    parser.add_argument("--skip_stages", action = "store_true", help = "Only benchmark simulate")
+    parser.add_argument("--no_memory", action = "store_true", help = "Skip the traced second simulate call that measures peak memory")
+    parser.add_argument("--output", default = None, help = "JSON file of the results, df/benchmark_<time>.json by default")
+    parser.add_argument("--baseline", default = None, help = "JSON file of an earlier run to compare shots per second with")
+    parser.add_argument("--tolerance", type = float, default = 0.25, help = "Slowdown relative to the baseline reported as a regression")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,115 @@
+import argparse
+import numpy as np
+from lattice import get_geometry, get_toric_geometry
+from peeling import get_erasure_forests
+from union_find import peel_forest
+"""
+Stateless batch decoding of erasure and syndrome records produced outside this package, without code objects.
+
+A record of n_shots shots is two arrays: erasures of shape (n_shots, n_data) over geometry.data_qubits and syndromes
+of shape (n_shots, n_X + n_Z) over geometry.stabilizers["X"] followed by geometry.stabilizers["Z"], nonzero where erased
+or measured -1. Corrections are (n_shots, 2, n_data) booleans over geometry.data_qubits, the X correction (from the Z
+syndromes) first and the Z correction second. Inputs are only read through np.nonzero chunk by chunk, so bool or uint8
+arrays and np.memmap files are decoded in place, and decode_file streams .npy files larger than memory.
+"""
+
+def decode_batch(size, erasures, syndromes, code = "surface", decoder = "tree", out = None, chunk_shots = 4096):
+    """
+    Corrections of every shot of a record, written to out when given (an array or memmap of the corrections shape).
+    The tree decoder peels the trees of peeling.erasure_forest grown in data qubit order, so they can be rooted at other
+    stabilizers than those of surface_code and give corrections differing by stabilizers, the union_find decoder gives the
+    corrections of the batch engine. The two decoders span the clusters with different trees, so their corrections can also differ
+    by a logical operator on an erasure spanning the boundaries. The toric code is decoded with union_find.
+    Syndromes outside the erasure are ignored and a cluster away from the boundary with odd syndrome parity keeps a residual.
+    """
+    geometry = get_toric_geometry(size) if code == "toric" else get_geometry(size)
+    if decoder not in ["tree", "union_find"]:
+        raise ValueError(f"Unknown decoder {decoder}")
+    n_data = len(geometry.data_qubits)
+    n_X = len(geometry.stabilizers["X"])
+    columns = np.concatenate([geometry.stabilizer_index["X"], geometry.stabilizer_index["Z"]])
+    erasures, syndromes = np.asarray(erasures), np.asarray(syndromes)
+    n_shots = len(erasures)
+    if erasures.shape != (n_shots, n_data) or syndromes.shape != (n_shots, len(columns)):
+        raise ValueError(f"Size {size} of the {code} code needs erasures of shape (n_shots, {n_data}) and syndromes of shape (n_shots, {len(columns)}), "
+            f"not {erasures.shape} and {syndromes.shape}")
+    if out is None:
+        out = np.zeros((n_shots, 2, n_data), dtype = bool)
+    elif out.shape != (n_shots, 2, n_data):
+        raise ValueError(f"Corrections of shape {out.shape} instead of {(n_shots, 2, n_data)}")
+    forests = get_erasure_forests(geometry) if code == "surface" and decoder == "tree" else None
+    for start in range(0, n_shots, chunk_shots):
+        stop = min(n_shots, start + chunk_shots)
+        shots, qubits = np.nonzero(erasures[start:stop])
+        erased_cells = geometry.data_index[qubits].tolist()
+        erasure_bounds = np.searchsorted(shots, np.arange(stop - start + 1)).tolist()
+        # X syndromes come first in every shot, so the (shot, type) keys 2*shot + type are sorted
+        shots, stabilizers = np.nonzero(syndromes[start:stop])
+        syndrome_cells = columns[stabilizers].tolist()
+        syndrome_bounds = np.searchsorted(2*shots + (stabilizers >= n_X), np.arange(2*(stop - start) + 1)).tolist()
+        corrected_shots, corrected_types, corrected_cells = [], [], []
+        for i in range(stop - start):
+            erased = erased_cells[erasure_bounds[i]:erasure_bounds[i + 1]]
+            if not erased:
+                continue
+            for type_number, stab_type in enumerate(["X", "Z"]):
+                marked = syndrome_cells[syndrome_bounds[2*i + type_number]:syndrome_bounds[2*i + type_number + 1]]
+                if not marked:
+                    continue
+                if forests is not None:
+                    forests[stab_type].grow(erased, marked)
+                    corrections = forests[stab_type].peel()
+                else:
+                    corrections = union_find_corrections(geometry, erased, marked, stab_type)
+                corrected_shots.extend([start + i]*len(corrections))
+                # Z stabilizers detect X errors
+                corrected_types.extend([1 - type_number]*len(corrections))
+                corrected_cells.extend(corrections)
+        out[start:stop] = False
+        out[corrected_shots, corrected_types, geometry.qubit_number[corrected_cells]] = True
+    return out
+
+def union_find_corrections(geometry, erased, marked, stab_type):
+    """
+    Flat indices of the correction of union_find.peel_forest, with the edges in the order of batch_surface_code.union_find_forest
+    """
+    stabilizers = geometry.qubit_stabilizers[stab_type][geometry.qubit_number[erased]]
+    syndromes = [0]*geometry.n_cells
+    for stab in marked:
+        syndromes[stab] = 1
+    return peel_forest(geometry.n_cells, list(zip(stabilizers[:, 0].tolist(), stabilizers[:, 1].tolist(), erased)), syndromes, geometry.open_index[stab_type])
+
+def decode_file(size, erasure_path, syndrome_path, output_path, code = "surface", decoder = "tree", chunk_shots = 4096):
+    """
+    decode_batch of the records in two .npy files, memory mapped, into a .npy file of corrections written chunk by chunk
+    """
+    erasures = np.load(erasure_path, mmap_mode = "r")
+    syndromes = np.load(syndrome_path, mmap_mode = "r")
+    geometry = get_toric_geometry(size) if code == "toric" else get_geometry(size)
+    out = np.lib.format.open_memmap(output_path, mode = "w+", dtype = bool, shape = (len(erasures), 2, len(geometry.data_qubits)))
+    decode_batch(size, erasures, syndromes, code, decoder, out, chunk_shots)
+    out.flush()
+    return out
+
+def batch_records(encoding):
+    """
+    Erasures and syndromes of a batch_code batch in the record layout of decode_batch
+    """
+    geometry = encoding.geometry
+    pad = (geometry.width - geometry.shape[1])//2
+    flat = lambda grid: np.pad(grid, ((0, 0), (pad, pad), (pad, pad))).reshape(len(grid), -1)
+    erasures = flat(encoding.erasures)[:, geometry.data_index]
+    syndromes = np.concatenate([flat(encoding.syndromes[stab_type])[:, geometry.stabilizer_index[stab_type]] for stab_type in ["X", "Z"]], axis = 1)
+    return erasures, syndromes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Decode erasure and syndrome records stored as .npy files, memory mapped")
+    parser.add_argument("size", type = int)
+    parser.add_argument("erasures", help = ".npy file of (n_shots, n_data) erasures")
+    parser.add_argument("syndromes", help = ".npy file of (n_shots, n_X + n_Z) syndromes, X stabilizers first")
+    parser.add_argument("output", help = ".npy file the (n_shots, 2, n_data) X and Z corrections are written to")
+    parser.add_argument("--code", default = "surface", choices = ["toric", "surface"])
+    parser.add_argument("--decoder", default = "tree", choices = ["tree", "union_find"])
+    parser.add_argument("--chunk_shots", type = int, default = 4096, help = "Shots read and decoded at a time")
+    args = parser.parse_args()
+    decode_file(args.size, args.erasures, args.syndromes, args.output, args.code, args.decoder, args.chunk_shots)
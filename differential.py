@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from lattice import get_geometry, get_toric_geometry
+from batch_code import new_batch_code, unpack_shots
+from topological_code import surface_code, toric_code
+import decoding
+"""
+Differential testing of the decoder backends on random erasure and Pauli patterns.
+
+Every backend decodes the same patterns, (n_shots, n_data) erasures and X and Z errors over geometry.data_qubits, and returns
+the residual syndromes, (n_shots, n_X + n_Z) in the record layout of decoding, and the logical outcome of every shot.
+Backends of one group are meant to give the same corrections and must agree exactly, and every backend must clear
+every syndrome and can only fail on a shot whose erasure spans the boundaries. Patterns are deduplicated before decoding.
+A failing pattern is minimized by removing erased qubits and Pauli errors while it still fails.
+"""
+
+backends = {}
+
+def register(name, group, codes):
+    """
+    Add a backend(size, code, erased, X, Z) -> (residual syndromes, logical) of the codes in codes to backends
+    """
+    def add(backend):
+        backends[name] = (backend, group, codes)
+        return backend
+    return add
+
+def get_code_geometry(size, code):
+    return get_toric_geometry(size) if code == "toric" else get_geometry(size)
+
+def shot_backend(decoder):
+    """
+    The reference per-shot decoder, surface_code or toric_code with the erasure added in data qubit order like add_erasure_errors
+    """
+    def backend(size, code, erased, X, Z):
+        geometry = get_code_geometry(size, code)
+        columns = stabilizer_columns(geometry)
+        syndromes = np.zeros((len(erased), len(columns["X"]) + len(columns["Z"])), dtype = bool)
+        logical = np.zeros(len(erased), dtype = bool)
+        for shot in range(len(erased)):
+            encoding = toric_code(size) if code == "toric" else surface_code(size)
+            for qubit in np.flatnonzero(erased[shot]).tolist():
+                encoding.erasure_set.add(geometry.data_qubits[qubit])
+            for error_type, errors in [("X", X), ("Z", Z)]:
+                encoding.operations[error_type].update(geometry.data_qubits[qubit] for qubit in np.flatnonzero(errors[shot]).tolist())
+            encoding.measure_syndrome()
+            if encoding.error_detected():
+                encoding.erasure_decoder(decoder)
+                encoding.measure_syndrome()
+            for stab_type in ["X", "Z"]:
+                for stab in encoding.syndromes[stab_type]:
+                    syndromes[shot, columns[stab_type][stab]] = True
+            logical[shot] = encoding.has_logical_error()
+        return syndromes, logical
+    return backend
+
+def batch_backend(engine, decoder):
+    """
+    batch_surface_code, packed_surface_code or batch_toric_code decoding every shot
+    """
+    def backend(size, code, erased, X, Z):
+        encoding = new_batch_code(size, len(erased), code, engine)
+        encoding.add_errors(erased, X, Z)
+        encoding.measure_syndrome()
+        encoding.erasure_decoder(None, None, decoder)
+        encoding.measure_syndrome()
+        return residual_syndromes(encoding), encoding.has_logical_error()
+    return backend
+
+def decode_batch_backend(decoder):
+    """
+    decoding.decode_batch on the records of the patterns, corrections applied to a batch code
+    """
+    def backend(size, code, erased, X, Z):
+        encoding = new_batch_code(size, len(erased), code)
+        encoding.add_errors(erased, X, Z)
+        encoding.measure_syndrome()
+        corrections = decoding.decode_batch(size, *decoding.batch_records(encoding), code, decoder)
+        encoding.add_errors(np.zeros_like(erased), corrections[:, 0], corrections[:, 1])
+        encoding.measure_syndrome()
+        return residual_syndromes(encoding), encoding.has_logical_error()
+    return backend
+
+register("shot_tree", "tree", ["surface"])(shot_backend("tree"))
+register("batch_tree", "tree", ["surface"])(batch_backend("batch", "tree"))
+register("packed_tree", "tree", ["surface"])(batch_backend("packed", "tree"))
+register("shot_union_find", "union_find", ["surface", "toric"])(shot_backend("union_find"))
+register("batch_union_find", "union_find", ["surface", "toric"])(batch_backend("batch", "union_find"))
+register("packed_union_find", "union_find", ["surface"])(batch_backend("packed", "union_find"))
+register("decode_batch_union_find", "union_find", ["surface", "toric"])(decode_batch_backend("union_find"))
+# grown in data qubit order, so its trees can be rooted elsewhere than surface_code's and it is only checked on its own
+register("decode_batch_tree", "decode_batch_tree", ["surface"])(decode_batch_backend("tree"))
+
+def stabilizer_columns(geometry):
+    """
+    {stab_type: {stabilizer: column}} of the record layout, X stabilizers first
+    """
+    n_X = len(geometry.stabilizers["X"])
+    return {stab_type: {stab: offset + k for k, stab in enumerate(geometry.stabilizers[stab_type])} for stab_type, offset in [("X", 0), ("Z", n_X)]}
+
+def residual_syndromes(encoding):
+    """
+    Syndromes of a batch code in the record layout
+    """
+    if encoding.syndromes["X"].dtype == np.uint64:
+        return np.concatenate([unpack_shots(encoding.syndromes[stab_type][encoding.geometry.stabilizer_index[stab_type]], encoding.n_shots)
+            for stab_type in ["X", "Z"]], axis = 1)
+    return decoding.batch_records(encoding)[1]
+
+def random_patterns(size, code, n_shots, rng, p_range = (0.05, 0.6)):
+    """
+    n_shots erasure patterns, every shot with its own erasure rate drawn uniformly from p_range and a uniformly random Pauli
+    on each erased qubit, as add_erasure_errors
+    """
+    n_data = len(get_code_geometry(size, code).data_qubits)
+    erased = rng.random((n_shots, n_data)) < rng.uniform(*p_range, size = (n_shots, 1))
+    pauli = rng.random((n_shots, n_data))
+    return erased, erased & (pauli < 1/2), erased & (pauli >= 1/4) & (pauli < 3/4)
+
+def unique_patterns(erased, X, Z):
+    """
+    The distinct patterns, and for every shot the index of its pattern
+    """
+    rows = np.packbits(np.concatenate([erased, X, Z], axis = 1), axis = 1)
+    _, first, inverse = np.unique(rows.view(np.dtype((np.void, rows.shape[1]))).ravel(), return_index = True, return_inverse = True)
+    return erased[first], X[first], Z[first], inverse
+
+def check(size, code, erased, X, Z, names):
+    """
+    Boolean array of the patterns where a backend leaves a syndrome, fails without a spanning erasure,
+    or disagrees with the first backend of its group, and the results of every backend
+    """
+    results = {name: backends[name][0](size, code, erased, X, Z) for name in names}
+    spanning = new_batch_code(size, len(erased), code)
+    spanning.add_errors(erased, np.zeros_like(erased), np.zeros_like(erased))
+    spans = spanning.erasure_spans_boundaries()
+    failed = np.zeros(len(erased), dtype = bool)
+    references = {}
+    for name, (syndromes, logical) in results.items():
+        failed |= syndromes.any(axis = 1) | (logical & ~spans)
+        group = backends[name][1]
+        if group in references:
+            reference_syndromes, reference_logical = results[references[group]]
+            failed |= (syndromes != reference_syndromes).any(axis = 1) | (logical != reference_logical)
+        else:
+            references[group] = name
+    return failed, results
+
+def minimize(size, code, erased, X, Z, names):
+    """
+    A failing pattern with erased qubits and Pauli errors removed one at a time while it still fails,
+    until removing any single one makes it pass
+    """
+    fails = lambda erased, X, Z: bool(check(size, code, erased[None], X[None], Z[None], names)[0][0])
+    changed = True
+    while changed:
+        changed = False
+        for qubit in np.flatnonzero(erased):
+            trial = erased.copy()
+            trial[qubit] = False
+            if fails(trial, X & trial, Z & trial):
+                erased, X, Z, changed = trial, X & trial, Z & trial, True
+        for errors in ["X", "Z"]:
+            for qubit in np.flatnonzero(X if errors == "X" else Z):
+                trial_X, trial_Z = X.copy(), Z.copy()
+                (trial_X if errors == "X" else trial_Z)[qubit] = False
+                if fails(erased, trial_X, trial_Z):
+                    X, Z, changed = trial_X, trial_Z, True
+    return erased, X, Z
+
+def describe(size, code, erased, X, Z, names):
+    """
+    A failing pattern as qubit coordinates, with the residual syndromes and logical outcome of every backend
+    """
+    geometry = get_code_geometry(size, code)
+    stabilizers = list(geometry.stabilizers["X"]) + list(geometry.stabilizers["Z"])
+    coordinates = lambda qubits: [list(geometry.data_qubits[qubit]) for qubit in np.flatnonzero(qubits)]
+    results = check(size, code, erased[None], X[None], Z[None], names)[1]
+    return {
+        "size": list(size) if isinstance(size, tuple) else size, "code": code,
+        "erasure": coordinates(erased), "X": coordinates(X), "Z": coordinates(Z),
+        "backends": {name: {"syndromes": [list(stabilizers[column]) for column in np.flatnonzero(syndromes[0])], "logical": bool(logical[0])}
+            for name, (syndromes, logical) in results.items()}
+    }
+
+def check_task(task):
+    """
+    Decode one batch of random patterns of a size and minimize up to max_failures of the failing ones
+    """
+    size, code, names, n_shots, p_range, seed, max_failures = task
+    erased, X, Z, inverse = unique_patterns(*random_patterns(size, code, n_shots, np.random.default_rng(seed), p_range))
+    failed = np.flatnonzero(check(size, code, erased, X, Z, names)[0])
+    return len(erased), [describe(size, code, *minimize(size, code, erased[shot], X[shot], Z[shot], names), names) for shot in failed[:max_failures]]
+
+def run(size_list, n_shots, code = "surface", names = None, p_range = (0.05, 0.6), seed = None, batch_size = 50000, max_failures = 1, workers = 1):
+    """
+    Differential test of the backends of code (all registered ones by default) on n_shots random patterns split over size_list,
+    in batches of batch_size drawn from generators seeded by the root seed, the size and the batch.
+    workers = None or 0 uses one process per core, workers = 1 runs the batches in this process.
+    Returns the number of distinct patterns decoded and the minimized failing patterns, at most max_failures per batch.
+    """
+    names = [name for name, (backend, group, codes) in backends.items() if code in codes] if names is None else names
+    seed = np.random.SeedSequence(seed).entropy
+    n_size = n_shots//len(size_list)
+    tasks = [(size, code, names, min(batch_size, n_size - start), p_range,
+              np.random.SeedSequence(seed, spawn_key = (*(size if isinstance(size, tuple) else (size,)), batch)), max_failures)
+             for size in size_list for batch, start in enumerate(range(0, n_size, batch_size))]
+    if workers == 1:
+        finished = map(check_task, tasks)
+    else:
+        executor = ProcessPoolExecutor(max_workers = workers or None)
+        finished = executor.map(check_task, tasks)
+    decoded = 0
+    failures = []
+    try:
+        for task_decoded, task_failures in finished:
+            decoded += task_decoded
+            failures.extend(task_failures)
+    finally:
+        if workers != 1:
+            executor.shutdown(cancel_futures = True)
+    return decoded, failures
+
+def main(args):
+    sizes = [tuple(int(length) for length in size.split("x")) if "x" in size else int(size) for size in args.sizes]
+    names = args.backends
+    if names is not None and any(args.code not in backends[name][2] for name in names):
+        raise ValueError(f"Backends of the {args.code} code: {[name for name, (backend, group, codes) in backends.items() if args.code in codes]}")
+    start = time.perf_counter()
+    decoded, failures = run(sizes, args.shots, args.code, names, tuple(args.p_range), args.seed, args.batch_size, args.max_failures, args.workers)
+    seconds = time.perf_counter() - start
+    print(f"{args.shots} shots of sizes {args.sizes}, {decoded} distinct patterns decoded by every backend in {seconds:.1f}s")
+    for failure in failures:
+        print(json.dumps(failure))
+    if args.output is not None and failures:
+        if os.path.dirname(args.output) and not os.path.exists(os.path.dirname(args.output)):
+            os.makedirs(os.path.dirname(args.output))
+        with open(args.output, "w") as file:
+            json.dump(failures, file, indent = 1)
+        print(f"Wrote {args.output}")
+    if failures:
+        print(f"{len(failures)} failing patterns")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Differential test of the decoder backends on random erasure patterns")
+    parser.add_argument("--shots", type = int, default = 1000000, help = "Random patterns, split evenly over the sizes")
+    parser.add_argument("--sizes", nargs = "+", default = ["3", "5", "7", "3x5"], help = "Lattice sizes, ROWSxCOLUMNS for rectangular surface codes")
+    parser.add_argument("--code", default = "surface", choices = ["toric", "surface"])
+    parser.add_argument("--backends", nargs = "+", default = None, choices = list(backends), help = "Backends to compare, every one of the code by default")
+    parser.add_argument("--p_range", type = float, nargs = 2, default = [0.05, 0.6], metavar = ("LOWER", "UPPER"), help = "Range of the erasure rate of each pattern")
+    parser.add_argument("--seed", type = int, default = None)
+    parser.add_argument("--batch_size", type = int, default = 50000, help = "Patterns drawn and deduplicated at a time")
+    parser.add_argument("--max_failures", type = int, default = 1, help = "Failing patterns minimized per batch")
+    parser.add_argument("--workers", type = int, default = 0, help = "Processes, 0 for one per core")
+    parser.add_argument("--output", default = None, help = "JSON file of the minimized failing patterns")
+    args = parser.parse_args()
+    main(args)
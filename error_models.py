@@ -0,0 +1,148 @@
+import numpy as np
+from batch_code import new_batch_code, default_batch_size
+
+"""
+Noise channels for the batch engines. A channel samples (erased, X, Z) booleans of shape (n_shots, n_data_qubits)
+over geometry.data_qubits, so nothing is drawn for stabilizer sites, and every part of a channel
+(which qubits are erased, which Pauli they get, ...) has its own random stream.
+contained is True when a channel only puts errors on erased qubits, which the erasure decoders rely on.
+"""
+
+class erasure_channel:
+    """
+    Erase each data qubit with probability p_erasure and apply I, X, Y or Z to it with probabilities pauli
+    """
+    n_streams = 2
+    contained = True
+
+    def __init__(self, p_erasure, pauli = (1/4, 1/4, 1/4, 1/4)):
+        self.p_erasure = p_erasure
+        self.pauli = pauli
+
+    def sample(self, streams, n_shots, geometry):
+        erased = streams[0].random((n_shots, len(geometry.data_qubits))) < self.p_erasure
+        X, Z = sample_paulis(streams[1], erased, self.pauli)
+        return erased, X, Z
+
+def biased_erasure_channel(p_erasure, bias):
+    """
+    Erasures whose Pauli is Z with bias times the probability of X or Y together, I with probability 1/4.
+    bias = 1/2 is erasure_channel
+    """
+    return erasure_channel(p_erasure, (1/4, 3/8/(bias + 1), 3/8/(bias + 1), 3/4*bias/(bias + 1)))
+
+class correlated_erasure_channel:
+    """
+    Each data qubit starts an erasure with probability p_erasure, which also erases each of its diagonal
+    neighbours, the nearest data qubits, with probability p_spread. Erased qubits get a uniformly random Pauli.
+    """
+    n_streams = 3
+    contained = True
+
+    def __init__(self, p_erasure, p_spread):
+        self.p_erasure = p_erasure
+        self.p_spread = p_spread
+        self.neighbours = {}
+
+    def get_neighbours(self, geometry):
+        """
+        (n_data_qubits, 4) data qubit numbers of the diagonal neighbours, -1 off the lattice
+        """
+        if geometry not in self.neighbours:
+            self.neighbours[geometry] = np.array([[geometry.qubit_number[geometry.get_index((y + d_y, x + d_x))]
+                for d_y, d_x in [(1,1), (1,-1), (-1,1), (-1,-1)]] for y, x in geometry.data_qubits], dtype = np.int64).reshape(-1, 4)
+        return self.neighbours[geometry]
+
+    def sample(self, streams, n_shots, geometry):
+        neighbours = self.get_neighbours(geometry)
+        seeds = streams[0].random((n_shots, len(geometry.data_qubits))) < self.p_erasure
+        erased = seeds.copy()
+        for direction in range(4):
+            spread = seeds & (streams[1].random(seeds.shape) < self.p_spread)
+            qubits = np.flatnonzero(neighbours[:, direction] >= 0)
+            erased[:, neighbours[qubits, direction]] |= spread[:, qubits]
+        X, Z = sample_paulis(streams[2], erased, (1/4, 1/4, 1/4, 1/4))
+        return erased, X, Z
+
+class fixed_weight_erasure_channel:
+    """
+    Erase exactly weight data qubits of every shot, chosen uniformly, each with a uniformly random Pauli.
+    The erasure channel conditioned on its number of erasures, the strata of simulator.simulate_stratified.
+    """
+    n_streams = 2
+    contained = True
+
+    def __init__(self, weight):
+        self.weight = weight
+
+    def sample(self, streams, n_shots, geometry):
+        erased = np.zeros((n_shots, len(geometry.data_qubits)), dtype = bool)
+        if self.weight > 0:
+            keys = streams[0].random(erased.shape)
+            np.put_along_axis(erased, np.argpartition(keys, self.weight - 1, axis = 1)[:, :self.weight], True, axis = 1)
+        X, Z = sample_paulis(streams[1], erased, (1/4, 1/4, 1/4, 1/4))
+        return erased, X, Z
+
+class pauli_channel:
+    """
+    Independent X, Y and Z errors on every data qubit with probabilities p_x, p_y and p_z, without erasures
+    """
+    n_streams = 1
+    contained = False
+
+    def __init__(self, p_x, p_y, p_z):
+        self.pauli = (1 - p_x - p_y - p_z, p_x, p_y, p_z)
+
+    def sample(self, streams, n_shots, geometry):
+        qubits = np.ones((n_shots, len(geometry.data_qubits)), dtype = bool)
+        X, Z = sample_paulis(streams[0], qubits, self.pauli)
+        return np.zeros_like(qubits), X, Z
+
+def sample_paulis(rng, qubits, pauli):
+    """
+    X and Z parts of a Pauli drawn with probabilities pauli = (I, X, Y, Z) for each True entry of qubits
+    """
+    X = np.zeros(qubits.shape, dtype = bool)
+    Z = np.zeros(qubits.shape, dtype = bool)
+    thresholds = np.cumsum(pauli[:3])
+    choice = np.searchsorted(thresholds, rng.random(np.count_nonzero(qubits)), side = "right")
+    X[qubits] = (choice == 1) | (choice == 2)
+    Z[qubits] = (choice == 2) | (choice == 3)
+    return X, Z
+
+# noise models that need a noise_parameter
+parametrized = ["erasure_pauli", "biased_erasure", "correlated_erasure"]
+
+def get_channels(noise, p_error_rate, noise_parameter = None):
+    """
+    Channels of a named noise model at physical error rate p_error_rate:
+    "erasure", "erasure_pauli" (erasure and depolarizing noise of total rate noise_parameter),
+    "biased_erasure" (bias noise_parameter) and "correlated_erasure" (spread probability noise_parameter)
+    """
+    if noise in parametrized and noise_parameter is None:
+        raise ValueError(f"The {noise} noise model needs a noise_parameter")
+    if noise == "erasure":
+        return [erasure_channel(p_error_rate)]
+    if noise == "erasure_pauli":
+        return [erasure_channel(p_error_rate), pauli_channel(*[noise_parameter/3]*3)]
+    if noise == "biased_erasure":
+        return [biased_erasure_channel(p_error_rate, noise_parameter)]
+    if noise == "correlated_erasure":
+        return [correlated_erasure_channel(p_error_rate, noise_parameter)]
+    raise ValueError(f"Unknown noise model {noise}")
+
+def shot_batches(size, n_samples, channels, batch_size = None, seed = None, code = "surface", engine = "batch"):
+    """
+    Yields batches of at most batch_size codes with the errors of every channel added, built only when requested,
+    so a sweep holds one batch at a time. Every channel gets its own streams spawned from np.random.SeedSequence(seed).
+    """
+    if batch_size is None:
+        batch_size = default_batch_size(size)
+    seed_sequences = (seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)).spawn(len(channels))
+    streams = [[np.random.default_rng(stream) for stream in seed_sequence.spawn(channel.n_streams)]
+               for channel, seed_sequence in zip(channels, seed_sequences)]
+    for start in range(0, n_samples, batch_size):
+        encoding = new_batch_code(size, min(batch_size, n_samples - start), code, engine)
+        for channel, channel_streams in zip(channels, streams):
+            encoding.add_errors(*channel.sample(channel_streams, encoding.n_shots, encoding.geometry))
+        yield encoding
@@ -0,0 +1,234 @@
+import argparse
+import os
+import socket
+import time
+from multiprocessing import Process
+import numpy as np
+import simulator
+from results_store import results_store
+"""
+Sweeps drained by workers on any number of hosts through one SQLite file on shared storage.
+A coordinator submits the (size, physical error rate, chunk) units of a sweep to the units table of a results_store file,
+and workers claim them under a lease, simulate them with the fastest engine the code supports and add their counts
+to the chunks table. A unit whose lease runs out is claimed again, so the units of dead workers are retried.
+A unit's counts only depend on its key through simulator.chunk_seed, and every engine gives the same counts,
+so a unit finished twice stores the same chunk and the sweep gives the counts of simulator.simulate_parallel.
+Leases compare time.time() of different hosts, whose clocks should agree to well within the lease.
+"""
+
+engines = ["packed", "batch", "shot"]
+
+class job_queue(results_store):
+    """
+    results_store with a table of units, pending, leased, done or failed, claimed in submission order
+    """
+    def __init__(self, path, lease_seconds = 600, max_attempts = 3, timeout = 60.0):
+        super().__init__(path, timeout)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS units (
+                code TEXT, decoder TEXT, size INTEGER, physical_error_rate REAL, seed TEXT, chunk_size INTEGER, chunk INTEGER,
+                n_samples INTEGER, status TEXT, worker TEXT, lease_expires REAL, attempts INTEGER, error TEXT,
+                PRIMARY KEY (code, decoder, size, physical_error_rate, seed, chunk_size, chunk));
+        """)
+        self.connection.commit()
+
+    def submit(self, size_list, error_range, n_samples, code, decoder, seed, chunk_size):
+        """
+        Add the units of a sweep, the chunks the store already holds with the samples of their unit as done,
+        and return the number of new units. Submitting a sweep again adds nothing, submitting it with another number
+        of samples resizes the units whose samples change and makes them pending again.
+        """
+        simulator.check_engine(size_list, code, "shot")
+        if any(isinstance(size, tuple) for size in size_list):
+            raise ValueError("The results store only holds square sizes")
+        done = self.get_chunks(code, decoder, seed, chunk_size, n_samples)
+        rows = [(code, decoder, int(size), float(phys_error_rate), str(seed), int(chunk_size), chunk, min(chunk_size, n_samples - start),
+                 "done" if (size, phys_error_rate, chunk) in done else "pending", None, None, 0, None)
+                for size in size_list for phys_error_rate in error_range for chunk, start in enumerate(range(0, n_samples, chunk_size))]
+        before = self.connection.total_changes
+        self.connection.executemany(f"""INSERT INTO units VALUES ({', '.join('?'*13)})
+            ON CONFLICT (code, decoder, size, physical_error_rate, seed, chunk_size, chunk) DO UPDATE SET
+            n_samples = excluded.n_samples, status = excluded.status, worker = NULL, lease_expires = NULL, attempts = 0, error = NULL
+            WHERE n_samples != excluded.n_samples""", rows)
+        self.connection.commit()
+        return self.connection.total_changes - before
+
+    def expire(self):
+        """
+        Make the units whose lease ran out pending again, or failed once their lease ran out max_attempts times,
+        and return the time they were compared to
+        """
+        now = time.time()
+        self.connection.execute("""UPDATE units SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+            error = CASE WHEN attempts >= ? THEN 'lease expired' ELSE error END WHERE status = 'leased' AND lease_expires < ?""",
+            (self.max_attempts, self.max_attempts, now))
+        self.connection.commit()
+        return now
+
+    def claim(self, worker):
+        """
+        Lease the first pending unit, after expiring the leases that ran out, to worker for lease_seconds,
+        None if there is none
+        """
+        now = self.expire()
+        row = self.connection.execute("""UPDATE units SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1
+            WHERE rowid = (SELECT rowid FROM units WHERE status = 'pending' ORDER BY rowid LIMIT 1)
+            RETURNING rowid, code, decoder, size, physical_error_rate, seed, chunk_size, chunk, n_samples, attempts""",
+            (worker, now + self.lease_seconds)).fetchone()
+        self.connection.commit()
+        if row is None:
+            return None
+        return dict(zip(["rowid", "code", "decoder", "size", "physical_error_rate", "seed", "chunk_size", "chunk", "n_samples", "attempts"], row))
+
+    def complete(self, unit, counts, engine = None, seconds = None):
+        """
+        Store the counts of a claimed unit, also after its lease ran out, unless the unit was resized since it was claimed
+        """
+        if self.connection.execute("SELECT n_samples FROM units WHERE rowid = ?", (unit["rowid"],)).fetchone()[0] != unit["n_samples"]:
+            return
+        self.add_chunk(tuple(unit[field] for field in ["code", "decoder", "size", "physical_error_rate", "seed", "chunk_size", "chunk"]), counts, engine, seconds)
+        self.connection.execute("UPDATE units SET status = 'done' WHERE rowid = ?", (unit["rowid"],))
+        self.connection.commit()
+
+    def release(self, unit, error):
+        """
+        Give up a claimed unit after an error, pending again until it has failed max_attempts times
+        """
+        self.connection.execute("UPDATE units SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ? WHERE rowid = ? AND status = 'leased'",
+            (self.max_attempts, error, unit["rowid"]))
+        self.connection.commit()
+
+    def progress(self, seed = None):
+        """
+        {status: units} of every sweep, or of the sweep of a root seed
+        """
+        query = "SELECT status, COUNT(*) FROM units" + ("" if seed is None else " WHERE seed = ?") + " GROUP BY status"
+        return dict(self.connection.execute(query, () if seed is None else (str(seed),)).fetchall())
+
+def fastest_engine(size, code, decoder, preference = engines):
+    """
+    First engine of preference that simulates size of code
+    """
+    for engine in preference:
+        try:
+            simulator.check_engine([size], code, engine, decoder)
+            return engine
+        except ValueError:
+            pass
+    raise ValueError(f"No engine of {preference} simulates size {size} of the {code} code")
+
+def run_worker(path, worker = None, preference = engines, batch_size = None, lease_seconds = 600, poll = 1.0, max_units = None):
+    """
+    Claim and simulate units of the queue at path until none is pending or leased, or max_units are done,
+    and return the number done. While other workers hold the last leases it polls, to take over the ones that run out.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    queue = job_queue(path, lease_seconds)
+    done = 0
+    try:
+        while max_units is None or done < max_units:
+            unit = queue.claim(worker)
+            if unit is None:
+                progress = queue.progress()
+                if not progress.get("pending") and not progress.get("leased"):
+                    break
+                time.sleep(poll)
+                continue
+            try:
+                engine = fastest_engine(unit["size"], unit["code"], unit["decoder"], preference)
+                task = (unit["size"], unit["physical_error_rate"], unit["n_samples"], unit["code"], engine, batch_size, unit["decoder"],
+                    simulator.chunk_seed(int(unit["seed"]), unit["size"], unit["physical_error_rate"], unit["chunk_size"], unit["chunk"]))
+                counts, seconds = simulator.timed_task(task)
+            except Exception as error:
+                queue.release(unit, repr(error))
+                continue
+            queue.complete(unit, counts, engine, seconds)
+            done += 1
+    finally:
+        queue.close()
+    return done
+
+def start_workers(path, n_workers, preference = engines, batch_size = None, lease_seconds = 600, poll = 1.0):
+    """
+    n_workers local processes running run_worker, one per core for n_workers = 0
+    """
+    processes = [Process(target = run_worker, args = (path, None, preference, batch_size, lease_seconds, poll)) for _ in range(n_workers or os.cpu_count())]
+    for process in processes:
+        process.start()
+    return processes
+
+def simulate_queue(size_list, lower_bound, upper_bound, n_points, n_samples, code, path, decoder = "tree", seed = None, chunk_size = 1000,
+        workers = None, preference = engines, batch_size = None, lease_seconds = 600, poll = 1.0, verbose = False):
+    """
+    Same sweep as simulator.simulate_parallel, submitted to the queue at path and drained by workers on any host.
+    workers local worker processes are started as well (None for none, 0 for one per core), and the coordinator
+    returns the counts of the sweep when none of its units is pending or leased, a RuntimeError if some failed.
+    The coordinator expires the leases that ran out too, and raises a RuntimeError if it started local workers
+    and every one of them stopped while units of the sweep are still pending or leased.
+    """
+    seed = np.random.SeedSequence(seed).entropy
+    error_range = np.linspace(lower_bound, upper_bound, n_points)
+    queue = job_queue(path, lease_seconds)
+    try:
+        queue.submit(size_list, error_range, n_samples, code, decoder, seed, chunk_size)
+        processes = [] if workers is None else start_workers(path, workers, preference, batch_size, lease_seconds, poll)
+        last = None
+        while True:
+            queue.expire()
+            progress = queue.progress(seed)
+            if verbose and progress != last:
+                print(", ".join(f"{units} {status}" for status, units in sorted(progress.items())))
+                last = progress
+            if not progress.get("pending") and not progress.get("leased"):
+                break
+            if processes and not any(process.is_alive() for process in processes):
+                # a worker may have finished the last units since progress was read
+                progress = queue.progress(seed)
+                if progress.get("pending") or progress.get("leased"):
+                    raise RuntimeError(f"Every local worker stopped, with exit codes {[process.exitcode for process in processes]}, "
+                        f"while {progress.get('pending', 0)} units of the sweep were pending and {progress.get('leased', 0)} leased in {path}")
+                continue
+            time.sleep(poll)
+        for process in processes:
+            process.join()
+        if progress.get("failed"):
+            raise RuntimeError(f"{progress['failed']} units of the sweep failed, see the error column of the units table of {path}")
+        counts = simulator.empty_counts(size_list, error_range)
+        points = {(size, phys_error_rate): (i, j) for i, size in enumerate(size_list) for j, phys_error_rate in enumerate(error_range)}
+        for (size, phys_error_rate, chunk), chunk_counts in queue.get_chunks(code, decoder, seed, chunk_size, n_samples).items():
+            if (size, phys_error_rate) in points:
+                counts[points[size, phys_error_rate]] += chunk_counts
+    finally:
+        queue.close()
+    return simulator.count_frame(size_list, error_range, counts)
+
+def main(args):
+    if args.status:
+        queue = job_queue(args.store)
+        print(queue.progress())
+        for row in queue.connection.execute("SELECT size, physical_error_rate, chunk, worker, attempts, error FROM units WHERE status = 'failed'"):
+            print("failed", *row)
+        queue.close()
+        return
+    preference = engines if args.engine is None else [args.engine] + [engine for engine in engines if engine != args.engine]
+    if args.processes == 1:
+        print(f"{run_worker(args.store, None, preference, args.batch_size, args.lease_seconds, args.poll, args.max_units)} units done")
+        return
+    for process in start_workers(args.store, args.processes, preference, args.batch_size, args.lease_seconds, args.poll):
+        process.join()
+    print(job_queue(args.store).progress())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Worker draining the sweeps submitted with main.py --queue to a shared SQLite results store")
+    parser.add_argument("--store", default = "./df/results.sqlite", help = "SQLite file of the queue, on storage shared by every host")
+    parser.add_argument("--processes", type = int, default = 1, help = "Worker processes on this host, 0 for one per core")
+    parser.add_argument("--engine", default = None, choices = engines, help = "Engine to try first, the fastest one the code supports by default")
+    parser.add_argument("--batch_size", type = int, default = None, help = "Samples per batch for the batch engines")
+    parser.add_argument("--lease_seconds", type = float, default = 600, help = "Seconds a claimed unit is held before other workers may retry it, longer than a unit takes")
+    parser.add_argument("--poll", type = float, default = 1.0, help = "Seconds between claims while every remaining unit is leased")
+    parser.add_argument("--max_units", type = int, default = None, help = "Stop after this many units, with one process")
+    parser.add_argument("--status", action = "store_true", help = "Print the units per status and the failed ones, and exit")
+    args = parser.parse_args()
+    main(args)
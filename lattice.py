@@ -0,0 +1,255 @@
+import numpy as np
+from functools import lru_cache
+
+@lru_cache(maxsize = 16)
+def get_geometry(size):
+    """
+    Shared lattice_geometry of a surface code, built once per size.
+    size is an int for a size x size lattice or a (rows, columns) tuple for a rectangular one
+    """
+    return lattice_geometry(size)
+
+def lattice_shape(size):
+    """
+    (rows, columns) of a size of get_geometry
+    """
+    if isinstance(size, (tuple, list)):
+        rows, columns = size
+        return int(rows), int(columns)
+    return int(size), int(size)
+
+class lattice_geometry:
+    """
+    Everything about a rows x columns surface code that does not depend on the errors, size x size for an int size.
+    X errors cross the columns from the left to the right boundary and Z errors the rows from top to bottom,
+    so the distances against them are (columns + 1)//2 and (rows + 1)//2.
+    Coordinates are (y, x) tuples as in topological_code. Integer tables use flat indices of the lattice
+    padded by 2 on every side, index = (y + 2)*width + x + 2 with width = columns + 4, so open stabilizers
+    and their neighbours have indices too.
+    Arrays are read-only, the instance is shared by every code of this size.
+    """
+    def __init__(self, size):
+        self.size = size
+        rows, columns = self.shape = lattice_shape(size)
+        self.width = columns + 4
+        self.n_cells = (rows + 4)*self.width
+        self.distances = {"X": (columns + 1)//2, "Z": (rows + 1)//2}
+        self.distance = min(self.distances.values())
+        # flat offsets of the (1,0), (-1,0), (0,1), (0,-1) neighbours, the order of get_adjacent_data_qubits
+        self.neighbours = (self.width, -self.width, 1, -1)
+
+        self.data_qubits = tuple((y, x) for y in range(rows) for x in range(y%2, columns, 2))
+        self.stabilizers = {
+            "X": tuple((1+2*y, 2*x) for y in range(rows//2) for x in range((columns +1)//2)),
+            "Z": tuple((2*y, 1+ 2*x) for y in range((rows+1)//2) for x in range(columns//2))
+        }
+        # the data qubits of the last column and row are the ones with y (x) of the parity of columns - 1 (rows - 1)
+        self.boundary = {
+            "X": (tuple((y,0) for y in range(0, rows, 2)),
+                tuple((y, columns-1) for y in range((columns + 1)%2, rows, 2))),
+            "Z": (tuple((0,x) for x in range(0, columns, 2)),
+                tuple((rows-1, x) for x in range((rows + 1)%2, columns, 2)))
+        }
+        self.open_qubits = {
+            "X": (tuple((-1,x) for x in range(0, columns, 2)),
+                tuple((rows, x) for x in range((rows + 1)%2, columns, 2))),
+            "Z": (tuple((y,-1) for y in range(0, rows, 2)),
+                tuple((y, columns) for y in range((columns + 1)%2, rows, 2)))
+        }
+        # directions along which two errors of a type are connected in has_logical_error
+        self.adjacency = {
+            "X": ((0,2),(-1,1), (1, 1),(0,-2), (-1,-1), (-1,1)),
+            "Z": ((2,0),(1,-1), (1, 1),(-2,0), (-1,-1), (-1,1))
+        }
+
+        # tuple lookups replacing the lists built by get_adjacent_stabilizers and get_adjacent_data_qubits
+        self.adjacent_stabilizers = {
+            stab_type: {qubit: self.get_adjacent_stabilizers(qubit, stab_type) for qubit in self.data_qubits}
+            for stab_type in ["X", "Z"]
+        }
+        self.adjacent_data_qubits = {
+            (y, x): tuple((y+d_y, x+d_x) for d_y, d_x in [(1,0), (-1,0), (0,1), (0,-1)])
+            for y in range(-1, rows + 1) for x in range(-1, columns + 1)
+        }
+
+        # integer tables, qubit i is data_qubits[i]
+        self.data_index = self.read_only(np.array([self.get_index(qubit) for qubit in self.data_qubits], dtype = np.int64))
+        qubit_number = np.full(self.n_cells, -1, dtype = np.int64)
+        qubit_number[self.data_index] = np.arange(len(self.data_qubits))
+        self.qubit_number = self.read_only(qubit_number)
+        self.stabilizer_index = {
+            stab_type: self.read_only(np.array([self.get_index(stab) for stab in self.stabilizers[stab_type]], dtype = np.int64))
+            for stab_type in ["X", "Z"]
+        }
+        self.open_index = {
+            stab_type: tuple(self.get_index(stab) for stab in self.open_qubits[stab_type][0] + self.open_qubits[stab_type][1])
+            for stab_type in ["X", "Z"]
+        }
+        # CSR adjacency, every qubit has two stabilizers of each type (open ones included), in get_adjacent_stabilizers order
+        self.qubit_stabilizers = {
+            stab_type: self.read_only(np.array([[self.get_index(stab) for stab in self.adjacent_stabilizers[stab_type][qubit]]
+                for qubit in self.data_qubits], dtype = np.int64).reshape(-1, 2))
+            for stab_type in ["X", "Z"]
+        }
+        # data qubits around each stabilizer, stabilizer_qubits[stab_type][1][indptr[j]:indptr[j+1]] for stabilizers[stab_type][j]
+        self.stabilizer_qubits = {}
+        for stab_type in ["X", "Z"]:
+            indptr = [0]
+            indices = []
+            for stab in self.stabilizers[stab_type]:
+                numbers = [qubit_number[self.get_index(qubit)] for qubit in self.adjacent_data_qubits[stab]]
+                indices += [number for number in numbers if number >= 0]
+                indptr.append(len(indices))
+            self.stabilizer_qubits[stab_type] = (self.read_only(np.array(indptr, dtype = np.int64)), self.read_only(np.array(indices, dtype = np.int64)))
+
+        # flat offsets of adjacency without repeats, and the first boundary as start indices of the logical error search
+        self.adjacency_offsets = {
+            error_type: tuple(dict.fromkeys(y*self.width + x for y, x in self.adjacency[error_type]))
+            for error_type in ["X", "Z"]
+        }
+        self.boundary_index = {
+            error_type: tuple(tuple(self.get_index(qubit) for qubit in qubits) for qubits in self.boundary[error_type])
+            for error_type in ["X", "Z"]
+        }
+
+        # boolean masks, padded flat for the decoders and size x size for the batch engine
+        self.boundary_mask = {
+            error_type: tuple(self.read_only(self.get_mask(qubits)) for qubits in self.boundary[error_type])
+            for error_type in ["X", "Z"]
+        }
+        self.open_mask = {
+            stab_type: self.read_only(self.get_mask(self.open_qubits[stab_type][0] + self.open_qubits[stab_type][1]))
+            for stab_type in ["X", "Z"]
+        }
+        # bytes versions of the boundary masks for O(1) tests in per-shot loops
+        self.boundary_flags = {
+            error_type: tuple(mask.tobytes() for mask in self.boundary_mask[error_type])
+            for error_type in ["X", "Z"]
+        }
+        self.data_grid = self.read_only(self.get_grid(self.data_qubits))
+        self.stabilizer_grid = {stab_type: self.read_only(self.get_grid(self.stabilizers[stab_type])) for stab_type in ["X", "Z"]}
+        self.boundary_grid = {
+            error_type: tuple(self.read_only(self.get_grid(qubits)) for qubits in self.boundary[error_type])
+            for error_type in ["X", "Z"]
+        }
+
+    def get_index(self, coordinate):
+        return (coordinate[0] + 2)*self.width + coordinate[1] + 2
+
+    def get_mask(self, coordinates):
+        mask = np.zeros(self.n_cells, dtype = bool)
+        mask[[self.get_index(coordinate) for coordinate in coordinates]] = True
+        return mask
+
+    def get_grid(self, coordinates):
+        grid = np.zeros(self.shape, dtype = bool)
+        for y, x in coordinates:
+            if 0 <= y < self.shape[0] and 0 <= x < self.shape[1]:
+                grid[y, x] = True
+        return grid
+
+    def get_adjacent_stabilizers(self, qubit, stab_type):
+        if stab_type == "X":
+            if qubit[0] %2 == 0:
+                return ((qubit[0]-1, qubit[1]),(qubit[0]+1, qubit[1]))
+            else:
+                return ((qubit[0], qubit[1]-1), (qubit[0], qubit[1] + 1))
+        else:
+            if qubit[1]%2 == 0:
+                return ((qubit[0], qubit[1]-1), (qubit[0], qubit[1]+1))
+            else:
+                return ((qubit[0]-1, qubit[1]), (qubit[0] + 1, qubit[1]))
+
+    def read_only(self, array):
+        array.flags.writeable = False
+        return array
+
+@lru_cache(maxsize = 16)
+def get_toric_geometry(size):
+    """
+    Shared toric_geometry of a size x size torus, built once per size
+    """
+    return toric_geometry(size)
+
+class toric_geometry:
+    """
+    The lattice of lattice_geometry on a size x size torus, coordinates taken mod size, so size must be even.
+    Every stabilizer has four data qubits and there are no boundaries, the distance is size//2.
+    Integer tables use flat indices y*size + x without padding.
+    """
+    def __init__(self, size):
+        if size < 2 or size%2:
+            raise ValueError("The toric code needs an even size of at least 2")
+        self.size = size
+        self.shape = (size, size)
+        self.width = size
+        self.n_cells = size**2
+        self.distance = size//2
+        self.data_qubits = tuple((y, 2*k + y%2) for y in range(size) for k in range(size//2))
+        self.stabilizers = {
+            "X": tuple((1+2*y, 2*x) for y in range(size//2) for x in range(size//2)),
+            "Z": tuple((2*y, 1+ 2*x) for y in range(size//2) for x in range(size//2))
+        }
+        # no open stabilizers, every tree is peeled down to a single node
+        self.open_index = {"X": (), "Z": ()}
+
+        self.adjacent_stabilizers = {
+            stab_type: {qubit: self.get_adjacent_stabilizers(qubit, stab_type) for qubit in self.data_qubits}
+            for stab_type in ["X", "Z"]
+        }
+        self.adjacent_data_qubits = {
+            (y, x): tuple(((y+d_y)%size, (x+d_x)%size) for d_y, d_x in [(1,0), (-1,0), (0,1), (0,-1)])
+            for stab_type in ["X", "Z"] for y, x in self.stabilizers[stab_type]
+        }
+
+        self.data_index = self.read_only(np.array([self.get_index(qubit) for qubit in self.data_qubits], dtype = np.int64))
+        qubit_number = np.full(self.n_cells, -1, dtype = np.int64)
+        qubit_number[self.data_index] = np.arange(len(self.data_qubits))
+        self.qubit_number = self.read_only(qubit_number)
+        self.stabilizer_index = {
+            stab_type: self.read_only(np.array([self.get_index(stab) for stab in self.stabilizers[stab_type]], dtype = np.int64))
+            for stab_type in ["X", "Z"]
+        }
+        self.qubit_stabilizers = {
+            stab_type: self.read_only(np.array([[self.get_index(stab) for stab in self.adjacent_stabilizers[stab_type][qubit]]
+                for qubit in self.data_qubits], dtype = np.int64).reshape(-1, 2))
+            for stab_type in ["X", "Z"]
+        }
+
+        # a closed error chain is a logical operator when it crosses one of these dual loops an odd number of times,
+        # the first cut is crossed by chains winding along x and the second by chains winding along y
+        self.cuts = {
+            "X": (tuple((y, 0) for y in range(0, size, 2)), tuple((1, x) for x in range(1, size, 2))),
+            "Z": (tuple((y, 1) for y in range(1, size, 2)), tuple((0, x) for x in range(0, size, 2)))
+        }
+        self.cut_sets = {error_type: tuple(frozenset(cut) for cut in self.cuts[error_type]) for error_type in ["X", "Z"]}
+        self.cut_grid = {
+            error_type: tuple(self.read_only(self.get_grid(cut)) for cut in self.cuts[error_type])
+            for error_type in ["X", "Z"]
+        }
+        # translating the first cut to column x or the second to row y gives another dual loop when x or y has this parity,
+        # an erasure missing one whole column and one whole row of these holds no chain winding around the torus
+        self.cut_parity = {"X": (0, 1), "Z": (1, 0)}
+
+        self.data_grid = self.read_only(self.get_grid(self.data_qubits))
+        self.stabilizer_grid = {stab_type: self.read_only(self.get_grid(self.stabilizers[stab_type])) for stab_type in ["X", "Z"]}
+
+    def get_index(self, coordinate):
+        return (coordinate[0] % self.size)*self.width + coordinate[1] % self.size
+
+    def get_grid(self, coordinates):
+        grid = np.zeros((self.size, self.size), dtype = bool)
+        for y, x in coordinates:
+            grid[y % self.size, x % self.size] = True
+        return grid
+
+    def get_adjacent_stabilizers(self, qubit, stab_type):
+        y, x = qubit
+        if (stab_type == "X") == (y%2 == 0):
+            return (((y-1) % self.size, x), ((y+1) % self.size, x))
+        else:
+            return ((y, (x-1) % self.size), (y, (x+1) % self.size))
+
+    def read_only(self, array):
+        array.flags.writeable = False
+        return array
@@ -1,5 +1,12 @@
 import argparse
 import simulator
+import numpy as np
+from results_store import results_store
+import weight_tables
+import job_queue
+import error_models
+from profiling import stage_profiler
+import pickle
 from datetime import datetime
 import os
 """
@@ -32,16 +39,99 @@ def main(args):
     while size <= args.high_size:
         size_list.append(size)
         size += args.interval
+    if args.rows is not None:
+        # rectangular (rows, columns) lattices, the positional sizes are the columns
+        low_rows, high_rows, rows_interval = args.rows
+        size_list = [(rows, columns) for columns in size_list for rows in range(low_rows, high_rows + 1, rows_interval)]
 
-    df = simulator.simulate(size_list, args.lower_bound, args.upper_bound, args.n_points, args.n_samples, args.code)
-    df["logical_error_rate"] = (df["uncorrected_error"] + df["undetected_error"])/args.n_samples
+    # the batch estimators have no shot engine, --coupled always runs the packed one
+    engine = args.engine if args.engine is not None else "batch" if args.weight_table or args.stratified or args.noise is not None else "shot"
+    chunk_size = 1000 if args.chunk_size is None else args.chunk_size
+    if args.target_width is not None:
+        seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+        print(f"Root seed: {seed}")
+        df = simulator.simulate_adaptive(size_list, args.lower_bound, args.upper_bound, args.n_points, args.n_samples, args.code, engine,
+            args.target_width, args.confidence, args.confidence_interval, args.min_samples, args.time_budget, 1 if args.workers is None else args.workers,
+            seed, chunk_size, args.batch_size, args.decoder)
+    elif args.weight_table:
+        df = weight_tables.simulate_tables(size_list, args.lower_bound, args.upper_bound, args.n_points, args.n_samples, args.code, args.decoder,
+            args.table_dir, args.confidence, engine, args.seed, args.batch_size)
+    elif args.stratified:
+        seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+        print(f"Root seed: {seed}")
+        df = simulator.simulate_stratified(size_list, args.lower_bound, args.upper_bound, args.n_points, args.n_samples, args.code,
+            engine, args.confidence, seed = seed, batch_size = args.batch_size, decoder = args.decoder)
+    elif args.coupled:
+        seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+        print(f"Root seed: {seed}")
+        df = simulator.simulate_coupled(size_list, args.lower_bound, args.upper_bound, args.n_points, args.n_samples, args.code, args.batch_size, args.decoder, seed)
+    elif args.noise is not None:
+        seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+        print(f"Root seed: {seed}")
+        df = simulator.simulate_channels(size_list, args.lower_bound, args.upper_bound, args.n_points, args.n_samples, args.code, args.noise,
+            args.noise_parameter, engine, args.batch_size, args.decoder, seed)
+    elif args.queue:
+        seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+        print(f"Root seed: {seed}")
+        df = job_queue.simulate_queue(size_list, args.lower_bound, args.upper_bound, args.n_points, args.n_samples, args.code, args.store, args.decoder,
+            seed, chunk_size, args.workers, batch_size = args.batch_size, lease_seconds = args.lease_seconds, verbose = True)
+    elif args.workers is None and not args.resume and not args.merge:
+        profile = stage_profiler() if args.profile else None
+        df = simulator.simulate(size_list, args.lower_bound, args.upper_bound, args.n_points, args.n_samples, args.code, engine, args.batch_size, args.decoder, profile,
+            args.rounds, args.measurement_error_rate, args.seed)
+        if profile is not None:
+            report = profile.report()
+            print(report["stages"])
+            print(f"{len(report['failures'])} decoder failures")
+            with open(f"{df_path}/{start}_{args.n_samples}_profile.pkl", "wb") as file:
+                pickle.dump(report, file)
+    else:
+        # every chunk goes to the store as it finishes, --resume continues the last run of the store unless --seed is given
+        store = results_store(args.store)
+        seed = args.seed if args.seed is not None else store.last_seed() if args.resume else None
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        print(f"Root seed: {seed}")
+        store.add_run(seed, vars(args))
+        df = simulator.simulate_parallel(size_list, args.lower_bound, args.upper_bound, args.n_points, args.n_samples, args.code, 
+            engine, 1 if args.workers is None else args.workers, seed, chunk_size, args.batch_size, args.decoder, store, args.resume)
+        if args.merge:
+            df = store.merged_counts(args.code, args.decoder, size_list, np.linspace(args.lower_bound, args.upper_bound, args.n_points))
+            df["logical_error_rate"] = (df["uncorrected_error"] + df["undetected_error"])/df["n_samples"]
+        store.close()
+    if "logical_error_rate" not in df:
+        df["logical_error_rate"] = (df["uncorrected_error"] + df["undetected_error"])/(df["n_samples"] if "n_samples" in df else args.n_samples)
     df["better"] = df["effective_error_rate"] > df["logical_error_rate"]
     print(df)
-    print(df[["logical_error_rate", "effective_error_rate", "better"]])
+    print(df[[col for col in ["n_samples", "logical_error_rate", "ci_lower", "ci_upper", "effective_error_rate", "better"] if col in df]])
     df.to_pickle(f"{df_path}/{start}_{args.n_samples}.pkl")
     # _{args.low_size}_{args.high_size}_{args.lower_bound}_{args.upper_bound}_{args.n_points}_{args.n_samples}_{args.code}.csv")
     return
 
+def check_arguments(parser, args):
+    """
+    Refuse the options the chosen mode would ignore or is missing
+    """
+    if args.noise in error_models.parametrized and args.noise_parameter is None:
+        parser.error(f"--noise {args.noise} needs --noise_parameter")
+    mode = next((f"--{name}" for name in ["target_width", "weight_table", "stratified", "coupled", "noise", "queue"] if getattr(args, name) not in [None, False]), None)
+    stored = mode is None and (args.workers is not None or args.resume or args.merge)
+    if mode is not None and (args.resume or args.merge):
+        parser.error(f"--resume and --merge are for --workers sweeps, not {mode}")
+    if args.workers is not None and mode not in [None, "--target_width", "--queue"]:
+        parser.error(f"--workers is not used by {mode}")
+    if args.rows is not None and (stored or mode == "--queue"):
+        parser.error("--rows is not used with the results store of --workers, --resume, --merge or --queue")
+    if args.engine is not None and mode == "--coupled":
+        parser.error("--coupled always runs the packed engine, --engine is not used")
+    if args.engine == "shot" and mode in ["--weight_table", "--stratified", "--noise"]:
+        parser.error(f"{mode} needs the batch or packed engine")
+    if args.chunk_size is not None and not stored and mode not in ["--target_width", "--queue"]:
+        parser.error("--chunk_size is only used with --workers, --resume, --merge, --queue or --target_width")
+    for option, given in [("--profile", args.profile), ("--rounds", args.rounds != 1)]:
+        if given and (stored or mode is not None):
+            parser.error(f"{option} only works without --workers, --resume or --merge and without {mode or 'another mode'}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = "Simulating the pseudo-threshold and threshold for the Linear\
     Time Maximum Likelihood Decoding of the Surace Code over the Quantum Erasure Channel by Delfosse and Zemor (2017). ")
@@ -51,9 +141,47 @@ if __name__ == "__main__":
     parser.add_argument("lower_bound", type = float, help = "lower bound of range of physical error")
     parser.add_argument("upper_bound", type = float, help = "upper bound of range of physical error")
     parser.add_argument("n_points", type = int, help = "number of physical error rates to simulate")
-    parser.add_argument("n_samples", type = int, help = "number of samples to simulate within range")
+    parser.add_argument("n_samples", type = int, help = "number of samples to simulate within range, with --target_width the budget per point, pooled over the sweep")
     parser.add_argument("code", help = "Toric code or surface code", choices = ["toric", "surface"])
-
-    # parser.add_argument("confidence", help = "Absolute percentage of error")
+    modes = parser.add_mutually_exclusive_group()
+    parser.add_argument("--rows", type = int, nargs = 3, default = None, metavar = ("LOW", "HIGH", "INTERVAL"),
+        help = "Sweep rectangular surface codes, every number of rows from LOW to HIGH with every size as the number of columns. "
+        "X errors cross the columns and Z errors the rows, so the distances are (columns + 1)//2 and (rows + 1)//2 (not with --workers, --resume, --merge or --queue)")
+    parser.add_argument("--engine", default = None, choices = ["shot", "batch", "packed"], help = "Simulate one code object per sample, vectorized batches of samples, or batches with 64 samples per word (same counts). "
+        "shot by default, batch by default for --weight_table, --stratified and --noise, which have no shot engine, and not with --coupled, which always runs packed")
+    parser.add_argument("--decoder", default = "tree", choices = ["tree", "union_find"], help = "Peeling tree, or union-find forest with iterative peeling. "
+        "Their corrections agree up to syndrome-free operators, so shots with a spanning erasure can end with different logical outcomes, at the same failure rate")
+    parser.add_argument("--batch_size", type = int, default = None, help = "Samples per batch for the batch engine")
+    parser.add_argument("--profile", action = "store_true", help = "Time every stage, count shots and record tree statistics and decoder failures, "
+        "saved next to the results as <name>_profile.pkl (not with --workers, --resume, --merge or another mode)")
+    parser.add_argument("--rounds", type = int, default = 1, help = "Rounds of syndrome measurements, all but the last with erased measurements, "
+        "decoded by peeling the spacetime erasure forest (shot engine and tree decoder, not with --workers, --resume, --merge or another mode)")
+    parser.add_argument("--measurement_error_rate", type = float, default = None, help = "Erasure probability of each measurement with --rounds, the physical error rate by default")
+    parser.add_argument("--workers", type = int, default = None, help = "Run (size, error rate, chunk) tasks on this many processes, 0 for one per core")
+    parser.add_argument("--seed", type = int, default = None, help = "Root seed of the generators of every mode, the per-task ones with --workers")
+    parser.add_argument("--chunk_size", type = int, default = None, help = "Samples per task with --workers, --resume, --merge, --queue or --target_width, 1000 by default. "
+        "Results depend on it but not on the number of workers")
+    modes.add_argument("--stratified", action = "store_true", help = "Estimate rare logical error rates by sampling each number of erasures, n_samples per size shared by every error rate")
+    modes.add_argument("--coupled", action = "store_true", help = "Evaluate every error rate of a size on the same n_samples shots, with nested erasures, "
+        "for smoother curves at about the cost of one error rate below threshold (odd sizes of the surface code)")
+    modes.add_argument("--weight_table", action = "store_true", help = "Evaluate the erasure channel from per weight failure tables, enumerated exactly where small enough "
+        "and sampled with n_samples shots otherwise, cached in --table_dir")
+    parser.add_argument("--table_dir", default = f"{df_path}/weight_tables", help = "Directory of the failure tables of --weight_table")
+    modes.add_argument("--noise", default = None, choices = ["erasure", "erasure_pauli", "biased_erasure", "correlated_erasure"],
+        help = "Sample batches from an error_models noise model, each channel with its own random streams")
+    parser.add_argument("--noise_parameter", type = float, default = None, help = "Pauli rate, bias or spread probability of --noise, needed by every model but erasure")
+    parser.add_argument("--store", default = f"{df_path}/results.sqlite", help = "SQLite file the chunks of a --workers sweep are appended to")
+    parser.add_argument("--resume", action = "store_true", help = "Skip the chunks the store already holds for the seed, the seed of its last run without --seed")
+    parser.add_argument("--merge", action = "store_true", help = "Report the counts of every run in the store for these points, summed over seeds")
+    modes.add_argument("--queue", action = "store_true", help = "Submit the (size, error rate, chunk) units to the queue in --store and wait for workers "
+        "(python job_queue.py --store on any host, and --workers local ones) to drain them, same counts as --workers for a seed and --chunk_size")
+    parser.add_argument("--lease_seconds", type = float, default = 600, help = "Seconds a worker holds a unit of --queue before it is retried")
+    modes.add_argument("--target_width", type = float, default = None, help = "Sample each point until its confidence interval is this wide relative to the logical error rate, "
+        "giving the budget the resolved points leave to the widest intervals")
+    parser.add_argument("--confidence", type = float, default = 0.95, help = "Confidence level of the interval with --target_width")
+    parser.add_argument("--confidence_interval", default = "wilson", choices = ["wilson", "clopper_pearson"], help = "Confidence interval used with --target_width")
+    parser.add_argument("--min_samples", type = int, default = 1000, help = "Samples in the first round of each point with --target_width")
+    parser.add_argument("--time_budget", type = float, default = None, help = "Seconds of sampling per point with --target_width, pooled over the sweep like n_samples")
     args = parser.parse_args()
+    check_arguments(parser, args)
     main(args)
\ No newline at end of file
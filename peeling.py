@@ -0,0 +1,285 @@
+import weakref
+from functools import lru_cache
+
+@lru_cache(maxsize = 16)
+def get_erasure_forests(geometry):
+    """
+    The X and Z erasure_forest of a lattice_geometry, allocated once and reused by every shot of that size
+    """
+    return {stab_type: erasure_forest(geometry, stab_type) for stab_type in ["X", "Z"]}
+
+@lru_cache(maxsize = 16)
+def get_spacetime_forests(geometry, rounds):
+    """
+    The X and Z spacetime_forest of a lattice_geometry over rounds rounds of measurements
+    """
+    return {stab_type: spacetime_forest(geometry, stab_type, rounds) for stab_type in ["X", "Z"]}
+
+def cell_stabilizers(geometry, stab_type):
+    """
+    The two stabilizers of every data qubit by cell, in get_adjacent_stabilizers order, () for the other cells
+    """
+    stabilizers = [()]*geometry.n_cells
+    for qubit, pair in zip(geometry.data_index.tolist(), geometry.qubit_stabilizers[stab_type].tolist()):
+        stabilizers[qubit] = tuple(pair)
+    return stabilizers
+
+class peeling_forest:
+    """
+    Trees in visit order, the stabilizer, parent position (-1 for roots), qubit joining it to its parent (-1 for boundary roots)
+    and syndrome of every node, peeled in a single reverse pass
+    """
+    def peel(self):
+        """
+        Flat indices of the correction, the qubit above every node whose subtree has odd syndrome parity.
+        A qubit can appear twice, a root away from the boundary shares its qubit with its first child.
+        Consumes the syndromes.
+        """
+        parents, qubits, syndromes = self.parents, self.qubits, self.syndromes
+        corrections = []
+        for k in range(self.n_nodes - 1, -1, -1):
+            if syndromes[k]:
+                if qubits[k] >= 0:
+                    corrections.append(qubits[k])
+                if parents[k] >= 0:
+                    syndromes[parents[k]] ^= 1
+        return corrections
+
+    def tree_sizes(self):
+        """
+        (erased qubits, depth) of every tree of more than one node
+        """
+        parents = self.parents
+        root = [0]*self.n_nodes
+        depth = [0]*self.n_nodes
+        trees = {}
+        for k in range(self.n_nodes):
+            if parents[k] < 0:
+                root[k] = k
+            else:
+                root[k] = root[parents[k]]
+                depth[k] = depth[parents[k]] + 1
+            nodes, tree_depth = trees.get(root[k], (0, 0))
+            trees[root[k]] = (nodes + 1, max(tree_depth, depth[k]))
+        return [(nodes - 1, tree_depth) for nodes, tree_depth in trees.values() if nodes > 1]
+
+class grown_forest(peeling_forest):
+    """
+    The trees of one grow of a shared forest, copied out of its lists for a code still holding them at the next grow
+    """
+    def __init__(self, forest):
+        n = forest.n_nodes
+        self.nodes, self.parents, self.qubits, self.syndromes = forest.nodes[:n], forest.parents[:n], forest.qubits[:n], forest.syndromes[:n]
+        self.n_nodes = n
+
+class erasure_forest(peeling_forest):
+    """
+    Peeling forest of one stabilizer type in flat lists preallocated over the padded indices of lattice_geometry.
+    grow visits the stabilizers in the order the recursive TreeNode construction of surface_code did, recording
+    for the k-th node its stabilizer, the position of its parent (-1 for roots), the qubit joining them (-1 for
+    boundary roots) and its syndrome, so peel is a single reverse pass over that order.
+    The forest is shared by the codes of a size. A code growing with owner = itself peels the lists in place, and
+    the next grow first gives it a grown_forest copy if it is still alive and holds the forest, so trees are only
+    copied when a code keeps them past another code's grow.
+    """
+    def __init__(self, geometry, stab_type):
+        n_cells = geometry.n_cells
+        self.stab_type = stab_type
+        self.owner = None
+        self.width = geometry.width
+        self.open_index = geometry.open_index[stab_type]
+        self.qubit_stabilizers = cell_stabilizers(geometry, stab_type)
+        self.nodes = [0]*n_cells
+        self.parents = [0]*n_cells
+        self.qubits = [0]*n_cells
+        self.syndromes = bytearray(n_cells)
+        self.n_nodes = 0
+        # scratch flags by cell, all zero between shots
+        self.visited = bytearray(n_cells)
+        self.erased = bytearray(n_cells)
+        self.marked = bytearray(n_cells)
+
+    def release(self, owner = None):
+        """
+        Give the code holding this forest a grown_forest copy of its trees, unless it is owner or gone
+        """
+        previous = None if self.owner is None else self.owner()
+        if previous is not None and previous is not owner and previous.forests is not None and previous.forests.get(self.stab_type) is self:
+            previous.forests[self.stab_type] = grown_forest(self)
+        self.owner = None
+
+    def grow(self, erasure_order, syndromes, owner = None):
+        """
+        Trees of the erased qubits, erasure_order the flat indices of the erased qubits in the iteration order
+        of the erasure set and syndromes the flat indices of the stabilizers with a syndrome.
+        Boundary trees are rooted at the first open stabilizer they touch, the others at the first stabilizer
+        of the first erased qubit left. owner is the code keeping this forest in its forests until the next grow.
+        The scratch flags are cleared even if growing fails.
+        """
+        self.release(owner)
+        width = self.width
+        nodes, parents, qubits, node_syndromes = self.nodes, self.parents, self.qubits, self.syndromes
+        visited, erased, marked, qubit_stabilizers = self.visited, self.erased, self.marked, self.qubit_stabilizers
+        n = 0
+        try:
+            for qubit in erasure_order:
+                erased[qubit] = 1
+            for stab in syndromes:
+                marked[stab] = 1
+            def roots():
+                # an open stabilizer without erased neighbours stays a single node no tree can reach, and is left out
+                for root in self.open_index:
+                    if not visited[root] and (erased[root + width] or erased[root - width] or erased[root + 1] or erased[root - 1]):
+                        yield root, -1
+                for root_qubit in erasure_order:
+                    if erased[root_qubit]:
+                        yield qubit_stabilizers[root_qubit][0], root_qubit
+            for root, root_qubit in roots():
+                visited[root] = 1
+                nodes[n], parents[n], qubits[n], node_syndromes[n] = root, -1, root_qubit, marked[root]
+                # position, stabilizer and remaining neighbours of every node on the path, and the second stabilizer
+                # of a qubit whose stabilizers both are children, next to the open stabilizers of even sizes
+                stack = [[n, root, iter((root + width, root - width, root + 1, root - 1)), None]]
+                n += 1
+                while stack:
+                    entry = stack[-1]
+                    position, node, neighbours, deferred = entry
+                    child = -1
+                    if deferred is not None:
+                        entry[3] = None
+                        qubit, child = deferred
+                        if visited[child]:
+                            continue
+                    else:
+                        for qubit in neighbours:
+                            if erased[qubit]:
+                                erased[qubit] = 0
+                                first, second = qubit_stabilizers[qubit]
+                                if first == node:
+                                    child = second
+                                elif second == node:
+                                    child = first
+                                elif visited[first]:
+                                    child = second
+                                else:
+                                    child = first
+                                    entry[3] = (qubit, second)
+                                if not visited[child]:
+                                    break
+                                child = -1
+                        if child < 0:
+                            stack.pop()
+                            continue
+                    visited[child] = 1
+                    nodes[n], parents[n], qubits[n], node_syndromes[n] = child, position, qubit, marked[child]
+                    stack.append([n, child, iter((child + width, child - width, child + 1, child - 1)), None])
+                    n += 1
+        finally:
+            for k in range(n):
+                visited[nodes[k]] = 0
+            # the trees consume every erased qubit, unless growing failed
+            for qubit in erasure_order:
+                erased[qubit] = 0
+            for stab in syndromes:
+                marked[stab] = 0
+        self.n_nodes = n
+        self.owner = None if owner is None else weakref.ref(owner)
+
+class spacetime_forest(erasure_forest):
+    """
+    Peeling forest of one stabilizer type over rounds of measurements, for surface_code with noisy measurements.
+    Nodes and edges have spacetime indices layer*cells + cell over the padded cells of lattice_geometry:
+    layer 2t holds the stabilizers measured in round t and the data qubits erased before it,
+    layer 2t + 1 the measurement of each stabilizer in round t, the time-like edge to its node in round t + 1.
+    Open stabilizers of every round are boundary nodes. The flags are sets and the node lists grow with the forest,
+    so memory follows the erased subgraph instead of the cells*rounds lattice. peel and tree_sizes are erasure_forest's,
+    peel returning edges.
+    """
+    def __init__(self, geometry, stab_type, rounds):
+        self.stab_type = stab_type
+        self.owner = None
+        self.width = geometry.width
+        self.cells = geometry.n_cells
+        self.rounds = rounds
+        self.open_cells = geometry.open_mask[stab_type].tobytes()
+        self.qubit_stabilizers = cell_stabilizers(geometry, stab_type)
+        self.nodes, self.parents, self.qubits, self.syndromes = [], [], [], bytearray()
+        self.n_nodes = 0
+
+    def endpoints(self, edge):
+        """
+        The two nodes of an edge
+        """
+        layer, cell = divmod(edge, self.cells)
+        if layer % 2:
+            return edge - self.cells, edge + self.cells
+        first, second = self.qubit_stabilizers[cell]
+        return layer*self.cells + first, layer*self.cells + second
+
+    def is_open(self, node):
+        return bool(self.open_cells[node % self.cells])
+
+    def grow(self, erasure_order, syndromes, owner = None):
+        """
+        Trees of the erased edges, erasure_order their spacetime indices in the order they were sampled
+        and syndromes the detection events. Every tree touching the boundary is rooted at the open stabilizer
+        of its first edge to the boundary, the others at the first node of their first edge.
+        """
+        self.release(owner)
+        width, cells = self.width, self.cells
+        erased = set(erasure_order)
+        marked = set(syndromes)
+        visited = set()
+        nodes, parents, qubits, node_syndromes = [], [], [], bytearray()
+        def roots():
+            for edge in erasure_order:
+                if edge in erased:
+                    for node in self.endpoints(edge):
+                        if self.is_open(node) and node not in visited:
+                            yield node
+            for edge in erasure_order:
+                if edge in erased:
+                    yield self.endpoints(edge)[0]
+        for root in roots():
+            if root in visited:
+                continue
+            visited.add(root)
+            nodes.append(root)
+            parents.append(-1)
+            qubits.append(-1)
+            node_syndromes.append(root in marked)
+            stack = [(len(nodes) - 1, root, iter((root + width, root - width, root + 1, root - 1, root + cells, root - cells)))]
+            while stack:
+                position, node, edges = stack[-1]
+                for edge in edges:
+                    if edge in erased:
+                        first, second = self.endpoints(edge)
+                        if node != first and node != second:
+                            # a data qubit next to an open stabilizer it does not belong to
+                            continue
+                        erased.discard(edge)
+                        child = second if node == first else first
+                        if child not in visited:
+                            visited.add(child)
+                            nodes.append(child)
+                            parents.append(position)
+                            qubits.append(edge)
+                            node_syndromes.append(child in marked)
+                            stack.append((len(nodes) - 1, child, iter((child + width, child - width, child + 1, child - 1, child + cells, child - cells))))
+                            break
+                else:
+                    stack.pop()
+        self.nodes, self.parents, self.qubits, self.syndromes = nodes, parents, qubits, node_syndromes
+        self.n_nodes = len(nodes)
+        self.owner = None if owner is None else weakref.ref(owner)
+
+    def events(self, edges):
+        """
+        Detection events of a set of flipped edges, the nodes with an odd number of them but the open stabilizers
+        """
+        events = set()
+        for edge in edges:
+            for node in self.endpoints(edge):
+                if not self.is_open(node):
+                    events.symmetric_difference_update((node,))
+        return events
@@ -0,0 +1,103 @@
+import time
+from collections import Counter, defaultdict
+import pandas as pd
+
+"""
+Opt-in instrumentation of the simulation loops. The simulators take profile = None and only call run_stage,
+which is a plain call without a profiler, so a sweep without profiling pays one extra function call per stage.
+"""
+
+def run_stage(profile, stage, function, *args):
+    """
+    function(*args), timed as stage of the current point of profile when there is one
+    """
+    if profile is None:
+        return function(*args)
+    return profile.time(stage, function, *args)
+
+class stage_profiler:
+    """
+    Cumulative seconds and counters per (size, physical error rate) and stage, histograms of the cluster sizes
+    (erased qubits per tree) and tree depths of construct_erasure_tree, and one record per decoder failure,
+    a shot left with a syndrome after decoding.
+    The shot engine also records the erasure clusters of every shot of odd surface lattices, for percolation analysis.
+    """
+    def __init__(self):
+        self.current = None
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.cluster_sizes = defaultdict(Counter)
+        self.tree_depths = defaultdict(Counter)
+        self.erasure_clusters = defaultdict(Counter)
+        self.shot_clusters = []
+        self.failures = []
+
+    def point(self, size, phys_error_rate):
+        self.current = (size, float(phys_error_rate))
+
+    def time(self, stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.seconds[self.current, stage] += time.perf_counter() - start
+        return result
+
+    def count(self, counter, n = 1):
+        self.counters[self.current, counter] += int(n)
+
+    def record_forests(self, forests):
+        """
+        Size and depth of every tree of the peeling.erasure_forest of each stabilizer type
+        """
+        for forest in forests.values():
+            for cluster_size, depth in forest.tree_sizes():
+                self.cluster_sizes[self.current][cluster_size] += 1
+                self.tree_depths[self.current][depth] += 1
+
+    def record_clusters(self, shot, clusters):
+        """
+        Sizes of the erasure clusters of each error type of surface_code.erasure_clusters, and one row per shot and type
+        with the number of clusters, the largest one and whether one spans the boundaries
+        """
+        for error_type, (sizes, spans) in clusters.items():
+            for cluster_size in sizes:
+                self.erasure_clusters[self.current][cluster_size] += 1
+            self.shot_clusters.append((*self.current, shot, error_type, len(sizes), max(sizes, default = 0), spans))
+
+    def record_failure(self, **record):
+        self.count("residual_syndrome")
+        self.failures.append(dict(zip(["size", "physical_error_rate"], self.current), **record))
+
+    def frame(self):
+        """
+        Seconds of every stage as <stage>_seconds columns and the counters, indexed by (size, physical_error_rate)
+        """
+        columns = defaultdict(dict)
+        for (point, stage), seconds in self.seconds.items():
+            columns[f"{stage}_seconds"][point] = seconds
+        for (point, counter), count in self.counters.items():
+            columns[counter][point] = count
+        df = pd.DataFrame(columns)
+        if len(df):
+            df.index = pd.MultiIndex.from_tuples(df.index, names = ["size", "physical_error_rate"])
+            df = df.sort_index()
+        return df.fillna(0)
+
+    def histogram_frame(self, histograms):
+        """
+        Long DataFrame of cluster_sizes or tree_depths, one row per (size, physical_error_rate, value) with its count
+        """
+        rows = [(*point, value, count) for point, histogram in histograms.items() for value, count in sorted(histogram.items())]
+        return pd.DataFrame(rows, columns = ["size", "physical_error_rate", "value", "count"])
+
+    def report(self):
+        """
+        Everything recorded, as DataFrames, to save next to the results of a sweep
+        """
+        return {
+            "stages": self.frame(),
+            "cluster_sizes": self.histogram_frame(self.cluster_sizes),
+            "tree_depths": self.histogram_frame(self.tree_depths),
+            "erasure_clusters": self.histogram_frame(self.erasure_clusters),
+            "shot_clusters": pd.DataFrame(self.shot_clusters, columns = ["size", "physical_error_rate", "shot", "error_type", "clusters", "largest", "spans"]),
+            "failures": pd.DataFrame(self.failures)
+        }
@@ -0,0 +1,83 @@
+import sqlite3
+import json
+import time
+import numpy as np
+import pandas as pd
+from simulator import outcomes
+
+class results_store:
+    """
+    Append-only SQLite file of sweep chunks, one row per (code, decoder, size, physical error rate, seed, chunk size, chunk).
+    Rows are committed as chunks finish, so an interrupted sweep keeps its finished chunks and can be resumed.
+    A chunk's samples only depend on its key, so rows of different seeds or chunk sizes are independent samples of a point and can be summed.
+    """
+    def __init__(self, path, timeout = 5.0):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout = timeout)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                code TEXT, decoder TEXT, size INTEGER, physical_error_rate REAL, seed TEXT, chunk_size INTEGER, chunk INTEGER,
+                n_samples INTEGER, no_error INTEGER, undetected_error INTEGER, corrected_error INTEGER, uncorrected_error INTEGER,
+                engine TEXT, seconds REAL, finished REAL,
+                PRIMARY KEY (code, decoder, size, physical_error_rate, seed, chunk_size, chunk));
+            CREATE TABLE IF NOT EXISTS runs (started REAL, seed TEXT, arguments TEXT);
+        """)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def add_run(self, seed, arguments):
+        """
+        Record the root seed and arguments of a sweep, so it can be resumed
+        """
+        self.connection.execute("INSERT INTO runs VALUES (?, ?, ?)", (time.time(), str(seed), json.dumps(arguments)))
+        self.connection.commit()
+
+    def last_seed(self):
+        row = self.connection.execute("SELECT seed FROM runs ORDER BY started DESC LIMIT 1").fetchone()
+        return None if row is None else int(row[0])
+
+    def add_chunk(self, key, counts, engine = None, seconds = None):
+        """
+        key is (code, decoder, size, physical_error_rate, seed, chunk_size, chunk) and counts follow outcomes.
+        A chunk already stored with the same number of samples is kept, one stored with another number is replaced.
+        """
+        code, decoder, size, phys_error_rate, seed, chunk_size, chunk = key
+        row = (code, decoder, int(size), float(phys_error_rate), str(seed), int(chunk_size), int(chunk),
+            int(sum(counts)), *(int(count) for count in counts), engine, seconds, time.time())
+        columns = ["n_samples", *outcomes, "engine", "seconds", "finished"]
+        self.connection.execute(f"""INSERT INTO chunks VALUES ({', '.join('?'*len(row))})
+            ON CONFLICT (code, decoder, size, physical_error_rate, seed, chunk_size, chunk) DO UPDATE SET
+            {', '.join(f'{column} = excluded.{column}' for column in columns)} WHERE n_samples != excluded.n_samples""", row)
+        self.connection.commit()
+
+    def get_chunks(self, code, decoder, seed, chunk_size, n_samples = None):
+        """
+        {(size, physical_error_rate, chunk): counts} of the chunks stored for a root seed and chunk size, counts in the order of outcomes.
+        With n_samples, only the chunks of a sweep of n_samples per point, holding the samples their chunk of that sweep has.
+        """
+        query = f"""SELECT size, physical_error_rate, chunk, {', '.join(outcomes)} FROM chunks
+            WHERE code = ? AND decoder = ? AND seed = ? AND chunk_size = ?"""
+        parameters = (code, decoder, str(seed), int(chunk_size))
+        if n_samples is not None:
+            query += " AND n_samples = MIN(chunk_size, ? - chunk*chunk_size)"
+            parameters += (int(n_samples),)
+        rows = self.connection.execute(query, parameters)
+        return {(size, phys_error_rate, chunk): np.array(counts, dtype = np.int64) for size, phys_error_rate, chunk, *counts in rows}
+
+    def merged_counts(self, code, decoder, size_list = None, error_range = None):
+        """
+        Counts of every stored run summed per (size, physical error rate), with the number of samples and seeds.
+        Error rates are matched to 12 decimals, so points of sweeps over different ranges merge.
+        """
+        df = pd.read_sql_query(f"""SELECT size, ROUND(physical_error_rate, 12) AS physical_error_rate, SUM(n_samples) AS n_samples,
+            {', '.join(f'SUM({col}) AS {col}' for col in outcomes)}, COUNT(DISTINCT seed) AS n_seeds FROM chunks
+            WHERE code = ? AND decoder = ? GROUP BY size, ROUND(physical_error_rate, 12)""", self.connection, params = (code, decoder))
+        if size_list is not None:
+            df = df[df["size"].isin(size_list)]
+        if error_range is not None:
+            df = df[df["physical_error_rate"].isin([round(float(p), 12) for p in error_range])]
+        df = df.set_index(["size", "physical_error_rate"]).sort_index()
+        df["effective_error_rate"] = 0.75*df.index.get_level_values("physical_error_rate")
+        return df
@@ -1,49 +1,565 @@
 import numpy as np
-from topological_code import surface_code, toric_code
+from topological_code import surface_code, toric_code, spacetime_code
+from batch_code import new_batch_code, default_batch_size, spread_lanes, unpack_shots
+from error_models import get_channels, shot_batches, fixed_weight_erasure_channel
+from lattice import get_geometry, get_toric_geometry, lattice_shape
+from profiling import run_stage
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import NormalDist
 import pandas as pd
+import time
+from math import lgamma, log, log1p, exp
 
+# outcome of a shot with detected and logical errors is outcomes[2*detected + logical]
+outcomes = ["no_error", "undetected_error", "corrected_error", "uncorrected_error"]
 
-def simulate(size_list, lower_bound, upper_bound, n_points, n_samples, code):
+
+def simulate(size_list, lower_bound, upper_bound, n_points, n_samples, code, engine = "shot", batch_size = None, decoder = "tree", profile = None,
+        rounds = 1, measurement_error_rate = None, seed = None):
     """
     takes in size of code to simulate, the physical error rate to simulate
+    engine = "shot" builds one code object per sample, engine = "batch" samples batch_size shots at once
+    with batch_surface_code and gives the same counts for the same random state
+    decoder is the method passed to erasure_decoder, "tree" or "union_find"
+    profile is an optional profiling.stage_profiler that times the stages of every point
+    rounds > 1 measures the syndrome rounds times with spacetime_code, every measurement but the last erased
+    with probability measurement_error_rate (the physical error rate by default)
+    the points draw in turn from np.random.default_rng(seed), or from the global np.random state without a seed
+    """
+    check_engine(size_list, code, engine, decoder, rounds)
+    rng = np.random if seed is None else np.random.default_rng(seed)
+    error_range = np.linspace(lower_bound, upper_bound, n_points)
+    counts = empty_counts(size_list, error_range)
+    for i, size in enumerate(size_list):
+        for j, phys_error_rate in enumerate(error_range):
+            if profile is not None:
+                profile.point(size, phys_error_rate)
+            if engine in ["batch", "packed"]:
+                counts[i, j] += simulate_batch(size, phys_error_rate, n_samples, batch_size, rng, decoder, code, engine, profile)
+            else:
+                counts[i, j] += simulate_shots(size, phys_error_rate, n_samples, code, rng, decoder, profile = profile,
+                    rounds = rounds, measurement_error_rate = measurement_error_rate)
+
+    return count_frame(size_list, error_range, counts)
+
+def simulate_parallel(size_list, lower_bound, upper_bound, n_points, n_samples, code, engine = "batch", workers = None, seed = None, chunk_size = 1000, batch_size = None, decoder = "tree",
+        store = None, resume = False):
+    """
+    Same sweep as simulate, split into (size, physical error rate, chunk of chunk_size samples) tasks run on a process pool.
+    Every task draws from its own generator seeded by chunk_seed, so for a given seed and chunk_size
+    the counts do not depend on the number of workers or on the other points of the sweep.
+    workers = None or 0 uses one process per core, workers = 1 runs the tasks in this process
+    store is a results_store that every chunk is written to as it finishes, with resume = True the chunks
+    it already holds for this seed and chunk_size are read back instead of simulated, unless they hold another number of samples,
+    as the last chunk of a sweep with fewer samples does, which are simulated again and replaced
+    """
+    check_engine(size_list, code, engine)
+    if store is not None and any(isinstance(size, tuple) for size in size_list):
+        raise ValueError("The results store only holds square sizes")
+    seed = np.random.SeedSequence(seed).entropy
+    error_range = np.linspace(lower_bound, upper_bound, n_points)
+    counts = empty_counts(size_list, error_range)
+    points = {(size, phys_error_rate): (i, j) for i, size in enumerate(size_list) for j, phys_error_rate in enumerate(error_range)}
+    chunks = [(size, phys_error_rate, chunk, min(chunk_size, n_samples - start))
+              for size, phys_error_rate in points for chunk, start in enumerate(range(0, n_samples, chunk_size))]
+    done = store.get_chunks(code, decoder, seed, chunk_size, n_samples) if store is not None and resume else {}
+    tasks = [(size, phys_error_rate, n_chunk, code, engine, batch_size, decoder, chunk_seed(seed, size, phys_error_rate, chunk_size, chunk))
+             for size, phys_error_rate, chunk, n_chunk in chunks if (size, phys_error_rate, chunk) not in done]
+    keys = [(code, decoder, size, phys_error_rate, seed, chunk_size, chunk)
+            for size, phys_error_rate, chunk, n_chunk in chunks if (size, phys_error_rate, chunk) not in done]
+    for key, task_counts in done.items():
+        if key[:2] in points:
+            counts[points[key[:2]]] += task_counts
+    if workers == 1:
+        finished = ((key, timed_task(task)) for key, task in zip(keys, tasks))
+    else:
+        executor = ProcessPoolExecutor(max_workers = workers or None)
+        futures = {executor.submit(timed_task, task): key for key, task in zip(keys, tasks)}
+        finished = ((futures[future], future.result()) for future in as_completed(futures))
+    try:
+        for key, (task_counts, seconds) in finished:
+            if store is not None:
+                store.add_chunk(key, task_counts, engine, seconds)
+            counts[points[key[2:4]]] += task_counts
+    finally:
+        if workers != 1:
+            executor.shutdown(cancel_futures = True)
+    return count_frame(size_list, error_range, counts)
+
+def chunk_seed(seed, size, phys_error_rate, chunk_size, chunk):
+    """
+    SeedSequence of one chunk of a point, from the root seed and the chunk's own key, (rows, columns) for a rectangular size.
+    The chunk size is part of the key, so sweeps of one seed with different chunk sizes draw independent samples.
+    """
+    size_key = tuple(size) if isinstance(size, tuple) else (size,)
+    return np.random.SeedSequence(seed, spawn_key = (*size_key, int(np.float64(phys_error_rate).view(np.uint64)), int(chunk_size), chunk))
+
+def simulate_channels(size_list, lower_bound, upper_bound, n_points, n_samples, code, noise, noise_parameter = None, engine = "batch",
+        batch_size = None, decoder = "tree", seed = None):
+    """
+    Same sweep as simulate with a noise model of error_models.get_channels instead of add_erasure_errors,
+    every point drawing from its own np.random.SeedSequence spawned from seed
+    """
+    check_engine(size_list, code, engine)
+    error_range = np.linspace(lower_bound, upper_bound, n_points)
+    counts = empty_counts(size_list, error_range)
+    seeds = iter(np.random.SeedSequence(seed).spawn(counts.shape[0]*counts.shape[1]))
+    for i, size in enumerate(size_list):
+        for j, phys_error_rate in enumerate(error_range):
+            channels = get_channels(noise, phys_error_rate, noise_parameter)
+            counts[i, j] += simulate_stream(size, n_samples, channels, batch_size, next(seeds), decoder, code, engine)
+    return count_frame(size_list, error_range, counts)
+
+def simulate_coupled(size_list, lower_bound, upper_bound, n_points, n_samples, code = "surface", batch_size = None, decoder = "tree", seed = None):
+    """
+    Same sweep as simulate with every error rate of a size evaluated on the same shots, see coupled_counts.
+    The curves share their randomness, so differences between neighbouring error rates are far less noisy.
+    Only odd sizes of the surface code, whose state is kept in the words of packed_surface_code.
+    """
+    check_engine(size_list, code, "packed")
+    error_range = np.linspace(lower_bound, upper_bound, n_points)
+    counts = empty_counts(size_list, error_range)
+    rng = np.random.default_rng(seed)
+    for i, size in enumerate(size_list):
+        counts[i] += coupled_counts(size, error_range, n_samples, batch_size, rng, decoder)
+    return count_frame(size_list, error_range, counts)
+
+def coupled_counts(size, error_range, n_samples, batch_size = None, rng = np.random, decoder = "tree"):
+    """
+    counts of each outcome at every error rate, (len(error_range), len(outcomes)), from two uniforms per qubit and shot.
+    A qubit is erased from the first error rate above its first uniform on and gets the Pauli its second uniform picks,
+    with the probabilities of add_erasure_errors, so the erasures and errors of a shot are nested as the error rate grows.
+    The error rates are visited in increasing order, adding the qubits erased at each one to a packed_surface_code,
+    and the erased cells reached from the first boundaries grow from the ones reached at the error rate before.
+    Only the shots whose erasure then spans are classified by classify_shots, which gives the counts of
+    classify_batch on the errors of each error rate, the others are classified from their syndrome.
     """
+    if batch_size is None:
+        batch_size = default_batch_size(size)
+    order = np.argsort(error_range)
+    counts = np.zeros((len(error_range), len(outcomes)), dtype = np.int64)
+    for start in range(0, n_samples, batch_size):
+        encoding = new_batch_code(size, min(batch_size, n_samples - start), "surface", "packed")
+        geometry = encoding.geometry
+        random = rng.random((encoding.n_shots, *geometry.shape))
+        pauli = rng.random((encoding.n_shots, *geometry.shape))
+        # position in order of the first error rate erasing each qubit, len(order) for none
+        levels = np.where(geometry.data_grid, np.searchsorted(error_range[order], random, side = "right"), len(order))
+        X, Z = pauli < 1/2, (pauli >= 1/4) & (pauli < 3/4)
+        X_words, Z_words = encoding.pack(X & geometry.data_grid), encoding.pack(Z & geometry.data_grid)
+        reached = {error_type: np.zeros_like(encoding.erasures) for error_type in ["X", "Z"]}
+        for level, j in enumerate(order):
+            added = encoding.pack(levels == level)
+            encoding.erasures |= added
+            encoding.operations["X"] ^= added & X_words
+            encoding.operations["Z"] ^= added & Z_words
+            encoding.measure_syndrome()
+            outcome = 2*encoding.error_detected().astype(np.int64)
+            spans = np.zeros(encoding.n_shots, dtype = bool)
+            for error_type in ["X", "Z"]:
+                first, second = (np.flatnonzero(mask) for mask in geometry.boundary_mask[error_type])
+                reached[error_type][first] |= encoding.erasures[first]
+                reached[error_type] = spread_lanes(encoding.erasures, reached[error_type], geometry.adjacency_offsets[error_type])
+                spans |= unpack_shots(np.bitwise_or.reduce(reached[error_type][second], axis = 0), encoding.n_shots)
+            shots = np.flatnonzero(spans)
+            if len(shots):
+                erased = levels[shots] <= level
+                spanning = new_batch_code(size, len(shots), "surface", "packed")
+                spanning.add_grid_errors(erased, erased & X[shots], erased & Z[shots])
+                outcome[shots] = classify_shots(spanning, decoder)
+            counts[j] += np.bincount(outcome, minlength = len(outcomes))
+    return counts
+
+def simulate_adaptive(size_list, lower_bound, upper_bound, n_points, max_samples, code, engine = "batch", target_width = 0.1, confidence = 0.95,
+        interval = "wilson", min_samples = 1000, time_budget = None, workers = 1, seed = None, chunk_size = 10000, batch_size = None, decoder = "tree"):
+    """
+    Samples the (size, physical error rate) points in rounds until the confidence interval on the logical error rate of each
+    is narrower than target_width times the rate, from a budget of max_samples samples and time_budget seconds per point
+    pooled over the sweep. A point starts with min_samples samples, each round it asks for the samples its current rate says
+    it still needs, at most doubling its total, and the budget left goes to the widest intervals first, so the samples and
+    time a point does not need because it resolved early go to the unresolved ones, usually those near threshold.
+    Points without failures yet, far below threshold, have no finite width and come after every point with failures.
+    The sweep stops when every point is resolved or the budget is spent.
+    Every point has its own np.random.SeedSequence spawned from seed and each task of at most chunk_size samples spawns from it,
+    so without a time budget the counts only depend on seed and chunk_size.
+    Adds n_samples, logical_error_rate, ci_lower and ci_upper columns.
+    """
+    check_engine(size_list, code, engine)
     error_range = np.linspace(lower_bound, upper_bound, n_points)
+    counts = empty_counts(size_list, error_range)
+    points = [(i, j) for i in range(len(size_list)) for j in range(len(error_range))]
+    seeds = dict(zip(points, np.random.SeedSequence(seed).spawn(len(points))))
+    sample_budget = max_samples*len(points)
+    seconds_budget = None if time_budget is None else time_budget*len(points)
+    elapsed = 0.0
+    executor = None if workers == 1 else ProcessPoolExecutor(max_workers = workers or None)
+    try:
+        unfinished = points
+        while unfinished and counts.sum() < sample_budget and (seconds_budget is None or elapsed < seconds_budget):
+            remaining = sample_budget - int(counts.sum())
+            tasks = []
+            for point in sorted(unfinished, key = lambda point: sampling_order(counts[point], confidence, interval)):
+                n_round = min(remaining, samples_needed(counts[point], target_width, confidence, min_samples, int(counts[point].sum()) + remaining))
+                remaining -= n_round
+                for start in range(0, n_round, chunk_size):
+                    tasks.append((point, (size_list[point[0]], error_range[point[1]], min(chunk_size, n_round - start), code, engine,
+                        batch_size, decoder, seeds[point].spawn(1)[0])))
+            results = [timed_task(task) for point, task in tasks] if executor is None else list(executor.map(timed_task, [task for point, task in tasks]))
+            for (point, task), (task_counts, seconds) in zip(tasks, results):
+                elapsed += seconds
+                counts[point] += task_counts
+            unfinished = [point for point in unfinished if relative_width(counts[point], confidence, interval) > target_width]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    df = count_frame(size_list, error_range, counts)
+    n_samples = counts.sum(axis = 2).ravel()
+    failures = logical_failures(counts).ravel()
+    df["n_samples"] = n_samples
+    df["logical_error_rate"] = failures/n_samples
+    df["ci_lower"], df["ci_upper"] = np.array([confidence_interval(k, n, confidence, interval) for k, n in zip(failures, n_samples)]).T
+    return df
+
+def simulate_stratified(size_list, lower_bound, upper_bound, n_points, n_samples, code, engine = "batch", confidence = 0.95, tail = 1e-12,
+        seed = None, batch_size = None, decoder = "tree"):
+    """
+    Rare-event estimate of the logical error rate of the erasure channel, stratified by the number of erasures w.
+    With n data qubits w is Binomial(n, p) and the failure rate is sum_w P(w) f_w, where f_w is the failure rate
+    of shots with exactly w erasures. f_w does not depend on p, so every size samples its strata once, n_samples shots
+    in total, and every error rate reweights them. Fewer than distance erasures never hold a logical operator, so f_w = 0 there,
+    and strata further than tail of binomial mass from the bulk of every error rate are not sampled, their mass is added to ci_upper.
+    Half of the shots go evenly to the strata, the other half by Neyman allocation, proportional to P(w) sqrt(f_w (1 - f_w))
+    with the Laplace estimate of f_w from the first half, summed over the error rates after normalizing each.
+    The interval is the normal one, with the Laplace estimates in the variance so strata without failures still count.
+    The peeling decoder is maximum likelihood for erasures, so f_w does not decrease with w, and a stratum without failures
+    uses the shots of the strata above it that have none either.
+    Every stratum gets at least one shot, so n_samples below the number of strata is refused and the shots never exceed n_samples.
+    Adds n_samples, logical_error_rate, ci_lower and ci_upper columns, without outcome counts.
+    """
+    if engine not in ["batch", "packed"]:
+        raise ValueError("The stratified estimator needs the batch or packed engine")
+    check_engine(size_list, code, engine)
+    error_range = np.linspace(lower_bound, upper_bound, n_points)
+    z = NormalDist().inv_cdf(1/2 + confidence/2)
+    rows = []
+    for size, size_seed in zip(size_list, np.random.SeedSequence(seed).spawn(len(size_list))):
+        geometry = get_toric_geometry(size) if code == "toric" else get_geometry(size)
+        n_qubits = len(geometry.data_qubits)
+        distance = geometry.distance
+        pmf = np.array([weight_distribution(n_qubits, p) for p in error_range])
+        weights = np.unique(np.concatenate([weight_strata(point_pmf, distance, tail) for point_pmf in pmf])).astype(np.int64)
+        if n_samples < len(weights):
+            raise ValueError(f"Size {size} has {len(weights)} strata, more than the {n_samples} samples, which need at least one shot each")
+        shots = np.zeros(len(weights), dtype = np.int64)
+        failures = np.zeros(len(weights), dtype = np.int64)
+        allocation = np.full(len(weights), max(1, n_samples//(2*max(1, len(weights)))))
+        for stage in range(2):
+            for k, (weight, n_weight) in enumerate(zip(weights, allocation)):
+                if n_weight > 0:
+                    counts = simulate_stream(size, int(n_weight), [fixed_weight_erasure_channel(weight)], batch_size,
+                        size_seed.spawn(1)[0], decoder, code, engine)
+                    shots[k] += n_weight
+                    failures[k] += logical_failures(counts)
+            laplace = smoothed_rates(shots, failures)
+            spread = pmf[:, weights]*np.sqrt(laplace*(1 - laplace))
+            spread = (spread/np.maximum(spread.sum(axis = 1, keepdims = True), np.finfo(float).tiny)).sum(axis = 0)
+            remaining = max(0, n_samples - int(shots.sum()))
+            if len(weights):
+                allocation = np.floor(remaining*spread/spread.sum()).astype(np.int64)
+        for point_pmf in pmf:
+            probability = point_pmf[weights]
+            unsampled = max(0.0, point_pmf[distance:].sum() - probability.sum())
+            rate = float(np.sum(probability*failures/np.maximum(shots, 1)))
+            half_width = z*np.sqrt(np.sum(probability**2*laplace*(1 - laplace)/np.maximum(shots, 1)))
+            rows.append((int(shots.sum()), rate, max(0.0, rate - half_width), min(1.0, rate + half_width + unsampled)))
     index = pd.MultiIndex.from_product([size_list,error_range], names = ["size", "physical_error_rate"])
-    df = pd.DataFrame(columns = ["no_error", "undetected_error", "corrected_error", "uncorrected_error", "effective_error_rate"], index = index)
-    for col in df.columns:
-        df[col].values[:] = 0
-    for size in size_list:
-        for phys_error_rate in error_range:
-            df.loc[(size,phys_error_rate), "effective_error_rate"] += 0.75*phys_error_rate
-            for n in range(n_samples):
-                if code == "toric":
-                    encoding = toric_code(size)
-                else:
-                    encoding = surface_code(size)
-
-                encoding.add_erasure_errors(phys_error_rate)
-                encoding.measure_syndrome()
-                if not encoding.error_detected():
-                    if not encoding.has_logical_error():
-                        df.loc[(size,phys_error_rate), "no_error"] += 1
-                        continue
-                    else:
-                        df.loc[(size,phys_error_rate), "undetected_error"] += 1
-                    continue # exit to next sample
-                else:
-                # we use the decoding algorithm if there is any error
-                    encoding.erasure_decoder()
-                    encoding.measure_syndrome()
-                    if encoding.error_detected():
-                        print(f"For Size {size}")
-                        print(f"Symdromes: {encoding.syndromes}")
-                        print(f"Operations: {encoding.operations}")
-                        print(f"Erasure Set: {encoding.erasure_set}")
-                        break
-                    if encoding.has_logical_error():
-                        df.loc[(size,phys_error_rate), "uncorrected_error"] += 1
-                    else:
-                        df.loc[(size,phys_error_rate), "corrected_error"] += 1
+    df = pd.DataFrame(rows, columns = ["n_samples", "logical_error_rate", "ci_lower", "ci_upper"], index = index)
+    df.insert(0, "effective_error_rate", 0.75*index.get_level_values("physical_error_rate"))
+    return df
+
+def smoothed_rates(shots, failures):
+    """
+    Laplace estimates (failures + 1)/(shots + 2) of the strata, with the shots of a stratum without failures
+    pooled with those of the consecutive strata above it without failures, whose rates bound its own
+    """
+    pooled = shots.copy()
+    for k in range(len(shots) - 2, -1, -1):
+        if failures[k] == 0 and failures[k + 1] == 0:
+            pooled[k] += pooled[k + 1]
+    return (failures + 1)/(pooled + 2)
+
+def weight_distribution(n_qubits, p):
+    """
+    Binomial(n_qubits, p) probabilities of 0..n_qubits erasures, from log space
+    """
+    if p <= 0 or p >= 1:
+        pmf = np.zeros(n_qubits + 1)
+        pmf[0 if p <= 0 else n_qubits] = 1.0
+        return pmf
+    return np.array([exp(lgamma(n_qubits + 1) - lgamma(w + 1) - lgamma(n_qubits - w + 1) + w*log(p) + (n_qubits - w)*log1p(-p))
+        for w in range(n_qubits + 1)])
+
+def weight_strata(pmf, distance, tail):
+    """
+    The contiguous weights from distance on that hold all but at most tail of the mass above distance,
+    trimmed from the side with less mass
+    """
+    low, high = distance, len(pmf) - 1
+    dropped = 0.0
+    while low <= high and dropped + min(pmf[low], pmf[high]) <= tail:
+        if pmf[low] <= pmf[high]:
+            dropped += pmf[low]
+            low += 1
+        else:
+            dropped += pmf[high]
+            high -= 1
+    return np.arange(low, high + 1)
+
+def samples_needed(counts, target_width, confidence, min_samples, max_samples):
+    """
+    Samples for the next round of a point, from the normal approximation n = 4 z^2 (1 - rate)/(rate target_width^2)
+    """
+    n_samples = int(counts.sum())
+    if n_samples == 0:
+        return min(min_samples, max_samples)
+    failures = int(logical_failures(counts))
+    if failures == 0:
+        needed = 2*n_samples
+    else:
+        rate = failures/n_samples
+        z = NormalDist().inv_cdf(1/2 + confidence/2)
+        needed = int(np.ceil(4*z**2*(1 - rate)/(rate*target_width**2)))
+    return max(1, min(max(needed - n_samples, min_samples), n_samples, max_samples - n_samples))
 
+def sampling_order(counts, confidence, interval):
+    """
+    Sort key of a point in a round of simulate_adaptive: the widest finite intervals first,
+    then the points without failures, fewest samples first
+    """
+    width = relative_width(counts, confidence, interval)
+    return (1, int(counts.sum())) if np.isinf(width) else (0, -width)
+
+def relative_width(counts, confidence, interval):
+    n_samples = int(counts.sum())
+    failures = int(logical_failures(counts))
+    if failures == 0:
+        return np.inf
+    lower, upper = confidence_interval(failures, n_samples, confidence, interval)
+    return (upper - lower)*n_samples/failures
+
+def confidence_interval(failures, n_samples, confidence = 0.95, interval = "wilson"):
+    """
+    Two sided interval on a binomial rate, interval = "wilson" for the Wilson score interval
+    or "clopper_pearson" for the exact interval
+    """
+    if interval == "wilson":
+        z = NormalDist().inv_cdf(1/2 + confidence/2)
+        rate = failures/n_samples
+        center = (rate + z**2/(2*n_samples))/(1 + z**2/n_samples)
+        half_width = z/(1 + z**2/n_samples)*np.sqrt(rate*(1 - rate)/n_samples + z**2/(4*n_samples**2))
+        return max(0.0, center - half_width), min(1.0, center + half_width)
+    if interval == "clopper_pearson":
+        alpha = 1 - confidence
+        lower = 0.0 if failures == 0 else bisect_rate(lambda p: 1 - binomial_cdf(failures - 1, n_samples, p) - alpha/2)
+        upper = 1.0 if failures == n_samples else bisect_rate(lambda p: alpha/2 - binomial_cdf(failures, n_samples, p))
+        return lower, upper
+    raise ValueError(f"Unknown interval {interval}")
+
+def binomial_cdf(k, n, p):
+    """
+    P(X <= k) for X ~ Binomial(n, p), summed in log space
+    """
+    if p <= 0:
+        return 1.0
+    if p >= 1:
+        return float(k >= n)
+    j = np.arange(1, k + 1)
+    log_pmf = n*np.log1p(-p) + np.concatenate(([0.0], np.cumsum(np.log((n - j + 1)/j) + np.log(p) - np.log1p(-p))))
+    top = log_pmf.max()
+    return min(1.0, float(np.exp(top)*np.exp(log_pmf - top).sum()))
+
+def bisect_rate(f, iterations = 60):
+    """
+    Root in [0, 1] of an increasing function f
+    """
+    low, high = 0.0, 1.0
+    for _ in range(iterations):
+        middle = (low + high)/2
+        if f(middle) < 0:
+            low = middle
+        else:
+            high = middle
+    return (low + high)/2
+
+def timed_task(task):
+    """
+    simulate_task and the seconds it took
+    """
+    start = time.perf_counter()
+    counts = simulate_task(task)
+    return counts, time.perf_counter() - start
+
+def simulate_task(task):
+    """
+    counts for one chunk of samples, run in a worker process
+    """
+    size, phys_error_rate, n_samples, code, engine, batch_size, decoder, seed_sequence = task
+    rng = np.random.default_rng(seed_sequence)
+    if engine in ["batch", "packed"]:
+        return simulate_batch(size, phys_error_rate, n_samples, batch_size, rng, decoder, code, engine)
+    return simulate_shots(size, phys_error_rate, n_samples, code, rng, decoder)
+
+def check_engine(size_list, code, engine, decoder = "tree", rounds = 1):
+    if code == "toric" and any(isinstance(size, tuple) for size in size_list):
+        raise ValueError("The toric code only supports square sizes")
+    if code == "toric" and any(size % 2 == 1 for size in size_list):
+        raise ValueError("The toric code needs even sizes")
+    if engine == "packed" and code != "surface":
+        raise ValueError("The packed engine only supports the surface code")
+    if engine in ["batch", "packed"] and code == "surface" and any(length % 2 == 0 for size in size_list for length in lattice_shape(size)):
+        # the peeling decoder leaves syndromes behind on even lattices, which the per-shot loop reports and stops on
+        raise ValueError("The batch engine only supports odd sizes of the surface code")
+    if rounds > 1 and (code != "surface" or engine != "shot" or decoder != "tree"):
+        raise ValueError("Several rounds of measurements need the surface code, the shot engine and the tree decoder")
+
+def empty_counts(size_list, error_range):
+    """
+    Outcome counts of a sweep, indexed by (size index, physical error rate index, outcome)
+    """
+    return np.zeros((len(size_list), len(error_range), len(outcomes)), dtype = np.int64)
+
+def logical_failures(counts):
+    return counts[..., outcomes.index("undetected_error")] + counts[..., outcomes.index("uncorrected_error")]
+
+def count_frame(size_list, error_range, counts):
+    """
+    DataFrame of the counts in the schema of the saved sweeps, indexed by (size, physical_error_rate)
+    """
+    index = pd.MultiIndex.from_product([size_list,error_range], names = ["size", "physical_error_rate"])
+    df = pd.DataFrame(counts.reshape(-1, len(outcomes)), columns = outcomes, index = index)
+    df["effective_error_rate"] = 0.75*index.get_level_values("physical_error_rate")
     return df
 
+def simulate_shots(size, phys_error_rate, n_samples, code, rng = np.random, decoder = "tree", profile = None, rounds = 1, measurement_error_rate = None):
+    """
+    counts of each outcome, in the order of outcomes, over n_samples shots, building one code object per shot.
+    A shot left with a syndrome after decoding is an uncorrected error, and a failure record of profile
+    rounds > 1 samples spacetime_code shots with measurement erasures at measurement_error_rate
+    Detected shots of odd surface lattices whose erasure_clusters span no boundaries are corrected errors without decoding,
+    with profile the clusters of every shot are recorded
+    """
+    counts = np.zeros(len(outcomes), dtype = np.int64)
+    error_rates = (phys_error_rate, rng) if rounds == 1 else (phys_error_rate, rng, measurement_error_rate)
+    # peeling clears every syndrome of odd lattices, so there a shot without a spanning cluster is classified without decoding
+    early_exit = code == "surface" and rounds == 1 and all(length % 2 for length in lattice_shape(size))
+    for n in range(n_samples):
+        if code == "toric":
+            encoding = toric_code(size)
+        elif rounds > 1:
+            encoding = spacetime_code(size, rounds)
+        else:
+            encoding = surface_code(size)
+
+        run_stage(profile, "add_erasure_errors", encoding.add_erasure_errors, *error_rates)
+        run_stage(profile, "measure_syndrome", encoding.measure_syndrome)
+        detected = bool(encoding.error_detected())
+        if early_exit and (detected or profile is not None):
+            clusters = run_stage(profile, "erasure_clusters", encoding.erasure_clusters, profile is None)
+            if profile is not None:
+                profile.record_clusters(n, clusters)
+            if not any(spans for sizes, spans in clusters.values()):
+                if profile is not None:
+                    profile.count("early_exit")
+                counts[2*detected] += 1
+                continue
+        if detected:
+        # we use the decoding algorithm if there is any error
+            if profile is not None and code == "surface" and decoder == "tree":
+                profile.time("construct_erasure_tree", encoding.construct_erasure_tree)
+                profile.record_forests(encoding.forests)
+                profile.time("peel_erasure_trees", encoding.peel_erasure_trees)
+            else:
+                run_stage(profile, "erasure_decoder", encoding.erasure_decoder, decoder)
+            run_stage(profile, "measure_syndrome", encoding.measure_syndrome)
+            if encoding.error_detected():
+                if profile is not None:
+                    profile.record_failure(engine = "shot", decoder = decoder, shot = n,
+                        syndromes = {stab_type: sorted(stabs) for stab_type, stabs in encoding.syndromes.items()},
+                        operations = {error_type: sorted(qubits) for error_type, qubits in encoding.operations.items()},
+                        erasure = sorted(encoding.erasure_set))
+                counts[outcomes.index("uncorrected_error")] += 1
+                continue
+        counts[2*detected + run_stage(profile, "has_logical_error", encoding.has_logical_error)] += 1
+    if profile is not None:
+        profile.count("shots", n_samples)
+    return counts
+
+def simulate_batch(size, phys_error_rate, n_samples, batch_size = None, rng = np.random, decoder = "tree", code = "surface", engine = "batch", profile = None):
+    """
+    counts of each outcome over n_samples shots of the surface or toric code, sampled batch_size shots at a time
+    engine = "packed" keeps the surface code state of 64 shots per uint64 word with packed_surface_code
+    """
+    if batch_size is None:
+        batch_size = default_batch_size(size)
+    counts = np.zeros(len(outcomes), dtype = np.int64)
+    for start in range(0, n_samples, batch_size):
+        encoding = new_batch_code(size, min(batch_size, n_samples - start), code, engine)
+        run_stage(profile, "add_erasure_errors", encoding.add_erasure_errors, phys_error_rate, rng)
+        counts += classify_batch(encoding, decoder, profile = profile)
+    return counts
+
+def simulate_stream(size, n_samples, channels, batch_size = None, seed = None, decoder = "tree", code = "surface", engine = "batch"):
+    """
+    counts of each outcome over n_samples shots with the errors of error_models channels, from error_models.shot_batches
+    """
+    counts = np.zeros(len(outcomes), dtype = np.int64)
+    contained = all(channel.contained for channel in channels)
+    for encoding in shot_batches(size, n_samples, channels, batch_size, seed, code, engine):
+        counts += classify_batch(encoding, decoder, contained)
+    return counts
+
+def classify_batch(encoding, decoder = "tree", contained = True, profile = None):
+    """
+    counts of each outcome of a batch code with errors added, see classify_shots
+    """
+    return np.bincount(classify_shots(encoding, decoder, contained, profile), minlength = len(outcomes))
+
+def classify_shots(encoding, decoder = "tree", contained = True, profile = None):
+    """
+    index in outcomes of every shot of a batch code with errors added.
+    contained says every error lies in the erasure, otherwise every detected shot is decoded
+    and shots left with a syndrome count as uncorrected errors
+    """
+    run_stage(profile, "measure_syndrome", encoding.measure_syndrome)
+    detected = encoding.error_detected()
+    # residual errors stay inside the erasure set (and the errors), so only shots where those connect two boundaries
+    # (wind around the torus) can end up with a logical error and need the exact decoder
+    spans = {error_type: run_stage(profile, "prefilter", encoding.erasure_spans_boundaries, error_type, not contained) for error_type in ["X", "Z"]}
+    spanning = np.flatnonzero(spans["X"] | spans["Z"])
+    decode = spanning[detected[spanning]] if contained else np.flatnonzero(detected)
+    # Z stabilizer trees correct X errors and X stabilizer trees correct Z errors
+    stab_types = None if not contained else [[stab_type for stab_type, error_type in [("Z", "X"), ("X", "Z")] if spans[error_type][shot]] for shot in decode]
+    run_stage(profile, "erasure_decoder", encoding.erasure_decoder, decode, stab_types, decoder)
+    # errors of a type that cannot span are left undecoded, so each type is only checked where it spans
+    logical = np.zeros(encoding.n_shots, dtype = bool)
+    if not contained or profile is not None:
+        run_stage(profile, "measure_syndrome", encoding.measure_syndrome)
+        residual = encoding.error_detected()
+        if not contained:
+            logical |= residual
+        if profile is not None:
+            # a contained shot keeps the syndromes of the types it was not decoded for
+            failed = residual
+            if contained:
+                failed = spans["X"] & encoding.error_detected("Z") | spans["Z"] & encoding.error_detected("X")
+            for shot in np.flatnonzero(failed & detected):
+                profile.record_failure(engine = type(encoding).__name__, decoder = decoder, shot = int(shot))
+    for error_type in ["X", "Z"]:
+        shots = np.flatnonzero(spans[error_type])
+        logical[shots] |= run_stage(profile, "has_logical_error", encoding.has_logical_error, shots, error_type)
+    if profile is not None:
+        profile.count("shots", encoding.n_shots)
+        profile.count("detected", detected.sum())
+        profile.count("spanning", len(spanning))
+        profile.count("decoded", len(decode))
+    return 2*detected + logical
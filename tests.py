@@ -1,7 +1,7 @@
 from random import Random
 import topological_code
 import argparse
-from UnitTester import LogicalErrorTester, DecoderTester, RandomErrorTester
+from UnitTester import LogicalErrorTester, DecoderTester, RandomErrorTester, BatchEngineTester, ParallelSeedTester, SyndromeClearingTester, GeometryTester, AdaptiveSamplingTester, ResumeTester, ErrorModelTester, StratifiedSamplingTester, WeightTableTester, BenchmarkTester, ProfilingTester, SpacetimeTester, RectangularTester, AnalysisTester, QueueTester, DecodeBatchTester, ClusterTester, CoupledTester, DifferentialTester
 
 def get_topological_code(type, size):
     if type == "toric":
@@ -18,8 +18,9 @@ def test_logical_errors(test_cases):
     return failed_list
 
 def print_erasure_tree(code):
+    root_list = code.erasure_trees()
     for stab_type in ["X", "Z"]:
-        for i, roots in enumerate(code.root_list[stab_type]):
+        for i, roots in enumerate(root_list[stab_type]):
             print(f"Stab Type {stab_type} {i}-th root:")
             print_root(roots)
 
@@ -28,10 +29,18 @@ def print_root(node):
     for child in node.children:
         print_root(child)
 
-def test_decoder(test_cases, verbose = False):
+def test_decoder(test_cases, verbose = False, method = "tree"):
     failed_list = []
     for test in test_cases:
-        tester = DecoderTester(*test, verbose) 
+        tester = DecoderTester(*test, verbose, method) 
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_syndrome_clearing(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = SyndromeClearingTester(*test)
         if not tester:
             failed_list.append(tester)
     return failed_list
@@ -44,6 +53,142 @@ def test_random_errors(test_cases):
         test_list.append(tester)
     return test_list
 
+def test_batch_engine(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = BatchEngineTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_parallel_seeds(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = ParallelSeedTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_resume(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = ResumeTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_adaptive_sampling(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = AdaptiveSamplingTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_error_models(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = ErrorModelTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_stratified_sampling(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = StratifiedSamplingTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_weight_tables(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = WeightTableTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_benchmarks(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = BenchmarkTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_profiling(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = ProfilingTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_spacetime(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = SpacetimeTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_rectangular(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = RectangularTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_analysis(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = AnalysisTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_queue(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = QueueTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_decode_batch(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = DecodeBatchTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_clusters(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = ClusterTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_coupled(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = CoupledTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
+def test_differential(test_cases):
+    failed_list = []
+    for test in test_cases:
+        tester = DifferentialTester(*test)
+        if not tester:
+            failed_list.append(tester)
+    return failed_list
+
 def indepth_test():
     print("Specific Test")
     code = topological_code.surface_code(5)
@@ -76,6 +221,32 @@ def main(args):
         (5, args.type, "Diagonal Z error on 5x5 surface", True, [],  [(0,0), (1,1), (2,2), (3,3), (4,4)]),
         (5, args.type, "Sparse errors on 5x5 surface", False, [(1,1),(3,3)],[(1,1),(3,3)])
     ]
+    if args.type == "toric":
+        test_cases = [
+            (6, "toric", "X logical error along x on 6x6 torus", True, [(0,0), (0,2), (0,4)], []),
+            (6, "toric", "X logical error along y on 6x6 torus", True, [(1,1), (3,1), (5,1)], []),
+            (6, "toric", "Z logical error along x on 6x6 torus", True, [], [(1,1), (1,3), (1,5)]),
+            (6, "toric", "Z logical error along y on 6x6 torus", True, [], [(0,0), (2,0), (4,0)]),
+            (6, "toric", "X stabilizer on 6x6 torus", False, [(0,2), (2,2), (1,1), (1,3)], []),
+            (6, "toric", "Z stabilizer on 6x6 torus", False, [], [(1,1), (5,1), (0,2), (0,0)]),
+            (6, "toric", "Two parallel X logical errors on 6x6 torus", False, [(0,0), (0,2), (0,4), (2,0), (2,2), (2,4)], []),
+            (6, "toric", "X and Z logical errors on 6x6 torus", True, [(1,1), (3,1), (5,1)], [(0,0), (2,0), (4,0)]),
+        ]
+    geometry_cases = [
+        (5, "surface", "Geometry of 5x5 surface", True),
+        (8, "surface", "Geometry of 8x8 surface", True),
+        (15, "surface", "Geometry of 15x15 surface", True),
+        ((5, 9), "surface", "Geometry of 5x9 surface", True),
+        ((8, 3), "surface", "Geometry of 8x3 surface", True),
+    ]
+    geometry_failed_list = [tester for tester in (GeometryTester(*test) for test in geometry_cases) if not tester]
+    if geometry_failed_list:
+        print("Failed Geometry Checks")
+        for test in geometry_failed_list:
+            print(test)
+    else:
+        print("Passed Geometry Checks")
+
     logical_error_failed = test_logical_errors(test_cases)
     if logical_error_failed:
         print("Failed Logical Error Checks")
@@ -111,6 +282,25 @@ def main(args):
     else: 
         print("Passed Decoder Checks")
 
+    union_find_failed_list = test_decoder(decoder_cases, False, "union_find")
+    clearing_cases = [
+        (13, "surface", "Union-find, Size = 13, p_error = 0.5", True, 0.5, 50, "union_find"),
+        (101, "surface", "Union-find, Size = 101, p_error = 0.5", True, 0.5, 3, "union_find"),
+        (13, "surface", "Tree decoder, codes growing in turn, Size = 13, p_error = 0.5", True, 0.5, 50, "tree"),
+    ]
+    if args.type == "toric":
+        clearing_cases = [
+            (14, "toric", "Union-find, Size = 14, p_error = 0.5", True, 0.5, 50, "union_find"),
+            (100, "toric", "Union-find, Size = 100, p_error = 0.5", True, 0.5, 3, "union_find"),
+        ]
+    union_find_failed_list += test_syndrome_clearing(clearing_cases)
+    if union_find_failed_list:
+        print("Failed Union-Find Decoder Checks")
+        for test in union_find_failed_list:
+            print(test)
+    else: 
+        print("Passed Union-Find Decoder Checks")
+
     random_error_cases = [
         (5, "surface", "Size = 5, p_error = 0.25", True, 0.25, 10000),
         (5, "surface", "Size = 5, p_error = 0.5", True, 0.5, 10000),
@@ -121,6 +311,224 @@ def main(args):
     ]
     test_random_errors(random_error_cases)
 
+    batch_cases = [
+        (5, "surface", "Batch engine, Size = 5, p_error = 0.3", True, 0.3, 500),
+        (9, "surface", "Batch engine, Size = 9, p_error = 0.45", True, 0.45, 500),
+        (13, "surface", "Batch engine, Size = 13, p_error = 0.5", True, 0.5, 300),
+        (5, "surface", "Packed engine, Size = 5, p_error = 0.3", True, 0.3, 500, 0, "packed", 100),
+        (9, "surface", "Packed engine, Size = 9, p_error = 0.45", True, 0.45, 500, 0, "packed", 100),
+        (13, "surface", "Packed engine, Size = 13, p_error = 0.5", True, 0.5, 300, 0, "packed", 200),
+    ]
+    if args.type == "toric":
+        batch_cases = [
+            (6, "toric", "Batch engine, Size = 6, p_error = 0.4", True, 0.4, 500),
+            (10, "toric", "Batch engine, Size = 10, p_error = 0.5", True, 0.5, 500),
+            (14, "toric", "Batch engine, Size = 14, p_error = 0.55", True, 0.55, 300),
+        ]
+    batch_failed_list = test_batch_engine(batch_cases)
+    if batch_failed_list:
+        print("Failed Batch Engine Checks")
+        for test in batch_failed_list:
+            print(test)
+    else:
+        print("Passed Batch Engine Checks")
+
+    # the toric code needs even sizes
+    small_size, batch_size = (5, 9) if args.type == "surface" else (6, 10)
+    parallel_cases = [
+        (small_size, args.type, f"Parallel shot engine, Size = {small_size}, p_error = 0.3", True, 0.3, 200, "shot"),
+        (batch_size, args.type, f"Parallel batch engine, Size = {batch_size}, p_error = 0.4", True, 0.4, 2000, "batch"),
+    ]
+    parallel_failed_list = test_parallel_seeds(parallel_cases)
+    if parallel_failed_list:
+        print("Failed Parallel Seeding Checks")
+        for test in parallel_failed_list:
+            print(test)
+    else:
+        print("Passed Parallel Seeding Checks")
+
+    resume_cases = [
+        (small_size, args.type, f"Resumed shot engine, Size = {small_size}, p_error = 0.3", True, 0.3, 200, "shot"),
+        (batch_size, args.type, f"Resumed batch engine, Size = {batch_size}, p_error = 0.4", True, 0.4, 2000, "batch"),
+    ]
+    resume_failed_list = test_resume(resume_cases)
+    if resume_failed_list:
+        print("Failed Resume Checks")
+        for test in resume_failed_list:
+            print(test)
+    else:
+        print("Passed Resume Checks")
+
+    adaptive_cases = [
+        (small_size, args.type, f"Adaptive shot engine, Size = {small_size}, p_error = 0.4", True, 0.4, 2000, 0.5, "shot"),
+        (batch_size, args.type, f"Adaptive batch engine, Size = {batch_size}, p_error = 0.4", True, 0.4, 20000, 0.2, "batch"),
+    ]
+    adaptive_failed_list = test_adaptive_sampling(adaptive_cases)
+    if adaptive_failed_list:
+        print("Failed Adaptive Sampling Checks")
+        for test in adaptive_failed_list:
+            print(test)
+    else:
+        print("Passed Adaptive Sampling Checks")
+
+    error_model_cases = [
+        (batch_size, args.type, f"{noise} noise, Size = {batch_size}, p_error = 0.3", True, 0.3, 2000, noise, noise_parameter, engine)
+        for noise, noise_parameter in [("erasure", None), ("erasure_pauli", 0.01), ("biased_erasure", 10), ("correlated_erasure", 0.3)]
+        for engine in (["batch", "packed"] if args.type == "surface" else ["batch"])
+    ]
+    error_model_failed_list = test_error_models(error_model_cases)
+    if error_model_failed_list:
+        print("Failed Error Model Checks")
+        for test in error_model_failed_list:
+            print(test)
+    else:
+        print("Passed Error Model Checks")
+
+    stratified_cases = [
+        (batch_size, args.type, f"Stratified batch engine, Size = {batch_size}, p_error = 0.35", True, 0.35, 20000, "batch"),
+    ]
+    if args.type == "surface":
+        stratified_cases.append((batch_size, args.type, f"Stratified packed engine, Size = {batch_size}, p_error = 0.3", True, 0.3, 20000, "packed"))
+    stratified_failed_list = test_stratified_sampling(stratified_cases)
+    if stratified_failed_list:
+        print("Failed Stratified Sampling Checks")
+        for test in stratified_failed_list:
+            print(test)
+    else:
+        print("Passed Stratified Sampling Checks")
+
+    table_size = 3 if args.type == "surface" else 4
+    weight_table_cases = [
+        (table_size, args.type, f"Weight table, Size = {table_size}, p_error = 0.3", True, 0.3, 20000, "batch"),
+    ]
+    if args.type == "surface":
+        weight_table_cases.append((table_size, args.type, f"Weight table packed engine, Size = {table_size}, p_error = 0.4", True, 0.4, 20000, "packed"))
+    weight_table_failed_list = test_weight_tables(weight_table_cases)
+    if weight_table_failed_list:
+        print("Failed Weight Table Checks")
+        for test in weight_table_failed_list:
+            print(test)
+    else:
+        print("Passed Weight Table Checks")
+
+    benchmark_cases = [
+        (small_size, args.type, f"Benchmark stages, Size = {small_size}, decoder = {decoder}", True, 0.3, 20, decoder)
+        for decoder in ["tree", "union_find"]
+    ]
+    benchmark_failed_list = test_benchmarks(benchmark_cases)
+    if benchmark_failed_list:
+        print("Failed Benchmark Checks")
+        for test in benchmark_failed_list:
+            print(test)
+    else:
+        print("Passed Benchmark Checks")
+
+    profiling_cases = [
+        (small_size, args.type, f"Profiled shot engine, Size = {small_size}, p_error = 0.3", True, 0.3, 200, "shot"),
+        (batch_size, args.type, f"Profiled batch engine, Size = {batch_size}, p_error = 0.4", True, 0.4, 2000, "batch"),
+    ]
+    profiling_failed_list = test_profiling(profiling_cases)
+    if profiling_failed_list:
+        print("Failed Profiling Checks")
+        for test in profiling_failed_list:
+            print(test)
+    else:
+        print("Passed Profiling Checks")
+
+    spacetime_cases = [
+        (small_size, args.type, f"Spacetime peeling, Size = {small_size}, rounds = {rounds}, p_error = 0.2", True, 0.2, 0.1, rounds, 200)
+        for rounds in [1, 4]
+    ]
+    spacetime_failed_list = test_spacetime(spacetime_cases)
+    if spacetime_failed_list:
+        print("Failed Spacetime Checks")
+        for test in spacetime_failed_list:
+            print(test)
+    else:
+        print("Passed Spacetime Checks")
+
+    rectangular_cases = [
+        ((rows, columns), args.type, f"Rectangular lattice, Size = {rows}x{columns}, p_error = 0.3", True, 0.3, 300)
+        for rows, columns in ([(5, 9), (9, 5)] if args.type == "surface" else [(6, 10)])
+    ]
+    rectangular_failed_list = test_rectangular(rectangular_cases)
+    if rectangular_failed_list:
+        print("Failed Rectangular Checks")
+        for test in rectangular_failed_list:
+            print(test)
+    else:
+        print("Passed Rectangular Checks")
+
+    analysis_cases = [
+        (small_size, args.type, f"Threshold analysis, Sizes = {small_size} to {small_size + 12}", True, 0.5, 1.5, 20000, 40)
+    ]
+    analysis_failed_list = test_analysis(analysis_cases)
+    if analysis_failed_list:
+        print("Failed Analysis Checks")
+        for test in analysis_failed_list:
+            print(test)
+    else:
+        print("Passed Analysis Checks")
+
+    queue_cases = [
+        (small_size, args.type, f"Job queue with local workers, Size = {small_size}, p_error = 0.3", True, 0.3, 200, 2)
+    ]
+    queue_failed_list = test_queue(queue_cases)
+    if queue_failed_list:
+        print("Failed Queue Checks")
+        for test in queue_failed_list:
+            print(test)
+    else:
+        print("Passed Queue Checks")
+
+    decode_batch_cases = [
+        (batch_size, args.type, f"Batch decoding API, {decoder} decoder, Size = {batch_size}, p_error = 0.4", True, 0.4, 300, decoder)
+        for decoder in (["tree", "union_find"] if args.type == "surface" else ["union_find"])
+    ]
+    decode_batch_failed_list = test_decode_batch(decode_batch_cases)
+    if decode_batch_failed_list:
+        print("Failed Decode Batch Checks")
+        for test in decode_batch_failed_list:
+            print(test)
+    else:
+        print("Passed Decode Batch Checks")
+
+    coupled_cases = [
+        (batch_size, args.type, f"Coupled sweep, Size = {batch_size}, p_error = 0.1 to 0.5", True, 0.1, 0.5, 5, 400)
+    ]
+    coupled_failed_list = test_coupled(coupled_cases)
+    if coupled_failed_list:
+        print("Failed Coupled Checks")
+        for test in coupled_failed_list:
+            print(test)
+    else:
+        print("Passed Coupled Checks")
+
+    differential_cases = [
+        (size, args.type, f"Differential test of the decoder backends, Size = {size}", True, 300)
+        for size in [small_size, batch_size]
+    ]
+    differential_failed_list = test_differential(differential_cases)
+    if differential_failed_list:
+        print("Failed Differential Checks")
+        for test in differential_failed_list:
+            print(test)
+    else:
+        print("Passed Differential Checks")
+
+    if args.type == "surface":
+        cluster_cases = [
+            (size, args.type, f"Erasure clusters, Size = {size}, p_error = {p_error}", True, p_error, 300)
+            for size, p_error in [(5, 0.4), (9, 0.3)]
+        ]
+        cluster_failed_list = test_clusters(cluster_cases)
+        if cluster_failed_list:
+            print("Failed Cluster Checks")
+            for test in cluster_failed_list:
+                print(test)
+        else:
+            print("Passed Cluster Checks")
+
     return
 
 if __name__ == "__main__":
@@ -1,7 +1,10 @@
 import numpy as np
+from union_find import union_find, peel_forest
+from peeling import get_erasure_forests, get_spacetime_forests
+from lattice import get_geometry, get_toric_geometry
 
 class topological_code:
-    def __init__(self, size):
+    def __init__(self, size, geometry = None):
         self.size = size
         self.erasure_set = set()
         self.syndromes = {
@@ -13,57 +16,40 @@ class topological_code:
             "Z": set()
         }
 
-        self.adjacency = {
-            "X": [(0,2),(-1,1), (1, 1),(0,-2), (-1,-1), (-1,1)],
-            "Z": [(2,0),(1,-1), (1, 1),(-2,0), (-1,-1), (-1,1)]
-        }
-        self.boundary = {
-            "X":self.get_X_boundary(),
-            "Z": self.get_Z_boundary()
-            }
-
-        self.open_qubits = {
-            "X": self.get_X_open(),
-            "Z": self.get_Z_open()
-        }
+        # lattice tables are built once per size and shared by every code of that size
+        self.geometry = get_geometry(size) if geometry is None else geometry
 
     def get_data_qubits(self):
-        if self.size%2== 1:
-            return [(y, 2*k + y%2) for y in range(self.size) for k in range(self.size//2 + (y+1)%2)]
-        else:
-            return [(y, 2*k + y%2) for y in range(self.size) for k in range(self.size//2)]
+        return self.geometry.data_qubits
 
     def get_X_stabilizers(self):
-        return [(1+2*y, 2*x) for y in range(self.size//2) for x in range((self.size +1)//2)]
+        return self.geometry.stabilizers["X"]
     
     def get_Z_stabilizers(self):
-        return [(2*y, 1+ 2*x) for y in range((self.size+1)//2) for x in range(self.size//2)]
+        return self.geometry.stabilizers["Z"]
 
     def get_X_boundary(self):
-        return [(2*y,0) for y in range((self.size+1)//2)], \
-            [(2*y + (self.size + 1)%2, self.size-1) for y in range((self.size+1)//2)]  
+        return self.geometry.boundary["X"]
     
     def get_Z_boundary(self):
-        return [(0,2*x) for x in range((self.size+1)//2)], \
-            [(self.size-1, 2*x + (self.size + 1)%2) for x in range((self.size+1)//2)]  
+        return self.geometry.boundary["Z"]
 
     def get_Z_open(self):
-        return [(2*y,-1) for y in range((self.size+1)//2)], \
-            [(2*y + (self.size + 1)%2, self.size) for y in range((self.size+1)//2)]   
+        return self.geometry.open_qubits["Z"]
 
     def get_X_open(self):
-        return [(-1,2*x) for x in range((self.size+1)//2)], \
-            [(self.size, 2*x + (self.size + 1)%2) for x in range((self.size+1)//2)]  
+        return self.geometry.open_qubits["X"]
 
     def set_random_seed(seed = 42):
         np.random.seed(seed)
 
-    def add_erasure_errors(self, p_error_rate):
+    def add_erasure_errors(self, p_error_rate, rng = np.random):
         """
         For each qubit, with equal probability apply I, X, Y, Z
         We only apply erasure errors on data qubits?
+        rng is the global numpy random state by default, or a np.random.Generator
         """
-        random = np.random.rand(self.size, self.size)
+        random = rng.random(self.geometry.shape)
         for qubit in self.get_data_qubits():
             random_qubit = random[qubit[0]][qubit[1]]
             if random_qubit < p_error_rate:
@@ -84,34 +70,48 @@ class topological_code:
     def has_logical_error(self):
         """
         DFS to check if boundaries are connected 
+        Searches from the errors on the first boundary with an explicit stack, over a flat bitmap of the errors
         """
-        # error = {"X": False, "Z": False}
+        geometry = self.geometry
         for error_type in ["X", "Z"]:
-            visited = set()
-            # we check the first boundary if there is an error of the appropriate type
-            # print(self.boundary[error_type])
-            for qubit in self.boundary[error_type][0]:
-                if qubit in self.operations[error_type]:
-                    if self.logical_error_DFS(visited, error_type, qubit):
-                        return True
-        return False
-    
-    def logical_error_DFS(self, visited, error_type, qubit):
-        if qubit not in visited:
-            # only visit new nodes
-            visited.add(qubit)
-            # print(f"Visiting {qubit}")
-            if qubit in self.boundary[error_type][1]:
-                if qubit in self.operations[error_type]:
-                    # print(f"Connected to second boundary:{qubit}")
+            errors = bytearray(geometry.n_cells)
+            for qubit in self.operations[error_type]:
+                errors[geometry.get_index(qubit)] = 1
+            second_boundary = geometry.boundary_flags[error_type][1]
+            offsets = geometry.adjacency_offsets[error_type]
+            # clearing an error marks it as visited
+            stack = [qubit for qubit in geometry.boundary_index[error_type][0] if errors[qubit]]
+            for qubit in stack:
+                errors[qubit] = 0
+            while stack:
+                qubit = stack.pop()
+                if second_boundary[qubit]:
                     return True
-            for y,x in self.adjacency[error_type]:
-                # for each adjacent qubit
-                next_qubit = (qubit[0] + y, qubit[1] + x)
-                if next_qubit in self.operations[error_type]:
-                    if self.logical_error_DFS(visited, error_type, next_qubit):
-                        return True
-        return False    
+                for offset in offsets:
+                    if errors[qubit + offset]:
+                        errors[qubit + offset] = 0
+                        stack.append(qubit + offset)
+        return False
+
+    def union_find_decoder(self):
+        """
+        Stabilizers are the flat indices of the geometry. Like construct_erasure_tree, each tree touching
+        the boundary is rooted at its first open stabilizer in open_qubits order, but the union-find forest spans
+        each cluster with other edges than the tree decoder's search, so the two corrections only agree up to
+        a syndrome-free operator inside the erasure. On an erasure spanning the boundaries that operator can be
+        a logical one and the two decoders then give different logical outcomes, with the same failure rate.
+        """
+        geometry = self.geometry
+        qubits = sorted(geometry.qubit_number[geometry.get_index(qubit)] for qubit in self.erasure_set)
+        for stab_type in ["X", "Z"]:
+            stabilizers = geometry.qubit_stabilizers[stab_type][qubits].tolist()
+            edges = [(stab_a, stab_b, geometry.data_qubits[qubit]) for (stab_a, stab_b), qubit in zip(stabilizers, qubits)]
+            syndromes = [0]*geometry.n_cells
+            for stab in self.syndromes[stab_type]:
+                syndromes[geometry.get_index(stab)] = 1
+            corrections = peel_forest(geometry.n_cells, edges, syndromes, geometry.open_index[stab_type])
+            self.operations["X" if stab_type == "Z" else "Z"].symmetric_difference_update(corrections)
+        return
 
     def reset_syndrome(self):
         self.syndromes = {
@@ -146,7 +146,10 @@ class TreeNode():
 class surface_code(topological_code):
     def __init__(self, size):
         super().__init__(size)
-        self.root_list = None
+        self.forests = None
+        self.adjacency = self.geometry.adjacency
+        self.boundary = self.geometry.boundary
+        self.open_qubits = self.geometry.open_qubits
 
     def measure_syndrome(self):
         self.reset_syndrome()
@@ -162,106 +165,232 @@ class surface_code(topological_code):
         return
 
 
-    def erasure_decoder(self):
+    def erasure_decoder(self, method = "tree"):
         """
         Construct tree, peel the tree
+        method = "tree" peels the erasure forests grown by construct_erasure_tree, method = "union_find" grows the forest
+        with union-find and peels its leaves iteratively
         """
+        if method == "union_find":
+            self.union_find_decoder()
+            return
         self.construct_erasure_tree()
-        # print(self.root_list)
-        for stab_type in ["X", "Z"]:
-            while self.root_list[stab_type]:
-                chosen_qubits = set()
-                curr_root = self.root_list[stab_type].pop()
-                self.peel_tree_dfs(chosen_qubits, curr_root)
-                # print(f"Chosen qubits {chosen_qubits} for {curr_root} for Stab Type {stab_type}")
-                self.operations["X" if stab_type == "Z" else "Z"].symmetric_difference_update(chosen_qubits)
+        self.peel_erasure_trees()
         return
 
-    def peel_tree_dfs(self, qubits_set, node):
-        node.subtree_syndrome_sum += node.syndrome
-        for child in node.children:
-            self.peel_tree_dfs(qubits_set, child)
-            node.subtree_syndrome_sum += child.subtree_syndrome_sum
-        if node.subtree_syndrome_sum%2:
-            # print(f"Trying to add the parent of: {node.info()}")
-            if node.parent_qubit:
-                qubits_set.add(node.parent_qubit)   
-        # print(f"{node}: {node.subtree_syndrome_sum}")
+    def peel_erasure_trees(self):
+        """
+        Peel every tree of the forests and apply the chosen qubits as the correction
+        """
+        width = self.geometry.width
+        for stab_type in ["X", "Z"]:
+            chosen_qubits = {(qubit//width - 2, qubit % width - 2) for qubit in self.forests[stab_type].peel()}
+            self.operations["X" if stab_type == "Z" else "Z"].symmetric_difference_update(chosen_qubits)
+        return
 
     def construct_erasure_tree(self):
-        self.root_list = {"X": [],"Z": []}
-        # loop this for X and Z
+        """
+        Grow the X and Z forests of peeling.erasure_forest, the flat lists shared by the codes of this size, and peel them
+        in place. A code still holding them when another code grows gets a grown_forest copy, so codes can grow in any order.
+        Trees touching the boundary are rooted at their first open stabilizer, the others at the first stabilizer
+        of the first erased qubit left in the iteration order of the erasure set.
+        """
+        geometry = self.geometry
+        forests = get_erasure_forests(geometry)
+        erasure_order = [geometry.get_index(qubit) for qubit in self.erasure_set.copy()]
+        self.forests = {}
         for stab_type in ["X", "Z"]:
-            open_boundaries = self.open_qubits[stab_type]
-            combined_boundaries = open_boundaries[0] + open_boundaries[1]
-            # copy erasure set
-            erasure_copy = self.erasure_set.copy()
-            visited = set()
-            # we search for all trees that are touching the boundary
-            for open_qubit in combined_boundaries:
-                if not open_qubit in visited:
-                    # print(f"{stab_type}: {open_qubit}")
-                    boundary_tree = self.erasure_tree_dfs(visited, None, erasure_copy,open_qubit, stab_type)
-                    if len(boundary_tree.children) > 0:
-                        # check if there is an erased edge leading from boundary tree
-                        self.root_list[stab_type].append(boundary_tree)
-            # append root of erasure tree while deleting visited erasures
-            # we search for all the erasures not touching boundary
-            while erasure_copy:
-                # print(erasure_copy)
-                curr_qubit = next(iter(erasure_copy))
-                # print(curr_qubit)
-                curr_stab = self.get_adjacent_stabilizers(curr_qubit, stab_type)[0]
-                self.root_list[stab_type].append(self.erasure_tree_dfs(visited, curr_qubit, erasure_copy, curr_stab, stab_type))
+            forests[stab_type].grow(erasure_order, [geometry.get_index(stab) for stab in self.syndromes[stab_type]], self)
+            self.forests[stab_type] = forests[stab_type]
         return
 
-    def erasure_tree_dfs(self, visited, parent_qubit, erasure_copy, curr, stab_type):
-        visited.add(curr)
-        curr_node = TreeNode()
-        curr_node.coordinate = curr
-        curr_node.parent_qubit = parent_qubit
-        curr_node.syndrome = curr_node.coordinate in self.syndromes[stab_type]
-        for qubit in self.get_adjacent_data_qubits(curr_node.coordinate):
-            if qubit in erasure_copy:
-                erasure_copy.remove(qubit)
-                # print(qubit)
-                for stab in self.get_adjacent_stabilizers(qubit, stab_type):
-                    if stab not in visited:
-                        curr_node.children.append(self.erasure_tree_dfs(visited, qubit, erasure_copy, stab, stab_type))
-        return curr_node
+    def erasure_trees(self):
+        """
+        TreeNode trees of the grown forests, the root_list of the recursive construction, for printing
+        """
+        width = self.geometry.width
+        root_list = {"X": [], "Z": []}
+        for stab_type, forest in self.forests.items():
+            tree_nodes = []
+            for k in range(forest.n_nodes):
+                node = TreeNode()
+                node.coordinate = (forest.nodes[k]//width - 2, forest.nodes[k] % width - 2)
+                node.parent_qubit = None if forest.qubits[k] < 0 else (forest.qubits[k]//width - 2, forest.qubits[k] % width - 2)
+                node.syndrome = bool(forest.syndromes[k])
+                tree_nodes.append(node)
+                if forest.parents[k] < 0:
+                    root_list[stab_type].append(node)
+                else:
+                    tree_nodes[forest.parents[k]].children.append(node)
+            root_list[stab_type] = [root for root in root_list[stab_type] if root.children]
+        return root_list
+
+    def erasure_clusters(self, stop = False):
+        """
+        {error_type: (sizes, spans)}, the sizes of the clusters of erased qubits joined along the adjacency of error_type in
+        has_logical_error (either direction), labelled with union-find, and whether one of them touches both boundaries.
+        Peeling leaves errors inside the erasure, so a shot without a spanning cluster of a type has no logical error of that type.
+        With stop the Z clusters are left out when an X cluster spans.
+        """
+        geometry = self.geometry
+        width = geometry.width
+        cells = [(y + 2)*width + x + 2 for y, x in self.erasure_set]
+        number = {cell: k for k, cell in enumerate(cells)}
+        clusters = {}
+        for error_type in ["X", "Z"]:
+            sets = union_find(len(cells))
+            for k, cell in enumerate(cells):
+                for offset in geometry.adjacency_offsets[error_type]:
+                    if cell + offset in number:
+                        sets.union(k, number[cell + offset])
+            first, second = geometry.boundary_flags[error_type]
+            sizes, touches = {}, {}
+            for k, cell in enumerate(cells):
+                root = sets.find(k)
+                sizes[root] = sizes.get(root, 0) + 1
+                touches[root] = touches.get(root, 0) | first[cell] | 2*second[cell]
+            clusters[error_type] = (list(sizes.values()), 3 in touches.values())
+            if stop and clusters[error_type][1]:
+                break
+        return clusters
 
     def get_adjacent_stabilizers(self, qubit, stab_type):
         # we make this return the open stabs
-        if stab_type == "X":
-            if qubit[0] %2 == 0:
-                return [(qubit[0]-1, qubit[1]),(qubit[0]+1, qubit[1])]
-                # ret = []
-                # if qubit[0]>0:
-                #     ret.append((qubit[0] - 1, qubit[1]))
-                # if qubit[0]< self.size- 1:
-                #     ret.append((qubit[0] + 1, qubit[1]))
-                # return ret
-            else:
-                return [(qubit[0], qubit[1]-1), (qubit[0], qubit[1] + 1)]
-        else:
-            if qubit[1]%2 == 0:
-                return [(qubit[0], qubit[1]-1), (qubit[0], qubit[1]+1)]
-                # ret = []
-                # if qubit[1]>0:
-                #     ret.append((qubit[0], qubit[1] - 1))
-                # if qubit[1]<self.size-1:
-                #     ret.append((qubit[0], qubit[1] + 1))
-                # return ret
-            else:
-                return [(qubit[0]-1, qubit[1]), (qubit[0] + 1, qubit[1])]
-    
+        return self.geometry.adjacent_stabilizers[stab_type][qubit]
 
     def get_adjacent_data_qubits(self, stab):
-        return [(stab[0]+y, stab[1]+x) for y, x in [(1,0), (-1,0), (0,1), (0,-1)]]
+        return self.geometry.adjacent_data_qubits[stab]
+
+class spacetime_code(surface_code):
+    """
+    The surface code over rounds rounds of syndrome measurements, only the last one perfect.
+    Before every round each data qubit is erased with probability p_error_rate and gets a uniformly random Pauli,
+    and in every round but the last each stabilizer measurement is erased with probability p_measurement
+    and gives a random outcome. Errors and corrections are flipped edges of the peeling.spacetime_forest lattice,
+    syndromes are its detection events and the erasure decoder peels the spacetime forests.
+    operations holds the data qubit errors and corrections summed over the rounds, for has_logical_error.
+    rounds = 1 is surface_code with perfect measurements.
+    """
+    def __init__(self, size, rounds):
+        super().__init__(size)
+        self.rounds = rounds
+        self.spacetime_forests = get_spacetime_forests(self.geometry, rounds)
+        # spacetime indices of the erased edges in sampling order and of the flipped edges, per stabilizer type
+        self.erasures = {"X": [], "Z": []}
+        self.flips = {"X": set(), "Z": set()}
+
+    def add_erasure_errors(self, p_error_rate, rng = np.random, p_measurement = None):
+        """
+        p_measurement is p_error_rate by default
+        """
+        if p_measurement is None:
+            p_measurement = p_error_rate
+        geometry = self.geometry
+        cells = geometry.n_cells
+        for t in range(self.rounds):
+            layer = 2*t*cells
+            random = rng.random(len(geometry.data_qubits))
+            for number in np.flatnonzero(random < p_error_rate).tolist():
+                qubit = geometry.data_qubits[number]
+                edge = layer + int(geometry.data_index[number])
+                self.erasure_set.add(qubit)
+                for stab_type in ["X", "Z"]:
+                    self.erasures[stab_type].append(edge)
+                error_random = random[number]/p_error_rate
+                # the X part of the Pauli is seen by the Z stabilizers and the Z part by the X stabilizers
+                if error_random < 1/2:
+                    self.operations["X"].symmetric_difference_update([qubit])
+                    self.flips["Z"].symmetric_difference_update([edge])
+                if 1/4 <= error_random < 3/4:
+                    self.operations["Z"].symmetric_difference_update([qubit])
+                    self.flips["X"].symmetric_difference_update([edge])
+            if t == self.rounds - 1:
+                break
+            for stab_type in ["X", "Z"]:
+                stabilizers = geometry.stabilizer_index[stab_type]
+                random = rng.random(len(stabilizers))
+                for number in np.flatnonzero(random < p_measurement).tolist():
+                    edge = layer + cells + int(stabilizers[number])
+                    self.erasures[stab_type].append(edge)
+                    if random[number] < p_measurement/2:
+                        self.flips[stab_type].add(edge)
+        return
+
+    def measure_syndrome(self):
+        """
+        Detection events of the flipped edges, the stabilizers whose outcome differs from the round before
+        """
+        self.syndromes = {stab_type: self.spacetime_forests[stab_type].events(self.flips[stab_type]) for stab_type in ["X", "Z"]}
+        return
+
+    def erasure_decoder(self, method = "tree"):
+        if method != "tree":
+            raise ValueError("Several rounds of measurements are only decoded by peeling trees")
+        self.construct_erasure_tree()
+        self.peel_erasure_trees()
+        return
+
+    def construct_erasure_tree(self):
+        self.forests = {}
+        for stab_type in ["X", "Z"]:
+            self.spacetime_forests[stab_type].grow(self.erasures[stab_type], self.syndromes[stab_type], self)
+            self.forests[stab_type] = self.spacetime_forests[stab_type]
+        return
+
+    def peel_erasure_trees(self):
+        """
+        Flip the peeled edges, applying the data qubits among them as the correction
+        """
+        width = self.geometry.width
+        cells = self.geometry.n_cells
+        for stab_type in ["X", "Z"]:
+            edges = self.forests[stab_type].peel()
+            self.flips[stab_type].symmetric_difference_update(edges)
+            data_edges = [edge % cells for edge in edges if (edge//cells) % 2 == 0]
+            # a data qubit can be corrected in several rounds, which cancel in pairs
+            chosen_qubits = set()
+            for qubit in data_edges:
+                chosen_qubits.symmetric_difference_update([(qubit//width - 2, qubit % width - 2)])
+            self.operations["X" if stab_type == "Z" else "Z"].symmetric_difference_update(chosen_qubits)
+        return
 
 class toric_code(topological_code):
-    def __init__(self):
-        super().__init__()
+    """
+    The surface code lattice on a size x size torus, size even, with coordinates taken mod size.
+    Without boundaries every stabilizer has four data qubits and logical errors are closed chains winding around the torus
+    """
+    def __init__(self, size):
+        super().__init__(size, get_toric_geometry(size))
 
-    def erasure_decoder(self):
+    def measure_syndrome(self):
+        self.reset_syndrome()
+        for stab_type in ["Z", "X"]:
+            operation = "X" if stab_type == "Z" else "Z"
+            for stab in self.geometry.stabilizers[stab_type]:
+                adj_count = 0
+                for qubit in self.geometry.adjacent_data_qubits[stab]:
+                    if qubit in self.operations[operation]:
+                        adj_count += 1
+                if adj_count%2:
+                    self.syndromes[stab_type].add(stab)
+        return
+
+    def has_logical_error(self):
+        """
+        Parity of the errors crossing the cut of each homology class, so only meaningful once no syndrome is left
+        """
+        for error_type in ["X", "Z"]:
+            for cut in self.geometry.cut_sets[error_type]:
+                if len(self.operations[error_type] & cut)%2:
+                    return True
+        return False
+
+    def erasure_decoder(self, method = "union_find"):
+        """
+        Peel a union-find spanning forest of the erasure. With no open stabilizers each tree holds an even number of syndromes
+        and is peeled down to a single node, so "tree" and "union_find" both use union_find_decoder
+        """
+        if method not in ["tree", "union_find"]:
+            raise ValueError(f"Unknown decoder {method}")
+        self.union_find_decoder()
         return
\ No newline at end of file
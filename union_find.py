@@ -0,0 +1,79 @@
+class union_find:
+    """
+    Disjoint sets over the nodes 0..n_nodes-1, stored in flat lists.
+    find compresses paths and union merges by rank, both without recursion.
+    """
+    def __init__(self, n_nodes):
+        self.parent = list(range(n_nodes))
+        self.rank = [0]*n_nodes
+
+    def find(self, node):
+        parent = self.parent
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    def union(self, a, b):
+        """
+        Merge the sets of a and b, False if they were already the same set
+        """
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return False
+        if self.rank[a] < self.rank[b]:
+            a, b = b, a
+        self.parent[b] = a
+        if self.rank[a] == self.rank[b]:
+            self.rank[a] += 1
+        return True
+
+def peel_forest(n_nodes, edges, syndromes, boundary = ()):
+    """
+    Peeling decoder of Delfosse and Zemor on an erased subgraph.
+    edges is a list of (node, node, qubit) for the erased qubits and syndromes a list of 0/1 per node (consumed).
+    boundary lists the open boundary nodes by priority, each tree is rooted at its first boundary node,
+    which absorbs any parity and is never peeled.
+    Grows a spanning forest with union-find, then peels leaves one at a time.
+    Returns the qubits of the correction.
+    """
+    sets = union_find(n_nodes)
+    tree = []
+    degree = [0]*n_nodes
+    # xor of the ids of the tree edges at each node, a leaf's only edge is the xor itself
+    incident = [0]*n_nodes
+    for u, v, qubit in edges:
+        if sets.union(u, v):
+            edge = len(tree)
+            tree.append((u, v, qubit))
+            degree[u] += 1
+            degree[v] += 1
+            incident[u] ^= edge
+            incident[v] ^= edge
+    roots = {}
+    for node in boundary:
+        if degree[node]:
+            roots.setdefault(sets.find(node), node)
+    roots = set(roots.values())
+    leaves = [node for u, v, qubit in tree for node in (u, v) if degree[node] == 1 and node not in roots]
+    corrections = []
+    while leaves:
+        leaf = leaves.pop()
+        if degree[leaf] != 1:
+            # the other end of a single edge tree, already peeled
+            continue
+        edge = incident[leaf]
+        u, v, qubit = tree[edge]
+        node = v if u == leaf else u
+        degree[leaf] = 0
+        degree[node] -= 1
+        incident[node] ^= edge
+        if syndromes[leaf]:
+            corrections.append(qubit)
+            syndromes[node] ^= 1
+        if degree[node] == 1 and node not in roots:
+            leaves.append(node)
+    return corrections
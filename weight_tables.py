@@ -0,0 +1,164 @@
+import os
+import numpy as np
+import pandas as pd
+from itertools import combinations
+from math import comb
+from statistics import NormalDist
+from lattice import get_geometry, get_toric_geometry
+from batch_code import new_batch_code, default_batch_size
+from error_models import fixed_weight_erasure_channel
+from simulator import simulate_stream, logical_failures, weight_distribution, smoothed_rates
+
+"""
+Failure fractions of the erasure decoders per number of erasures w, from which the logical error rate of the erasure
+channel at any physical error rate is the polynomial sum_w C(n, w) p^w (1 - p)^(n - w) f_w over the n data qubits.
+A table has one row per weight with the shots (erasure patterns for exact rows), the failures among them
+(expected failures for exact rows) and whether the row is exact. Tables are cached as pickles keyed by (code, size, decoder),
+and a cached table whose sampled weights have fewer shots than requested is topped up.
+"""
+
+def table_path(table_dir, code, size, decoder):
+    if isinstance(size, tuple):
+        size = "x".join(str(length) for length in size)
+    return f"{table_dir}/{code}_{size}_{decoder}.pkl"
+
+def get_table(size, code = "surface", decoder = "tree", n_samples = 10000, table_dir = "df/weight_tables", exhaustive_limit = 2**20,
+        engine = "batch", seed = None, batch_size = None):
+    """
+    Cached failure table of a code, built with build_table the first time. A cached table is used as it is when
+    each of its sampled weights has at least n_samples shots, and topped up to n_samples shots otherwise.
+    """
+    path = table_path(table_dir, code, size, decoder)
+    if os.path.exists(path):
+        table = pd.read_pickle(path)
+        if (table["shots"][~table["exact"]] >= n_samples).all():
+            return table
+        table = top_up_table(table, size, code, decoder, n_samples, engine, seed, batch_size)
+    else:
+        table = build_table(size, code, decoder, n_samples, exhaustive_limit, engine, seed, batch_size)
+    if not os.path.exists(table_dir):
+        os.makedirs(table_dir)
+    table.to_pickle(path)
+    return table
+
+def build_table(size, code = "surface", decoder = "tree", n_samples = 10000, exhaustive_limit = 2**20, engine = "batch", seed = None, batch_size = None):
+    """
+    Failure table of a code. A weight is enumerated exactly when its C(n, w) 2^w erasure patterns and X (or Z) parts
+    are at most exhaustive_limit shots, otherwise it is sampled with n_samples shots.
+    Weights below the distance cannot hold a logical operator and are exact zeros.
+    """
+    geometry = get_toric_geometry(size) if code == "toric" else get_geometry(size)
+    n_qubits = len(geometry.data_qubits)
+    distance = geometry.distance
+    seeds = iter(np.random.SeedSequence(seed).spawn(n_qubits + 1))
+    rows = []
+    for weight in range(n_qubits + 1):
+        weight_seed = next(seeds)
+        if weight < distance:
+            rows.append((weight, comb(n_qubits, weight), 0.0, True))
+        elif comb(n_qubits, weight)*2**weight <= exhaustive_limit:
+            rows.append((weight, comb(n_qubits, weight), exact_failures(size, code, decoder, weight, engine, batch_size), True))
+        else:
+            counts = simulate_stream(size, n_samples, [fixed_weight_erasure_channel(weight)], batch_size, weight_seed, decoder, code, engine)
+            rows.append((weight, n_samples, float(logical_failures(counts)), False))
+    return pd.DataFrame(rows, columns = ["weight", "shots", "failures", "exact"])
+
+def top_up_table(table, size, code = "surface", decoder = "tree", n_samples = 10000, engine = "batch", seed = None, batch_size = None):
+    """
+    The table with every sampled weight sampled up to n_samples shots. The new shots of a weight draw from a generator
+    keyed by the weight and the shots it already has, so they are independent of the ones of build_table.
+    """
+    entropy = np.random.SeedSequence(seed).entropy
+    table = table.copy()
+    for k in np.flatnonzero(~table["exact"].to_numpy() & (table["shots"].to_numpy() < n_samples)):
+        weight, shots = int(table["weight"].iloc[k]), int(table["shots"].iloc[k])
+        counts = simulate_stream(size, n_samples - shots, [fixed_weight_erasure_channel(weight)], batch_size,
+            np.random.SeedSequence(entropy, spawn_key = (weight, shots)), decoder, code, engine)
+        table.loc[table.index[k], ["shots", "failures"]] = [n_samples, table["failures"].iloc[k] + float(logical_failures(counts))]
+    return table
+
+def exact_failures(size, code, decoder, weight, engine = "batch", batch_size = None):
+    """
+    Sum over the erasure patterns of a weight of their failure probabilities.
+    The X and Z parts of a uniformly random Pauli are independent uniform subsets of the erasure and each is decoded
+    on its own, so a pattern fails with 1 - (1 - a_X)(1 - a_Z), a_X and a_Z the fractions of its 2^weight X and Z parts
+    that end in a logical error. The peeling forest only depends on the erasure and peeling is linear in the syndrome,
+    so the residual of a part is the xor of the residuals of its single qubit errors, and only those are decoded.
+    """
+    geometry = get_toric_geometry(size) if code == "toric" else get_geometry(size)
+    n_qubits = len(geometry.data_qubits)
+    if batch_size is None:
+        batch_size = default_batch_size(size)
+    parts = ((np.arange(2**weight)[:, None] >> np.arange(weight)) & 1).astype(np.uint8)
+    patterns_per_batch = max(1, batch_size//2**weight)
+    pattern_iterator = combinations(range(n_qubits), weight)
+    failures = 0.0
+    while True:
+        patterns = np.array([pattern for _, pattern in zip(range(patterns_per_batch), pattern_iterator)], dtype = np.int64).reshape(-1, weight)
+        if len(patterns) == 0:
+            return failures
+        erased = np.zeros((len(patterns), n_qubits), dtype = bool)
+        erased[np.arange(len(patterns))[:, None], patterns] = True
+        encoding = new_batch_code(size, len(patterns), code, engine)
+        encoding.add_errors(erased, np.zeros_like(erased), np.zeros_like(erased))
+        survived = np.ones(len(patterns))
+        for error_type in ["X", "Z"]:
+            # a pattern that does not span cannot end in a logical error of this type, whatever its Pauli
+            spanning = np.flatnonzero(encoding.erasure_spans_boundaries(error_type)[:len(patterns)])
+            if len(spanning) == 0:
+                continue
+            units = np.repeat(erased[spanning], weight, axis = 0)
+            flips = np.zeros_like(units)
+            flips[np.arange(len(units)), patterns[spanning].ravel()] = True
+            unit_encoding = new_batch_code(size, len(units), code, "batch")
+            unit_encoding.add_errors(units, flips if error_type == "X" else np.zeros_like(flips), flips if error_type == "Z" else np.zeros_like(flips))
+            unit_encoding.measure_syndrome()
+            unit_encoding.erasure_decoder(np.arange(len(units)), None, decoder)
+            residuals = unit_encoding.operations[error_type][:, geometry.data_grid].reshape(len(spanning), weight, n_qubits).astype(np.uint8)
+            residuals = (np.einsum("pw,swq->spq", parts, residuals) % 2).astype(bool).reshape(-1, n_qubits)
+            check = new_batch_code(size, len(residuals), code, engine)
+            check.add_errors(np.zeros_like(residuals), residuals if error_type == "X" else np.zeros_like(residuals),
+                residuals if error_type == "Z" else np.zeros_like(residuals))
+            logical = check.has_logical_error(None, error_type)[:len(residuals)]
+            survived[spanning] *= 1 - logical.reshape(len(spanning), 2**weight).mean(axis = 1)
+        failures += float(np.sum(1 - survived))
+
+def evaluate_table(table, error_range, confidence = 0.95):
+    """
+    Logical error rate of the erasure channel at each physical error rate from a failure table, with the normal interval
+    of the sampled weights (Laplace estimates, pooled above weights without failures as in simulator.simulate_stratified)
+    """
+    n_qubits = int(table["weight"].max())
+    z = NormalDist().inv_cdf(1/2 + confidence/2)
+    shots = table["shots"].to_numpy()
+    rates = table["failures"].to_numpy()/shots
+    sampled = ~table["exact"].to_numpy()
+    spread = np.zeros(len(table))
+    smoothed = smoothed_rates(shots[sampled], table["failures"].to_numpy()[sampled].astype(np.int64))
+    spread[sampled] = smoothed*(1 - smoothed)/shots[sampled]
+    rows = []
+    for phys_error_rate in error_range:
+        pmf = weight_distribution(n_qubits, phys_error_rate)
+        rate = float(pmf @ rates)
+        half_width = z*np.sqrt(pmf**2 @ spread)
+        rows.append((rate, max(0.0, rate - half_width), min(1.0, rate + half_width)))
+    return pd.DataFrame(rows, columns = ["logical_error_rate", "ci_lower", "ci_upper"], index = pd.Index(error_range, name = "physical_error_rate"))
+
+def simulate_tables(size_list, lower_bound, upper_bound, n_points, n_samples, code, decoder = "tree", table_dir = "df/weight_tables",
+        confidence = 0.95, engine = "batch", seed = None, batch_size = None):
+    """
+    The sweep of simulator.simulate from the cached failure tables, building the missing ones with n_samples shots per sampled weight.
+    Adds n_samples (shots of the sampled weights), logical_error_rate, ci_lower and ci_upper columns, without outcome counts.
+    """
+    error_range = np.linspace(lower_bound, upper_bound, n_points)
+    frames = []
+    for size in size_list:
+        table = get_table(size, code, decoder, n_samples, table_dir, engine = engine, seed = seed, batch_size = batch_size)
+        df = evaluate_table(table, error_range, confidence)
+        df.insert(0, "n_samples", int(table["shots"][~table["exact"]].sum()))
+        frames.append(df)
+    # concat keys would split rectangular (rows, columns) sizes into two levels
+    df = pd.concat(frames)
+    df.index = pd.MultiIndex.from_product([size_list, error_range], names = ["size", "physical_error_rate"])
+    df.insert(0, "effective_error_rate", 0.75*df.index.get_level_values("physical_error_rate"))
+    return df